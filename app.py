@@ -1,20 +1,185 @@
-from flask import Flask, request,  jsonify,render_template, session , redirect, url_for
+from flask import Flask, request,  jsonify,render_template, session , redirect, url_for, Response, stream_with_context, g, has_request_context, before_render_template, template_rendered
 from flask_sqlalchemy import SQLAlchemy
-import pandas as pd
+import hmac
+import itertools
 import os
 import json
-from sqlalchemy import inspect
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.local import LocalProxy
+from ingredient_data import read_ingredients_excel, read_aafco_standards, read_aafco_snapshot
+from nutrient_engine import NutrientMatrix, evaluate_recipes, shortfall_weights, validate_recipe
+import columnar_store
+from data_reload import DataGeneration, Reloader
+from optimizer import close_gaps
+from search_index import IngredientSearchIndex
+from http_cache import cached_payload, json_bytes
+from json_provider import OrjsonProvider, dumps_bytes, loads as json_loads, static_json
+from recipe_store import RecipeStore, VersionConflict
+from recipe_delta import apply_changes, changed_fields
+from recipe_search import RecipeSearch
+from whatif import compare_variants
+from feeding_plan import plan_feeding
+from result_cache import ResultCache, recipe_key
+from standards import StandardsProfile, load_profiles
+from instrumentation import metrics, phase, timed, add_phase_time, record_request, start_profile, finish_profile
+
+# ログレベルは環境変数 LOG_LEVEL で指定する (DEBUG にすると受信データなどのデバッグ出力も出す)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+# jsonify / get_json / tojson は orjson で処理する (NumPy の配列もそのまま返せる)
+app.json = OrjsonProvider(app)
+# ベンチマークなどで別の DB を使う場合は環境変数 SQLALCHEMY_DATABASE_URI で指定する
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# ?profile=1 (または X-Profile ヘッダー) でリクエスト単位の cProfile を有効にするか
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+# 栄養素行列を列指向のメモリマップファイル (instance/snapshots/nutrients) から読むか (COLUMNAR_STORE=0 で無効)
+app.config['COLUMNAR_STORE'] = os.environ.get('COLUMNAR_STORE', '1') == '1'
+# 既定の基準値プロファイル (aafco_standards.xlsx のシート名。省略時は最初のシート)
+app.config['STANDARDS_PROFILE'] = os.environ.get('STANDARDS_PROFILE')
+# /admin/reload を使うためのトークン (未設定なら無効)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+# レシピ探索 (/recipes/search) のプロセス数と、1回の探索の時間の上限 (秒)
+app.config['RECIPE_SEARCH_WORKERS'] = int(os.environ.get('RECIPE_SEARCH_WORKERS', os.cpu_count() or 1))
+app.config['RECIPE_SEARCH_MAX_SECONDS'] = float(os.environ.get('RECIPE_SEARCH_MAX_SECONDS', 30))
+# /batch/evaluate で1回に評価できるレシピの数
+app.config['BATCH_MAX_RECIPES'] = int(os.environ.get('BATCH_MAX_RECIPES', 10000))
+# /whatif で1回に評価できる候補の数
+app.config['WHATIF_MAX_VARIANTS'] = int(os.environ.get('WHATIF_MAX_VARIANTS', 1000))
+# /feeding-plan で1回に計画できる犬の数
+app.config['FEEDING_PLAN_MAX_DOGS'] = int(os.environ.get('FEEDING_PLAN_MAX_DOGS', 10000))
+# 元データ (xlsx) の変更を確認する間隔 (秒)。0 なら監視しない
+app.config['DATA_WATCH_INTERVAL'] = float(os.environ.get('DATA_WATCH_INTERVAL', 0))
 
 app.secret_key = 'your_secret_key_here' 
 
 db = SQLAlchemy(app)
 
-# グローバル変数としてAAFCO基準値を定義
-aafco_standards = {}
+# 現在のデータの世代 (栄養素行列・検索インデックス・基準値プロファイル)。
+# 起動時にロードし、再読み込みでは新しい世代を作って丸ごと差し替える
+def current_data():
+    """
+    リクエスト中はリクエストで最初に参照した時点の世代を返す
+    (処理中に再読み込みで差し替えられても、そのリクエストは最後まで同じ世代のデータを使う)
+    """
+    if has_request_context():
+        data = g.get('data')
+        if data is None:
+            data = g.data = reloader.current
+        return data
+    return reloader.current
+
+# グローバル変数としてAAFCO基準値を定義 (既定のプロファイルの最小値)
+aafco_standards = LocalProxy(lambda: current_data().standards)
+
+# 基準値プロファイル (aafco_standards.xlsx のシートごと) と既定のプロファイル
+standards_profiles = LocalProxy(lambda: current_data().profiles)
+default_profile = LocalProxy(lambda: current_data().default_profile)
+
+# 食材テーブル全体を保持する栄養素行列
+nutrient_matrix = LocalProxy(lambda: current_data().matrix)
+
+# 食材名の検索インデックス
+search_index = LocalProxy(lambda: current_data().search_index)
+
+# サーバー側のレシピストア。gunicorn の別ワーカーからも同じレシピを読めるよう、SQLite (既定は instance/recipes.db) にも保存する
+# (RECIPE_STORE_PATH でパスを変更、空文字列でプロセス内のみ)
+os.makedirs(app.instance_path, exist_ok=True)
+recipe_store = RecipeStore(
+    max_entries=int(os.environ.get('RECIPE_STORE_MAX_ENTRIES', 10000)),
+    ttl=int(os.environ.get('RECIPE_STORE_TTL', 86400)),
+    db_path=os.environ.get('RECIPE_STORE_PATH', os.path.join(app.instance_path, 'recipes.db')) or None,
+)
+
+# 同じレシピ (食材とグラム数の組) の計算結果のキャッシュ (データのバージョンが変わると破棄される)
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 4096)),
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 3600)),
+)
+
+# 提案食材を計算するスレッドプール (スレッド数は SUGGESTION_WORKERS、最初の投入時にスレッドを作るので fork 後も安全)
+suggestion_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('SUGGESTION_WORKERS', 4)), thread_name_prefix='suggestion'
+)
+
+# リクエストごとの SQL 実行回数を数える (X-Query-Count ヘッダーで返す)
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+# SQL の実行時間をリクエストの db 時間に加える
+@event.listens_for(Engine, 'after_cursor_execute')
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if has_request_context() and started:
+        add_phase_time('db', time.perf_counter() - started.pop())
+
+# テンプレートの描画時間をリクエストの render 時間に加える
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    if 'render_started' in g:
+        add_phase_time('render', time.perf_counter() - g.pop('render_started'))
+
+@app.before_request
+def refresh_data():
+    # ほかのワーカーが再読み込みした新しい世代があれば取り込む
+    reloader.refresh()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # プロファイルは PROFILING_ENABLED のときだけ、?profile=1 または X-Profile ヘッダーで有効にする
+    profile = request.args.get('profile') or request.headers.get('X-Profile')
+    if profile and app.config['PROFILING_ENABLED']:
+        g.profiler = start_profile()
+        g.profile_output = profile
+
+@app.after_request
+def add_query_count_header(response):
+    response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    # 処理時間と SQL 実行回数をメトリクスに記録する (/metrics 自体は除く)
+    if 'request_started' in g and request.endpoint != 'metrics_endpoint':
+        record_request(
+            request.endpoint or 'unknown',
+            response.status_code,
+            time.perf_counter() - g.request_started,
+            g.get('phase_seconds', {}),
+            g.get('query_count', 0),
+        )
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # プロファイル結果をレスポンスの代わりに返す
+        body, mimetype = finish_profile(profiler, g.profile_output)
+        response = Response(body, mimetype=mimetype)
+        if mimetype == 'application/octet-stream':
+            response.headers['Content-Disposition'] = 'attachment; filename=profile.pstats'
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    # 例外で after_request が呼ばれなかった場合もプロファイラを止める
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        finish_profile(profiler)
 
 # 食材モデルの定義
 class Ingredient(db.Model):
@@ -75,61 +240,81 @@ class Ingredient(db.Model):
         """Ingredientオブジェクトを辞書形式で返す"""
         return {col.name: getattr(self, col.name) for col in self.__table__.columns if col.name not in ['id', 'food_code', 'name']}
 
-# AAFCO基準値をロードする関数
-def load_aafco_standards():
-    aafco_path = os.path.join(os.path.dirname(__file__), 'aafco_standards.xlsx')
-    if not os.path.exists(aafco_path):
-        print("AAFCO基準値のExcelファイルがありません")
-        return {}
-    df = pd.read_excel(aafco_path, engine='openpyxl')
-    return {row["nutrient"]: row["minimum"] for _, row in df.iterrows()}
-
-# 栄養素の合計を計算する関数
-def calculate_totals(selected_list):
-    nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-    for item in selected_list:
-        food_code = item['food_code']
-        grams = item['grams']
-        nutrients = food_database.get(food_code, {})
-        for nutrient, value in nutrients.items():
-            nutrient_totals[nutrient] += value * (grams / 100)
-    return nutrient_totals
+# AAFCO基準値のプロファイルをロードする関数
+def load_standards_profiles(source_hash=None):
+    """
+    aafco_standards.xlsx の各シートを基準値プロファイルとして読み込み、
+    栄養素行列の列にそろえた閾値ベクトルにしておく。
+    source_hash を指定した場合は、現在の xlsx ではなくそのハッシュの xlsx から作ったスナップショットを読み込む
+    """
+    if source_hash:
+        df = read_aafco_snapshot(source_hash)
+    else:
+        aafco_path = os.path.join(os.path.dirname(__file__), 'aafco_standards.xlsx')
+        if not os.path.exists(aafco_path):
+            logger.warning("AAFCO基準値のExcelファイルがありません")
+            return {}
+        df = read_aafco_standards(aafco_path)
+    nutrients = list(nutrient_labels.keys())
+    profiles = load_profiles(df, nutrients)
+    for profile in profiles.values():
+        unknown = [nutrient for nutrient in profile.standards if nutrient not in nutrient_labels]
+        if unknown:
+            logger.warning("プロファイル %s の栄養素 %s は食材データにないため判定しません", profile.name, unknown)
+    return profiles
+
+# 既定の基準値プロファイルを選ぶ関数
+def select_default_profile(profiles):
+    name = app.config['STANDARDS_PROFILE']
+    if name:
+        if name not in profiles:
+            raise ValueError(f"Unknown standards profile: {name}")
+        return profiles[name]
+    if profiles:
+        return next(iter(profiles.values()))
+    return StandardsProfile('default', list(nutrient_labels.keys()), {})
+
+# 名前で基準値プロファイルを返す (省略時は既定のプロファイル、見つからなければ None)
+def get_profile(name=None):
+    if name is None:
+        return current_data().default_profile
+    return current_data().profiles.get(name)
+
+# 食材テーブルを栄養素行列としてロードする関数
+def load_nutrient_matrix():
+    """
+    ingredient テーブル (正のデータ) から栄養素行列を作る。
+    COLUMNAR_STORE が有効なら列指向ストアに書き出し、そのメモリマップのビューを使う。
+    """
+    nutrients = list(nutrient_labels.keys())
+    rows = db.session.query(
+        Ingredient.food_code, Ingredient.name, *[getattr(Ingredient, n) for n in nutrients]
+    ).order_by(Ingredient.food_code).all()
+    matrix = NutrientMatrix.from_rows(rows, nutrients)
+    if app.config['COLUMNAR_STORE']:
+        matrix = columnar_store.persist(matrix)
+    return matrix
 
 # 不足栄養素に基づく提案食材を生成する関数
-def suggest_ingredients_for_deficiencies(deficiencies):
+@timed('suggestion')
+def suggest_ingredients_for_deficiencies(deficiencies, exclude_food_codes=()):
     suggestions = {}
     for nutrient in deficiencies:
-        if hasattr(Ingredient, nutrient):
-            top_items = Ingredient.query.order_by(
-                getattr(Ingredient, nutrient).desc()
-            ).limit(15).all()
-            suggestions[nutrient] = [
-                {
-                    "food_code": item.food_code,
-                    "name": item.name,
-                    "nutrients": {
-                        col.name: getattr(item, col.name)
-                        for col in Ingredient.__table__.columns
-                        if col.name not in ['id', 'name', 'food_code']
-                    },
-                    "value": float(getattr(item, nutrient))
-                }
-                for item in top_items
-            ]
+        if nutrient in nutrient_matrix.column_index:
+            suggestions[nutrient] = nutrient_matrix.top_foods(nutrient, 15, exclude_food_codes)
     return suggestions
 
 # 初期データベースの処理
-def process_excel():
+def process_excel(reload=False):
+    """
+    ingredients.xlsx を ingredient テーブルに一括登録する。
+    food_code をキーにした upsert なので、reload=True で新しい食品成分表をそのまま再登録できる。
+    登録件数と所要時間を返す。
+    """
     excel_path = os.path.join(os.path.dirname(__file__), 'ingredients.xlsx')
     if not os.path.exists(excel_path):
-        print("Excelファイル(ingredients.xlsx)が存在しません")
-        return
-
-    # Excelファイルの読み込み
-    df = pd.read_excel(excel_path, engine='openpyxl')
-
-    # データクレンジング: Tr, N/A, Undefined を 0 に置き換える
-    df = df.replace(['Tr', 'N/A', 'Undefined', None], 0)
+        logger.warning("Excelファイル(ingredients.xlsx)が存在しません")
+        return None
 
     # テーブルが存在しない場合に作成
     inspector = inspect(db.engine)
@@ -137,71 +322,45 @@ def process_excel():
         db.create_all()
 
     # 既存データがある場合はスキップ
-    if Ingredient.query.count() > 0:
-        print("既存のデータがあります。処理をスキップします。")
-        return
-
-    # データベースへの登録
-    for index, row in df.iterrows():
-        ingredient = Ingredient(
-            category=row["食品群"],  # Excelからカテゴリを読み取る
-            food_code=int(row["食品番号"]),
-            name=row["食品名"],
-            ENERC_KCAL=float(row["エネルギー"]),
-            WATER=float(row["水分"]),
-            ILE=float(row["イソロイシン"]),
-            LEU=float(row["ロイシン"]),
-            LYS=float(row["リシン（リジン）"]),
-            MET=float(row["メチオニン"]),
-            CYS=float(row["シスチン"]),
-            PHE=float(row["フェニルアラニン"]),
-            TYR=float(row["チロシン"]),
-            THR=float(row["トレオニン（スレオニン）"]),
-            TRP=float(row["トリプトファン"]),
-            VAL=float(row["バリン"]),
-            HIS=float(row["ヒスチジン"]),
-            ARG=float(row["アルギニン"]),
-            F18D2N6=float(row["リノール酸"]),
-            F18D3N3=float(row["α‐リノレン酸"]),
-            F22D6N3=float(row["ドコサヘキサエン酸"]),
-            NAT=float(row["ナトリウム"]),
-            K=float(row["カリウム"]),
-            CA=float(row["カルシウム"]),
-            MG=float(row["マグネシウム"]),
-            P=float(row["リン"]),
-            FE=float(row["鉄"]),
-            ZN=float(row["亜鉛"]),
-            CU=float(row["銅"]),
-            MN=float(row["マンガン"]),
-            YO=float(row["ヨウ素"]),
-            SE=float(row["セレン"]),
-            CR=float(row["クロム"]),
-            RETOL=float(row["VAレチノール"]),
-            CARTA=float(row["VAα|カロテン"]),
-            CARTB=float(row["VAβ|カロテン"]),
-            CRYPXB=float(row["VＡβ|クリプトキサンチン"]),
-            CARTBEQ=float(row["ＶＡβ|カロテン当量"]),
-            VITA_RAE=float(row["ＶＡレチノール活性当量"]),
-            VITD=float(row["ビタミンD"]),
-            TOCPHA=float(row["VEα|トコフェロール"]),
-            TOCPHB=float(row["VEβ|トコフェロール"]),
-            TOCPHG=float(row["VEγ|トコフェロール"]),
-            TOCPHD=float(row["VEδ|トコフェロール"]),
-            THIA=float(row["ビタミンB1"]),
-            RIBF=float(row["ビタミンB2"]),
-            NIA=float(row["ナイアシン"]),
-            VITB6A=float(row["ビタミンB6"]),
-            VITB12=float(row["ビタミンB12"]),
-            FOL=float(row["葉酸"]),
-            PANTAC=float(row["パントテン酸"]),
-            NACL_EQ=float(row["食塩相当量"]),
-        )
-        try:
-            db.session.add(ingredient)
-            db.session.commit()
-        except Exception as e:
-            print(f"行 {index} でエラーが発生しました: {e}")
-            db.session.rollback()
+    if not reload and Ingredient.query.count() > 0:
+        logger.info("既存のデータがあります。処理をスキップします。")
+        return None
+
+    # Excelファイルの読み込みとデータクレンジング
+    started = time.perf_counter()
+    df = read_ingredients_excel(excel_path)
+    parsed = time.perf_counter()
+
+    # 1トランザクション内で一括 upsert する
+    records = df.to_dict('records')
+    existing = {food_code for (food_code,) in db.session.query(Ingredient.food_code)}
+    stmt = sqlite_insert(Ingredient.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['food_code'],
+        set_={column: stmt.excluded[column] for column in df.columns if column != 'food_code'},
+    )
+    try:
+        db.session.execute(stmt, records)
+        db.session.commit()
+    except Exception as e:
+        logger.exception("食材データの登録でエラーが発生しました: %s", e)
+        db.session.rollback()
+        return None
+    finished = time.perf_counter()
+
+    inserted = sum(1 for record in records if record['food_code'] not in existing)
+    stats = {
+        "rows": len(records),
+        "inserted": inserted,
+        "updated": len(records) - inserted,
+        "parse_seconds": round(parsed - started, 3),
+        "write_seconds": round(finished - parsed, 3),
+    }
+    logger.info(
+        f"食材データを登録しました: {stats['rows']}件 (新規 {stats['inserted']}件, 更新 {stats['updated']}件), "
+        f"読込 {stats['parse_seconds']}秒, 書込 {stats['write_seconds']}秒"
+    )
+    return stats
 
 # nutrient_labels をグローバル変数として定義
 nutrient_labels = {
@@ -256,135 +415,182 @@ nutrient_labels = {
 }
 
 # 共通ユーティリティ関数
+@timed('compute')
 def calculate_nutrients(selected_list):
     """
     栄養素の合計を計算する関数
     """
-    nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-    for item in selected_list:
-        ingredient = Ingredient.query.filter_by(food_code=item['food_code']).first()
-        if ingredient:
-            for nutrient in aafco_standards.keys():
-                value = getattr(ingredient, nutrient, 0) or 0
-                nutrient_totals[nutrient] += value * (item['grams'] / 100)
+    return nutrient_matrix.totals(selected_list, aafco_standards.keys())
+
+# データ (食材と AAFCO基準値) のバージョン
+def data_version():
+    return (
+        nutrient_matrix.version,
+        tuple(aafco_standards.items()),
+        tuple(profile.version for profile in standards_profiles.values()),
+    )
+
+# レシピの合計ベクトル (全栄養素) と合計グラム数 (同じレシピならキャッシュから返す)
+def cached_totals_vector(selected_list):
+    def compute():
+        rows, grams, _, _ = nutrient_matrix.resolve(selected_list)
+        return nutrient_matrix.totals_vector(rows, grams), float(grams.sum())
+
+    return result_cache.get_or_compute(('vector', recipe_key(selected_list)), data_version(), compute)
+
+# レシピを基準値プロファイルで判定する (不足栄養素・上限超過・result_symbols)
+def assess_recipe(selected_list, profile=None):
+    vector, total_grams = cached_totals_vector(selected_list)
+    return (profile or current_data().default_profile).assess(vector, total_grams)
+
+# 栄養素の合計 (同じレシピならキャッシュから返す)
+def cached_nutrient_totals(selected_list):
+    return result_cache.get_or_compute(
+        ('totals', recipe_key(selected_list)), data_version(), lambda: calculate_nutrients(selected_list)
+    )
+
+# 栄養素の合計・不足栄養素・提案食材 (同じレシピならキャッシュから返す)
+def evaluate_recipe(selected_list, profile=None):
+    profile = profile or current_data().default_profile
+
+    def compute():
+        if profile is current_data().default_profile:
+            nutrient_totals = cached_nutrient_totals(selected_list)
         else:
-            print(f"Warning: Ingredient with food_code {item['food_code']} not found")
-    return nutrient_totals
+            nutrient_totals = nutrient_matrix.to_dict(cached_totals_vector(selected_list)[0], profile.standards.keys())
+        deficiencies = assess_recipe(selected_list, profile)["deficiencies"]
+        return nutrient_totals, deficiencies, suggest_ingredients_for_deficiencies(deficiencies)
+
+    return result_cache.get_or_compute(
+        ('evaluation', profile.name, recipe_key(selected_list)), data_version(), compute
+    )
+
+# レシピをサーバー側に保存し、セッション (Cookie) にはレシピIDだけを入れる
+def save_recipe(selected_list):
+    recipe_id = session.get('recipe_id')
+    if not recipe_id:
+        recipe_id = session['recipe_id'] = RecipeStore.new_id()
+    session.pop('selected_list', None)
+    return recipe_store.put(recipe_id, selected_list)
+
+# セッションのレシピIDからレシピを読み込む
+def load_recipe():
+    entry = recipe_store.get(session.get('recipe_id'))
+    if entry is None and 'selected_list' in session:
+        # 以前の形式 (Cookie に selected_list を保存) のセッションを移行する
+        entry = save_recipe(session['selected_list'])
+    return entry
 
 # エンドポイントの定義
 @app.route('/')
 def index():
-    # `index.html` に食材リストを表示
-    ingredients = Ingredient.query.all()
-    return render_template('index.html', ingredients=ingredients)
+    # `index.html` に食材リストを表示 (描画結果はデータのバージョンごとにキャッシュ)
+    payload = cached_payload(
+        'index',
+        nutrient_matrix.version,
+        lambda: render_template('index.html', ingredients=nutrient_matrix.catalog()).encode('utf-8'),
+        mimetype='text/html',
+    )
+    return payload.response()
 
 @app.route('/calculate', methods=['POST'])
 def calculate():
     try:
         # JSON データの取得
         data = request.get_json()
-        print("Received data:", data)
-
-        # selected_list を取得しセッションに保存
-        session['selected_list'] = data.get('selected_list', [])
-        print("Session updated with selected_list:", session['selected_list'])  # デバッグ用
-
-        selected_list = session['selected_list']
-
-
-        # 食材コードリストの作成
-        selected_food_codes = [int(item['food_code']) for item in selected_list]
-        print("Selected food codes:", selected_food_codes)
-
-        # データベースから選択された食材を取得
-        selected_ingredients = Ingredient.query.filter(Ingredient.food_code.in_(selected_food_codes)).all()
-        print("Selected ingredients:", selected_ingredients)
-
-        totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-        total_grams = 0
-        selected_list_tuples = []
-
-        for item in selected_list:
-            food_code = int(item['food_code'])
-            grams = float(item['grams'])
-
-            # 対応する食材を取得
-            ingredient = next((ing for ing in selected_ingredients if ing.food_code == food_code), None)
-            if ingredient:
-                selected_list_tuples.append((food_code, grams, ingredient.name))
-                total_grams += grams
-                for nutrient in aafco_standards.keys():
-                    nutrient_value = getattr(ingredient, nutrient, 0) or 0
-                    totals[nutrient] += nutrient_value * (grams / 100)
-
-        # 不足栄養素を特定
-        deficiencies = [nutrient for nutrient, value in totals.items() if value < aafco_standards.get(nutrient, 0)]
+        logger.debug("Received data: %s", data)
+
+        # selected_list を取得しサーバー側に保存
+        selected_list = save_recipe(data.get('selected_list', [])).selected_list
+        logger.debug("Recipe saved with selected_list: %s", selected_list)
+
+        # 栄養素行列から選択された食材を引き当てる
+        with phase('compute'):
+            rows, grams, found, _ = nutrient_matrix.resolve(selected_list)
+            selected_list_tuples = [
+                (int(item['food_code']), float(item['grams']), nutrient_matrix.names[row])
+                for item, row in zip(found, rows)
+            ]
+            total_grams = float(grams.sum())
 
-        # 提案食材を取得
-        suggestions = suggest_ingredients_for_deficiencies(deficiencies)
+        # 栄養素の合計と不足栄養素だけを計算してすぐに返す
+        # (提案食材はページから /calculate/suggestions でストリーミングで取得する)
+        totals = cached_nutrient_totals(found)
+        assessment = assess_recipe(found)
 
         return render_template(
             'calculate.html',
             totals=totals,
             selected_list=selected_list_tuples,
             total_grams=total_grams,
-            deficiencies=deficiencies,
-            suggestions=suggestions,
-            result_symbols={
-                nutrient: "×" if totals[nutrient] < aafco_standards.get(nutrient, 0) else "○" for nutrient in totals
-            },
+            deficiencies=assessment["deficiencies"],
+            suggestions={},
+            result_symbols=assessment["result_symbols"],
             nutrient_labels=nutrient_labels,
             aafco_standards=aafco_standards
         )
     except Exception as e:
-        print(f"Unhandled Exception in /calculate: {e}")
+        logger.exception("Unhandled Exception in /calculate: %s", e)
         return jsonify({"error": str(e)}), 500
 
-def suggest_best_ingredients(deficiencies):
+@app.route('/calculate/suggestions', methods=['GET'])
+def calculate_suggestions():
     """
-    不足している複数の栄養素を部分的にでも補える食材を提案する
+    セッションのレシピの不足栄養素ごとの提案食材を、スレッドプールで計算できた順にストリーミングで返す。
+    Accept: text/event-stream なら Server-Sent Events、それ以外は NDJSON
+    (1行1栄養素の {"nutrient", "suggestions"} と、最後に {"done": true})。
     """
-    best_suggestions = []
-
-    # すべての食材を取得
-    all_ingredients = Ingredient.query.all()
-
-    for ingredient in all_ingredients:
-        total_score = 0
-        partial_score = 0
-        covered_nutrients = []
-
-        for nutrient in deficiencies:
-            nutrient_value = getattr(ingredient, nutrient, 0) or 0
-            standard_value = aafco_standards.get(nutrient, 0)
+    try:
+        entry = load_recipe()
+        if entry is None:
+            return jsonify({"error": "Recipe not found"}), 404
+
+        # ストリーミング中 (リクエストの外) もリクエストの世代のデータで計算する
+        matrix = current_data().matrix
+        deficiencies = assess_recipe(entry.selected_list)["deficiencies"]
+        futures = {
+            suggestion_pool.submit(matrix.top_foods, nutrient, 15): nutrient
+            for nutrient in deficiencies
+        }
+        sse = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+        def generate():
+            for future in as_completed(futures):
+                event = {"nutrient": futures[future], "suggestions": future.result()}
+                yield b"event: suggestions\ndata: " + dumps_bytes(event) + b"\n\n" if sse else dumps_bytes(event) + b"\n"
+            yield b"event: done\ndata: {}\n\n" if sse else b'{"done":true}\n'
+
+        response = Response(generate(), mimetype='text/event-stream' if sse else 'application/x-ndjson')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
 
-            if standard_value > 0 and nutrient_value > 0:
-                partial_score = min(nutrient_value / standard_value, 1.0)  # カバー率を1.0で最大化
-                total_score += partial_score
-                covered_nutrients.append(nutrient)
+    except Exception as e:
+        logger.exception("Error in GET /calculate/suggestions: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-        # スコアがゼロでない食材を提案候補に追加
-        if total_score > 0:
-            best_suggestions.append({
-                "food_code": ingredient.food_code,
-                "name": ingredient.name,
-                "score": round(total_score, 2),
-                "covered_nutrients": covered_nutrients
-            })
+@timed('suggestion')
+def suggest_best_ingredients(deficiencies, nutrient_totals=None):
+    """
+    不足している複数の栄養素を部分的にでも補える食材を提案する。
+    nutrient_totals を渡した場合は、基準値に対する不足の割合でスコアを重み付けする。
+    """
+    weights = None
+    if nutrient_totals is not None:
+        weights = shortfall_weights(nutrient_totals, aafco_standards, deficiencies)
 
-    # スコア順に並べて上位5つを返す
-    return sorted(best_suggestions, key=lambda x: x['score'], reverse=True)[:5]
+    # キャッシュ済みのカバー率行列でスコアを計算し、上位5つを返す
+    return nutrient_matrix.best_foods(deficiencies, aafco_standards, k=5, weights=weights)
 
 
 # データ処理を行う関数
 def process_adjust(data):
-    print("=== process_adjust関数が呼び出されました ===")  # 確認用ログ
-    print("受け取ったデータ:", data)  # 受け取ったJSONデータを出力
+    logger.debug("process_adjust: %s", data)
     
     # JSONデータから情報を取得
     selected_list = data.get('selected_list', [])
     deficiencies = data.get('deficiencies', [])
-    print("Deficiencies:", deficiencies)
+    logger.debug("Deficiencies: %s", deficiencies)
 
     # `selected_list` の形式を確認し、正しい形式に変換
     if isinstance(selected_list, list) and isinstance(selected_list[0], list):
@@ -392,50 +598,25 @@ def process_adjust(data):
     elif not (isinstance(selected_list, list) and isinstance(selected_list[0], dict)):
         raise ValueError("Invalid format for selected_list")
 
-    print("Processed selected_list:", selected_list)
-
-    # 選択した食材のデータベースオブジェクトを取得
-    selected_food_codes = [item['food_code'] for item in selected_list]
-    selected_ingredients = Ingredient.query.filter(Ingredient.food_code.in_(selected_food_codes)).all()
+    logger.debug("Processed selected_list: %s", selected_list)
 
     # 栄養素の合計を計算
-    nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-    for item in selected_list:
-        food_code = item['food_code']
-        grams = float(item['grams'])
-        ingredient = next((ing for ing in selected_ingredients if ing.food_code == food_code), None)
-        if ingredient:
-            for nutrient in aafco_standards.keys():
-                value = getattr(ingredient, nutrient, 0) or 0
-                nutrient_totals[nutrient] += value * (grams / 100)
+    nutrient_totals = calculate_nutrients(selected_list)
 
     # 不足栄養素に対する提案食材を取得
-    suggestions = {}
-    for nutrient in deficiencies:
-        ingredients = (
-            Ingredient.query.filter(getattr(Ingredient, nutrient, 0) > 0)
-            .order_by(getattr(Ingredient, nutrient).desc())
-            .limit(5)
-            .all()
-        )
-        suggestions[nutrient] = [
-            {
-                "food_code": ing.food_code,
-                "name": ing.name,
-                "value": getattr(ing, nutrient, 0),
-                "nutrients": {n: getattr(ing, n, 0) for n in aafco_standards.keys()},
-            }
-            for ing in ingredients
-        ]
+    suggestions = {
+        nutrient: nutrient_matrix.top_foods(nutrient, 5, positive_only=True)
+        for nutrient in deficiencies
+        if nutrient in nutrient_matrix.column_index
+    }
 
     # 不足栄養素を複数補える提案食材を追加
-    best_suggestions = suggest_best_ingredients(deficiencies)
+    best_suggestions = suggest_best_ingredients(
+        deficiencies, nutrient_totals if data.get('weight_by_shortfall') else None
+    )
 
-    # 適合状況を計算
-    result_symbols = {
-        nutrient: "×" if nutrient_totals.get(nutrient, 0) < aafco_standards.get(nutrient, 0) else "○"
-        for nutrient in aafco_standards
-    }
+    # 適合状況を既定の基準値プロファイルで判定 (最小値・最大値・単位)
+    result_symbols = assess_recipe(selected_list)["result_symbols"]
 
     # JSONレスポンス生成
     return {
@@ -449,17 +630,34 @@ def process_adjust(data):
         "aafco_standards": aafco_standards
     }
 
-def calculate_nutrients(selected_list):
-    nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
+@timed('compute')
+def evaluate_adjust_recipe(selected_list):
+    """
+    /adjust 用にレシピを整形し、栄養素合計・不足栄養素・提案食材を計算する
+    """
+    # 選択されたリストを栄養素行列の食材情報で整形（同じ食材は最初のグラム値を優先）
+    selected_by_row = {}
     for item in selected_list:
-        ingredient = Ingredient.query.filter_by(food_code=item['food_code']).first()
-        if ingredient:
-            for nutrient in aafco_standards.keys():
-                value = getattr(ingredient, nutrient, 0) or 0
-                nutrient_totals[nutrient] += value * (item['grams'] / 100)
-        else:
-            print(f"Warning: Ingredient with food_code {item['food_code']} not found")
-    return nutrient_totals
+        row = nutrient_matrix.row_of(item['food_code'])
+        if row is not None and row not in selected_by_row:
+            selected_by_row[row] = {
+                'food_code': int(nutrient_matrix.food_codes[row]),
+                'grams': item.get('grams', 100),
+                'name': nutrient_matrix.names[row]
+            }
+    selected_list = list(selected_by_row.values())
+
+    # 栄養素合計を計算
+    nutrient_totals = calculate_nutrients(selected_list)
+
+    # 不足栄養素と適合状況を既定の基準値プロファイルで判定
+    rows, grams, _, _ = nutrient_matrix.resolve(selected_list)
+    assessment = default_profile.assess(nutrient_matrix.totals_vector(rows, grams), float(grams.sum()))
+    deficiencies = assessment["deficiencies"]
+
+    # 提案食材を生成
+    suggestions = suggest_ingredients_for_deficiencies(deficiencies)
+    return selected_list, nutrient_totals, deficiencies, suggestions, assessment["result_symbols"]
 
 
 @app.route('/adjust', methods=['GET', 'POST'])
@@ -467,48 +665,25 @@ def adjust():
     # GET処理
     if request.method == 'GET':
         try:
-            # セッションからデータを取得
-            selected_list = session.get('selected_list', [])
-            print("Session selected_list:", selected_list)  # デバッグ用
-
-            # デフォルトの食材リストを設定（セッションにデータがない場合のみ）
-            if not selected_list:
-                default_ingredients = Ingredient.query.limit(3).all()
-                selected_list = [
-                    {'food_code': ing.food_code, 'grams': 100, 'name': ing.name}
-                    for ing in default_ingredients
-                ]
-                session['selected_list'] = selected_list  # 初期データをセッションに保存
-
-            # 選択された食材情報をデータベースから取得
-            selected_food_codes = [item['food_code'] for item in selected_list]
-            ingredients = Ingredient.query.filter(Ingredient.food_code.in_(selected_food_codes)).all()
-
-            # 選択されたリストを整形（セッションのグラム値を優先）
-            selected_list = [
-                {
-                    'food_code': ing.food_code,
-                    'grams': next((item['grams'] for item in selected_list if str(item['food_code']) == str(ing.food_code)), 100),
-                    'name': ing.name
-                }
-                for ing in ingredients
-            ]
-            print("Adjusted selected_list:", selected_list)  # デバッグ用
-
-            # 栄養素合計を計算
-            nutrient_totals = calculate_nutrients(selected_list)
-
-            # 不足栄養素を判定
-            deficiencies = [
-                nutrient for nutrient, total in nutrient_totals.items()
-                if total < aafco_standards.get(nutrient, 0)
-            ]
-
-            # 提案食材を生成
-            suggestions = suggest_ingredients_for_deficiencies(deficiencies)
+            # セッションのレシピIDでサーバー側のレシピを読み込む
+            entry = load_recipe()
+            logger.debug("Recipe selected_list: %s", entry.selected_list if entry else None)
+
+            # デフォルトの食材リストを設定（保存済みのレシピがない場合のみ）
+            if entry is None or not entry.selected_list:
+                entry = save_recipe([
+                    {'food_code': item['food_code'], 'grams': 100, 'name': item['name']}
+                    for item in nutrient_matrix.catalog()[:3]
+                ])
+
+            # 計算結果はレシピと一緒にキャッシュし、レシピもデータも変わっていなければ再計算しない
+            selected_list, nutrient_totals, deficiencies, suggestions, result_symbols = entry.result(
+                data_version(), lambda: evaluate_adjust_recipe(entry.selected_list)
+            )
+            logger.debug("Adjusted selected_list: %s", selected_list)
 
             # 合計グラム数を計算
-            total_grams = sum(item['grams'] for item in selected_list)
+            total_grams = sum(float(item['grams']) for item in selected_list)
 
             # レスポンスデータ生成
             response_data = {
@@ -516,36 +691,160 @@ def adjust():
                 "nutrient_totals": nutrient_totals,
                 "deficiencies": deficiencies,
                 "suggestions": suggestions,
-                "available_ingredients": [
-                    {'food_code': ing.food_code, 'name': ing.name} for ing in Ingredient.query.all()
-                ],
-                "result_symbols": {
-                    nutrient: "×" if nutrient_totals[nutrient] < aafco_standards[nutrient] else "○"
-                    for nutrient in aafco_standards
-                },
+                "available_ingredients": nutrient_matrix.catalog(),
+                "result_symbols": result_symbols,
                 "total_grams": total_grams,  # 合計グラム数を追加
                 "nutrient_labels": nutrient_labels,
-                "aafco_standards": aafco_standards,
+                "profile": default_profile,  # 基準値の表示 (最小値・最大値・単位) 用
+                # 栄養素名の JSON は変わらないので、データのバージョンごとに1回だけシリアライズしたものを埋め込む
+                "nutrient_labels_json": static_json('nutrient_labels', data_version(), lambda: nutrient_labels),
+                "recipe_version": entry.version,  # 差分更新 (/adjust/delta) 用
             }
 
             return render_template('adjust.html', data=response_data)
 
         except Exception as e:
-            print(f"Error in GET /adjust: {e}")
+            logger.exception("Error in GET /adjust: %s", e)
             return render_template('adjust.html', data={})
 
     # POST処理
     if request.method == 'POST':
         try:
-            # POSTリクエストで受信したデータをセッションに保存
+            # POSTリクエストで受信したデータをサーバー側に保存
             data = request.json
-            print("Received POST data:", data)  # デバッグ用
-            session['selected_list'] = data.get('selected_ingredients', [])
-            return jsonify({"message": "Data received successfully"})
+            logger.debug("Received POST data: %s", data)
+            entry = save_recipe(data.get('selected_ingredients', []))
+            return jsonify({"message": "Data received successfully", "version": entry.version})
         except Exception as e:
-            print(f"Error in POST /adjust: {e}")
+            logger.exception("Error in POST /adjust: %s", e)
             return jsonify({"error": str(e)}), 500
 
+@app.route('/adjust/delta', methods=['POST'])
+def adjust_delta():
+    """
+    サーバー側のレシピに食材1件ずつの変更 (グラム数の変更・追加・削除) を差分で適用し、
+    変化した栄養素の合計・判定だけを返すエンドポイント。
+    リクエスト: {"version": n, "changes": [{"op": "set", "food_code": ..., "old_grams": ..., "new_grams": ...}, ...]}
+    version がサーバー側のレシピと一致しない場合は 409 を返すので、クライアントはレシピ全体を送り直す。
+    """
+    try:
+        data = request.json
+        entry = load_recipe()
+        if entry is None:
+            return jsonify({"error": "Recipe not found"}), 404
+        if data.get('version') != entry.version:
+            return jsonify({"error": "Recipe has been updated", "version": entry.version}), 409
+
+        # 差分の基準になる合計ベクトル (保持していなければ、/adjust と同じ整形をしたレシピ全体から計算)
+        if entry.totals is not None and entry.totals[0] == nutrient_matrix.version:
+            selected_list, totals = entry.selected_list, entry.totals[1]
+        else:
+            selected_list = entry.result(data_version(), lambda: evaluate_adjust_recipe(entry.selected_list))[0]
+            rows, grams, _, _ = nutrient_matrix.resolve(selected_list)
+            totals = nutrient_matrix.totals_vector(rows, grams)
+
+        with phase('compute'):
+            grams_before = sum(float(item['grams']) for item in selected_list)
+            selected_list, new_totals, touched = apply_changes(
+                nutrient_matrix, selected_list, totals, data.get('changes', [])
+            )
+            total_grams = sum(float(item['grams']) for item in selected_list)
+        entry = recipe_store.put(
+            session['recipe_id'], selected_list,
+            expected_version=entry.version, totals=(nutrient_matrix.version, new_totals)
+        )
+
+        with phase('compute'):
+            response_data = changed_fields(
+                nutrient_matrix, totals, new_totals, touched, default_profile, grams_before, total_grams
+            )
+        response_data["version"] = entry.version
+        response_data["total_grams"] = total_grams
+        return jsonify(response_data)
+
+    except VersionConflict as e:
+        entry = load_recipe()
+        return jsonify({"error": str(e), "version": entry.version if entry else None}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in /adjust/delta: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/whatif', methods=['POST'])
+def whatif():
+    """
+    基準のレシピに対する多数の変更候補 (食材の置き換え・追加・削除・増減) を一括で評価するエンドポイント。
+    リクエスト: {"selected_list": [...], "variants": [{"id": ..., "changes": [{"op": "swap", ...}, ...]}, ...], "standards": ...}
+    selected_list を省略した場合はセッションのレシピを基準にする。
+    候補ごとの栄養素の増減と、合格に変わった / 不合格に変わった栄養素を、不足を解消した数の多い順に返す。
+    """
+    try:
+        data = request.json or {}
+        selected_list = data.get('selected_list', data.get('selected_ingredients'))
+        if selected_list is None:
+            entry = load_recipe()
+            if entry is None:
+                return jsonify({"error": "Recipe not found"}), 404
+            selected_list = entry.selected_list
+
+        variants = data.get('variants', [])
+        if not isinstance(variants, list):
+            return jsonify({"error": "variants must be a list"}), 400
+        if len(variants) > app.config['WHATIF_MAX_VARIANTS']:
+            return jsonify({"error": f"Too many variants (max {app.config['WHATIF_MAX_VARIANTS']})"}), 400
+
+        profile = get_profile(data.get('standards'))
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {data.get('standards')}"}), 400
+
+        with phase('compute'):
+            result = compare_variants(current_data().matrix, selected_list, variants, profile)
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in POST /whatif: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/feeding-plan', methods=['POST'])
+def feeding_plan():
+    """
+    レシピと犬の名簿から、犬ごとの給与量・栄養素の摂取量と基準値の判定、全頭分の仕込み量を返すエンドポイント。
+    リクエスト: {"selected_list": [...], "dogs": [{"id", "body_weight", "activity_factor", "energy_kcal"}, ...],
+               "days": 1, "standards": ...}
+    selected_list を省略した場合はセッションのレシピを使う。
+    """
+    try:
+        data = request.json or {}
+        selected_list = data.get('selected_list', data.get('selected_ingredients'))
+        if selected_list is None:
+            entry = load_recipe()
+            if entry is None:
+                return jsonify({"error": "Recipe not found"}), 404
+            selected_list = entry.selected_list
+
+        dogs = data.get('dogs', [])
+        if not isinstance(dogs, list):
+            return jsonify({"error": "dogs must be a list"}), 400
+        if len(dogs) > app.config['FEEDING_PLAN_MAX_DOGS']:
+            return jsonify({"error": f"Too many dogs (max {app.config['FEEDING_PLAN_MAX_DOGS']})"}), 400
+
+        profile = get_profile(data.get('standards'))
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {data.get('standards')}"}), 400
+
+        with phase('compute'):
+            result = plan_feeding(current_data().matrix, selected_list, dogs, profile, days=float(data.get('days', 1)))
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in POST /feeding-plan: %s", e)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/calculate-nutrients', methods=['POST'])
 def calculate_nutrients_endpoint():
     """
@@ -557,30 +856,15 @@ def calculate_nutrients_endpoint():
         data = request.json
         selected_ingredients = data.get('selected_ingredients', [])
 
-        # 栄養素の合計を初期化
-        nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-
-        # 各食材について栄養素を計算
-        for item in selected_ingredients:
-            food_code = item.get('food_code')
-            grams = item.get('grams', 0)
-
-            # データベースから該当する食材を取得
-            ingredient = Ingredient.query.filter_by(food_code=food_code).first()
-            if not ingredient:
-                print(f"Warning: Ingredient with food_code {food_code} not found.")
-                continue
-
-            # 栄養素を計算して加算
-            for nutrient in nutrient_totals.keys():
-                value_per_100g = getattr(ingredient, nutrient, 0) or 0
-                nutrient_totals[nutrient] += value_per_100g * (grams / 100)
+        # 栄養素行列で合計を計算し、既定の基準値プロファイルで判定する (同じレシピの結果はキャッシュから)
+        nutrient_totals = cached_nutrient_totals(selected_ingredients)
+        result_symbols = assess_recipe(selected_ingredients)["result_symbols"]
 
         # 計算結果を返す
-        return jsonify({"nutrient_totals": nutrient_totals})
+        return jsonify({"nutrient_totals": nutrient_totals, "result_symbols": result_symbols})
 
     except Exception as e:
-        print(f"Error in /calculate-nutrients: {e}")
+        logger.exception("Error in /calculate-nutrients: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -588,7 +872,7 @@ def calculate_nutrients_endpoint():
 def recalculate():
     try:
         data = request.json
-        print("Received Data for Recalculate:", data)
+        logger.debug("Received Data for Recalculate: %s", data)
 
         selected_list = data.get('selected_ingredients', [])
 
@@ -596,17 +880,13 @@ def recalculate():
         if not all(isinstance(item, dict) and 'food_code' in item and 'grams' in item for item in selected_list):
             raise ValueError("Invalid data format for selected_ingredients")
 
-        # 栄養素の合計を計算
-        nutrient_totals = calculate_totals(selected_list)
-
-        # 不足栄養素の判定
-        deficiencies = [
-            nutrient for nutrient, total in nutrient_totals.items()
-            if total < aafco_standards.get(nutrient, 0)
-        ]
+        # 判定に使う基準値プロファイル (省略時は既定のプロファイル)
+        profile = get_profile(data.get('standards'))
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {data.get('standards')}"}), 400
 
-        # 提案食材の再生成
-        suggestions = suggest_ingredients_for_deficiencies(deficiencies)
+        # 栄養素の合計・不足栄養素・提案食材 (同じレシピの結果はキャッシュから)
+        nutrient_totals, deficiencies, suggestions = evaluate_recipe(selected_list, profile)
 
         return jsonify({
             "nutrient_totals": nutrient_totals,
@@ -615,64 +895,375 @@ def recalculate():
         })
 
     except Exception as e:
-        print(f"Error in POST /recalculate: {e}")
+        logger.exception("Error in POST /recalculate: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/batch/evaluate', methods=['POST'])
+def batch_evaluate():
+    """
+    複数レシピの一括評価エンドポイント。
+    {"recipes": [...], "standards": ...} の JSON、または1行1レシピの NDJSON (プロファイルは ?standards= で指定) を受け取り、
+    レシピごとの合計・不足栄養素・上限超過・result_symbols を NDJSON でストリーミングして返す。
+    レシピは BATCH_MAX_RECIPES 件まで。JSON の場合は形式が正しくないレシピがあれば 400 を返す。
+    NDJSON の場合はストリーミングの開始後に読み込むため、形式が正しくない行は {"id", "error"} の行を返し、
+    件数の上限を超えた場合は {"error"} の行を返して打ち切る。
+    """
+    try:
+        max_recipes = app.config['BATCH_MAX_RECIPES']
+        exceeded = []
+        if request.mimetype == 'application/x-ndjson':
+            profile_name = request.args.get('standards')
+
+            def read_lines():
+                lines = (line for line in request.stream if line.strip())
+                for line in itertools.islice(lines, max_recipes):
+                    try:
+                        yield json_loads(line)
+                    except ValueError as e:
+                        # JSON でない行は validate_recipe でエラーの行にする
+                        yield ValueError(f"invalid JSON: {e}")
+                if next(lines, None) is not None:
+                    exceeded.append(True)
+
+            recipes = read_lines()
+        else:
+            data = request.get_json()
+            profile_name = data.get('standards', request.args.get('standards'))
+            recipes = data.get('recipes', [])
+            if not isinstance(recipes, list):
+                return jsonify({"error": "recipes must be a list"}), 400
+            if len(recipes) > max_recipes:
+                return jsonify({"error": f"Too many recipes (max {max_recipes})"}), 400
+            for i, recipe in enumerate(recipes):
+                try:
+                    validate_recipe(recipe)
+                except ValueError as e:
+                    return jsonify({"error": f"recipe {i}: {e}"}), 400
+
+        profile = get_profile(profile_name)
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {profile_name}"}), 400
+
+        def generate():
+            for result in evaluate_recipes(nutrient_matrix, recipes, profile):
+                yield dumps_bytes(result) + b"\n"
+            if exceeded:
+                yield dumps_bytes({"error": f"Too many recipes (max {max_recipes})"}) + b"\n"
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logger.exception("Error in POST /batch/evaluate: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/standards', methods=['GET'])
+def get_standards():
+    """
+    基準値プロファイルの一覧 (栄養素ごとの最小値・最大値・単位) と既定のプロファイル名を返すエンドポイント
+    """
+    try:
+        return jsonify({
+            "default": default_profile.name,
+            "profiles": [profile.describe() for profile in standards_profiles.values()],
+        })
+    except Exception as e:
+        logger.exception("Error in GET /standards: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/optimize', methods=['POST'])
+def optimize():
+    """
+    不足栄養素を補うための追加グラム数を計算するエンドポイント。
+    候補食材は candidates (food_code のリスト) か suggestions (suggest_ingredients_for_deficiencies の出力) で指定し、
+    どちらも無い場合は現在の不足栄養素に対する提案食材を候補にする。
+    判定には standards で指定した基準値プロファイル (省略時は既定のプロファイル) を使う。
+    """
+    try:
+        data = request.json
+        selected_list = data.get('selected_list', data.get('selected_ingredients', []))
+        profile = get_profile(data.get('standards'))
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {data.get('standards')}"}), 400
+        if any(basis != 'absolute' for basis in profile.bases.values()):
+            return jsonify({"error": "Optimization supports absolute standards only"}), 400
+
+        candidates = data.get('candidates')
+        if candidates is None:
+            suggestions = data.get('suggestions')
+            if suggestions is None:
+                deficiencies = assess_recipe(selected_list, profile)["deficiencies"]
+                suggestions = suggest_ingredients_for_deficiencies(deficiencies)
+            elif not isinstance(suggestions, dict) or not all(
+                isinstance(items, list) and all(isinstance(item, dict) and 'food_code' in item for item in items)
+                for items in suggestions.values()
+            ):
+                return jsonify({"error": "suggestions must map each nutrient to a list of {food_code, ...}"}), 400
+            candidates = [item['food_code'] for items in suggestions.values() for item in items]
+        elif not isinstance(candidates, list):
+            return jsonify({"error": "candidates must be a list of food_code"}), 400
+
+        with phase('compute'):
+            result = close_gaps(nutrient_matrix, selected_list, candidates, profile)
+        return jsonify(result)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in POST /optimize: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/recipes/search', methods=['POST'])
+def search_recipes():
+    """
+    候補食材から min_ingredients〜max_ingredients 種類を選び、合計 max_grams 以下で全栄養素を基準値以上にできる
+    レシピを探索し、見つかった順に NDJSON でストリーミングして返すエンドポイント
+    (探索のシャードの完了を待たず、1 件見つかるごとに 1 行を返す。クライアントが切断したら探索を止める)。
+    リクエスト: {"pool": [food_code, ...], "min_ingredients": 3, "max_ingredients": 5, "max_grams": 1000,
+               "limit": 100, "time_budget": 10, "standards": ...}
+    pool を省略した場合は、基準値のある栄養素ごとの含有量上位10件の食材を候補にする。
+    各行のレシピには基準値プロファイルでの判定 (deficiencies / excesses / result_symbols) が付く。
+    候補のどの食材でも基準値に届かない栄養素は探索の条件から外し、X-Uncoverable-Nutrients ヘッダー (カンマ区切り) で
+    最初に知らせる (その栄養素は見つかったレシピの deficiencies にも入る)。
+    最後の行は {"done": true, ...探索の統計}。
+    """
+    try:
+        data = request.json or {}
+        profile = get_profile(data.get('standards'))
+        if profile is None:
+            return jsonify({"error": f"Unknown standards profile: {data.get('standards')}"}), 400
+        if any(basis != 'absolute' for basis in profile.bases.values()):
+            return jsonify({"error": "Recipe search supports absolute standards only"}), 400
+
+        matrix = current_data().matrix
+        pool = data.get('pool')
+        if pool is None:
+            rows = []
+            for nutrient, minimum in profile.standards.items():
+                if minimum > 0 and nutrient in matrix.column_index:
+                    rows.extend(matrix.top_rows(nutrient, 10, positive_only=True))
+            pool = [int(matrix.food_codes[row]) for row in dict.fromkeys(rows)]
+
+        # 探索時間は (0, RECIPE_SEARCH_MAX_SECONDS] に収める (0・負・NaN・inf で上限を外せないようにする)
+        max_seconds = app.config['RECIPE_SEARCH_MAX_SECONDS']
+        time_budget = float(data.get('time_budget', max_seconds))
+        if not (math.isfinite(time_budget) and time_budget > 0):
+            return jsonify({"error": "time_budget must be a positive number of seconds"}), 400
+        search = RecipeSearch(
+            matrix,
+            pool,
+            profile,
+            min_size=int(data.get('min_ingredients', 3)),
+            max_size=int(data.get('max_ingredients', 5)),
+            max_grams=float(data.get('max_grams', 1000)),
+            max_results=int(data.get('limit', 100)),
+            time_budget=min(time_budget, max_seconds),
+            workers=app.config['RECIPE_SEARCH_WORKERS'],
+        )
+
+        def generate():
+            for recipe in search.run():
+                yield dumps_bytes(recipe) + b"\n"
+            yield dumps_bytes({"done": True, **search.stats}) + b"\n"
+
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.headers['X-Uncoverable-Nutrients'] = ','.join(search.uncoverable)
+        return response
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in POST /recipes/search: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/ingredients', methods=['GET'])
 def get_ingredients():
     """
     全食材リストを取得するエンドポイント。
+    cursor (前のページの next_cursor) と limit でページ分割でき、fields (カンマ区切り) で返す項目を指定できる。
+    パラメータが無い場合は、データのバージョンごとに事前に生成・圧縮した全件のレスポンスを返す。
     """
     try:
-        ingredients = Ingredient.query.all()
-        results = [{"food_code": ing.food_code, "name": ing.name} for ing in ingredients]
-        return jsonify({"ingredients": results})
+        fields = request.args.get('fields')
+        cursor = request.args.get('cursor', type=int)
+        limit = request.args.get('limit', type=int)
+
+        if fields is None and cursor is None and limit is None:
+            payload = cached_payload(
+                'ingredients',
+                nutrient_matrix.version,
+                lambda: json_bytes({"ingredients": nutrient_matrix.catalog()}),
+            )
+            return payload.response()
+
+        fields = fields.split(',') if fields else ['food_code', 'name']
+        unknown = [field for field in fields if field not in ('food_code', 'name') and field not in nutrient_matrix.column_index]
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+        if limit is not None and limit <= 0:
+            return jsonify({"error": "limit must be positive"}), 400
+
+        # ページもデータのバージョンごとにキャッシュする (同じページの2回目以降はシリアライズ・圧縮しない)
+        def build_page():
+            results, next_cursor = nutrient_matrix.page(cursor, limit, fields)
+            return json_bytes({"ingredients": results, "next_cursor": next_cursor})
+
+        payload = cached_payload(('ingredients', cursor, limit, tuple(fields)), nutrient_matrix.version, build_page)
+        return payload.response()
     except Exception as e:
-        print(f"全食材リスト取得エラー: {e}")
+        logger.exception("全食材リスト取得エラー: %s", e)
         return jsonify({"error": str(e)}), 500
 
 # Helper functions
 def calculate_totals(selected_list):
     """選択された食材リストに基づいて栄養素の合計を計算"""
-    print("Calculating totals for:", selected_list)
-    nutrient_totals = {nutrient: 0 for nutrient in aafco_standards.keys()}
-    for item in selected_list:
-        food_code = item.get('food_code')
-        grams = item.get('grams', 0)
-        ingredient = Ingredient.query.filter_by(food_code=food_code).first()
-        if ingredient:
-            for nutrient in aafco_standards.keys():
-                value = getattr(ingredient, nutrient, 0) or 0
-                nutrient_totals[nutrient] += value * (grams / 100)
-        else:
-            print(f"Warning: Ingredient with food_code {food_code} not found")
-    print("Nutrient totals:", nutrient_totals)
+    logger.debug("Calculating totals for: %s", selected_list)
+    nutrient_totals = calculate_nutrients(selected_list)
+    logger.debug("Nutrient totals: %s", nutrient_totals)
     return nutrient_totals
 
 @app.route('/search-ingredients', methods=['GET'])
 def search_ingredients():
     """
     食材検索エンドポイント。
-    クエリ文字列を使用して、食材名を部分一致で検索します。
+    メモリ内の検索インデックスで食材名を部分一致で検索し、関連度順に最大 limit 件 (既定50件) を返します。
+    全角/半角、カタカナ/ひらがなの違いは区別しません。
     """
-    query = request.args.get('query', '').strip().lower()
+    query = request.args.get('query', '').strip()
     if not query:
         return jsonify({"ingredients": []})
 
-    ingredients = Ingredient.query.filter(Ingredient.name.ilike(f"%{query}%")).all()
-    results = [{"food_code": ing.food_code, "name": ing.name} for ing in ingredients]
+    limit = request.args.get('limit', 50, type=int)
+    with phase('compute'):
+        results = search_index.search(query, limit=limit)
     return jsonify({"ingredients": results})
 
 
-if __name__ == '__main__':
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus 形式のメトリクス。
+    エンドポイントごとのリクエスト数・処理時間 (db / compute / suggestion / render の内訳)・SQL 実行回数と、
+    キャッシュの状態を返す。
+    """
+    cache_stats = result_cache.stats()
+    metrics.set('dogfood_result_cache_hits_total', cache_stats['hits'])
+    metrics.set('dogfood_result_cache_misses_total', cache_stats['misses'])
+    metrics.set('dogfood_result_cache_entries', cache_stats['entries'])
+    metrics.set('dogfood_recipe_store_entries', len(recipe_store))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# 元データから新しい世代を作る関数
+def build_data_generation(generation, reimport):
+    """
+    ingredients.xlsx を DB に取り込み (reimport=False なら DB が空の場合だけ)、
+    栄養素行列・検索インデックス・基準値プロファイルを作る。
+    返り値は (世代, マニフェストに書く情報)。
+    """
+    with app.app_context():
+        process_excel(reload=reimport)
+        profiles = load_standards_profiles()
+        matrix = load_nutrient_matrix()
+    store = columnar_store.store_path(matrix.version) if app.config['COLUMNAR_STORE'] else None
+    data = DataGeneration(
+        generation, matrix, IngredientSearchIndex(matrix.food_codes, matrix.names),
+        profiles, select_default_profile(profiles),
+    )
+    return data, {"store": store if store and os.path.isdir(store) else None}
+
+# ほかのワーカーが作った世代を開く関数
+def adopt_data_generation(manifest):
+    """
+    マニフェストの列指向ストアをメモリマップで開き、基準値はマニフェストに記録された
+    aafco_standards.xlsx のハッシュのスナップショットから読み込む (xlsx は解析しない。
+    公開後に xlsx が更新されていても、公開された世代と同じ基準値を使う)。
+    列指向ストアが無い場合は DB から栄養素行列を作る。
+    """
+    if manifest.get("store"):
+        matrix = columnar_store.open_store(manifest["store"])
+    else:
+        with app.app_context():
+            matrix = load_nutrient_matrix()
+    profiles = load_standards_profiles(manifest["sources"].get('aafco_standards.xlsx'))
+    return DataGeneration(
+        manifest["generation"], matrix, IngredientSearchIndex(matrix.food_codes, matrix.names),
+        profiles, select_default_profile(profiles),
+    )
+
+# 世代を差し替えたときの処理
+def on_data_installed(data):
+    # 古い世代の計算結果はもう使われないので破棄する
+    result_cache.clear()
+    metrics.set('dogfood_data_generation', data.generation)
+
+reloader = Reloader(
+    [
+        os.path.join(os.path.dirname(__file__), 'ingredients.xlsx'),
+        os.path.join(os.path.dirname(__file__), 'aafco_standards.xlsx'),
+    ],
+    build_data_generation,
+    adopt_data_generation,
+    on_install=on_data_installed,
+)
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def admin_reload():
+    """
+    ingredients.xlsx / aafco_standards.xlsx をバックグラウンドで読み込み直し、新しいデータの世代に切り替えるエンドポイント。
+    環境変数 ADMIN_TOKEN と同じ値を X-Admin-Token ヘッダーで送った場合だけ使える。
+    GET は現在の世代の情報を返す。POST は ?force=1 で元データが変わっていなくても作り直し、?wait=1 で完了まで待つ。
+    """
+    try:
+        token = app.config['ADMIN_TOKEN']
+        if not token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            return jsonify({"error": "Forbidden"}), 403
+
+        if request.method == 'GET':
+            return jsonify(reloader.status())
+
+        wait = request.args.get('wait') == '1'
+        started = reloader.reload(force=request.args.get('force') == '1', wait=wait)
+        status = reloader.status()
+        status["started"] = started
+        return jsonify(status), 200 if wait else 202
+
+    except Exception as e:
+        logger.exception("Error in /admin/reload: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+# 元データの監視を開始する関数 (gunicorn ではワーカーごとに post_fork から呼ぶ)
+def start_data_watcher():
+    reloader.watch(app.config['DATA_WATCH_INTERVAL'])
+
+
+@app.cli.command('import-ingredients')
+def import_ingredients_command():
+    """ingredients.xlsx を既存データに上書き登録する (flask --app app import-ingredients)"""
+    process_excel(reload=True)
+
+
+def create_app():
+    """
+    DB を初期化し、AAFCO基準値と栄養素行列をロードした Flask アプリを返す。
+    gunicorn の preload_app ではマスタープロセスで一度だけ呼ばれ、
+    ロード済みの配列はワーカー間で copy-on-write で共有される。
+    元データ (xlsx) が前回の起動から変わっていなければ、公開済みの世代をスナップショットから開く。
+    """
     with app.app_context():
         db.create_all()
-        process_excel()  # データベース初期化
-        aafco_standards = load_aafco_standards()
-        print("AAFCO Standards Loaded:", aafco_standards)  # デバッグログ
+        data = reloader.load()
+        logger.debug("AAFCO Standards Loaded: %s", data.standards)
+
+        # fork 前に接続を閉じ、ワーカーが SQLite の接続を共有しないようにする
+        db.engine.dispose()
+    return app
+
+
+if __name__ == '__main__':
+    create_app()
+    start_data_watcher()
 
     # アプリケーションの起動
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
-
-
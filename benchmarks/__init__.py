@@ -0,0 +1,4 @@
+"""
+栄養素計算のベンチマーク。
+リポジトリのルートで `python -m benchmarks.<モジュール名>` として実行する。
+"""
@@ -0,0 +1,121 @@
+"""
+ベンチマーク共通の処理: 合成レシピの生成、統計量の計算、結果の JSON 出力。
+"""
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+
+import numpy as np
+
+from ingredient_data import read_ingredients_excel
+from nutrient_engine import NutrientMatrix
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INGREDIENTS_EXCEL = os.path.join(ROOT, 'ingredients.xlsx')
+
+
+def use_temporary_database():
+    """
+    app を import する前に呼び、ベンチマーク用の一時的な SQLite DB を使うようにする。
+    instance/database.db を書き換えないため。返り値は一時ディレクトリ。
+    """
+    directory = tempfile.mkdtemp(prefix='dogfood-bench-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'database.db')
+    return directory
+
+
+def load_catalog():
+    """実際の ingredients.xlsx から (food_code, name) のリストを読み込む"""
+    df = read_ingredients_excel(INGREDIENTS_EXCEL)
+    return list(zip(df['food_code'].tolist(), df['name'].tolist()))
+
+
+def synthetic_recipes(catalog, count, size, seed=0):
+    """
+    カタログから size 種類の食材をランダムに選んだレシピを count 件生成する。
+    グラム数は 10〜300g (0.1g 単位)。seed が同じなら同じレシピになる。
+    """
+    rng = random.Random(seed)
+    return [
+        [
+            {'food_code': food_code, 'grams': round(rng.uniform(10, 300), 1), 'name': name}
+            for food_code, name in rng.sample(catalog, size)
+        ]
+        for _ in range(count)
+    ]
+
+
+def search_queries(catalog, count, seed=0):
+    """食材名の一部 (1〜4文字) を切り出した検索クエリを count 件生成する"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        name = rng.choice(catalog)[1]
+        length = rng.randint(1, min(4, len(name)))
+        start = rng.randint(0, len(name) - length)
+        queries.append(name[start:start + length])
+    return queries
+
+
+def scaled_matrix(matrix, factor):
+    """栄養素行列を factor 倍の食材数に複製する (食品番号はずらして重複させない)"""
+    if factor == 1:
+        return matrix
+    offset = int(matrix.food_codes.max()) + 1
+    food_codes = np.concatenate([matrix.food_codes + offset * i for i in range(factor)])
+    return NutrientMatrix(food_codes, list(matrix.names) * factor, matrix.nutrients, np.tile(matrix.values, (factor, 1)))
+
+
+def summarize(latencies, elapsed=None):
+    """レイテンシ (秒) のリストから平均・パーセンタイル (ms) とスループットを計算する"""
+    samples = np.array(latencies, dtype=np.float64) * 1000
+    if len(samples) == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    summary = {
+        "count": len(samples),
+        "mean_ms": round(float(samples.mean()), 4),
+        "min_ms": round(float(samples.min()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(samples.max()), 4),
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(len(samples) / elapsed, 2)
+    return summary
+
+
+def environment():
+    """実行環境の情報 (結果を比較するときの参考)"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(path, name, parameters, results):
+    """結果を実行環境・パラメータと一緒に JSON で書き出す (path が None なら標準出力)"""
+    document = {"benchmark": name, "environment": environment(), "parameters": parameters, "results": results}
+    text = json.dumps(document, ensure_ascii=False, indent=2)
+    if path is None:
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"結果を {path} に書き出しました")
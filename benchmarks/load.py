@@ -0,0 +1,162 @@
+"""
+Flask アプリに同時接続でリクエストを送り、エンドポイントごとのレイテンシ (p50/p95/p99) とスループットを計測する。
+
+    python -m benchmarks.load [--url http://127.0.0.1:5000] [--concurrency 1 4 16] [--duration 10] [--output results.json]
+
+--url を省略すると、一時 DB を使ったアプリをこのプロセス内のスレッド型サーバーで起動して計測する。
+gunicorn で起動したアプリを計測する場合は --url を指定する。
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+import urllib.parse
+
+from benchmarks.common import (
+    load_catalog, search_queries, summarize, synthetic_recipes, use_temporary_database, write_results,
+)
+
+
+ENDPOINTS = ['/calculate', '/adjust', '/recalculate', '/calculate-nutrients', '/search-ingredients']
+
+
+class Client:
+    """1つのワーカースレッド用の keep-alive 接続 (セッション Cookie を保持する)"""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.cookie = None
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def request(self, method, path, body=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # 切断された場合は接続し直す
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+
+def make_request(client, endpoint, recipe, query):
+    """endpoint に合成レシピ / 検索クエリで1回リクエストし、ステータスコードを返す"""
+    if endpoint == '/calculate':
+        return client.request('POST', endpoint, {'selected_list': recipe})
+    if endpoint == '/adjust':
+        return client.request('GET', endpoint)
+    if endpoint == '/search-ingredients':
+        return client.request('GET', endpoint + '?' + urllib.parse.urlencode({'query': query}))
+    return client.request('POST', endpoint, {'selected_ingredients': recipe})
+
+
+def run_scenario(url, endpoint, concurrency, duration, recipes, queries, seed):
+    """concurrency 本のスレッドで duration 秒間リクエストを送り続け、結果を集計する"""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        client = Client(url)
+        # /adjust はセッションのレシピを使うので、先にレシピを保存しておく
+        try:
+            client.request('POST', '/calculate', {'selected_list': rng.choice(recipes)})
+        finally:
+            barrier.wait()
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = make_request(client, endpoint, rng.choice(recipes), rng.choice(queries))
+            except (OSError, http.client.HTTPException):
+                status = None
+            latencies[index].append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = [latency for worker_latencies in latencies for latency in worker_latencies]
+    return {"errors": sum(errors), **summarize(samples, elapsed)}
+
+
+@contextlib.contextmanager
+def local_server():
+    """一時 DB を使ったアプリをスレッド型サーバーで起動し、その URL を返す"""
+    directory = use_temporary_database()
+    import app as dogfood
+    from werkzeug.serving import make_server
+
+    devnull = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(devnull):
+        dogfood.create_app()
+    # リクエストごとのアクセスログを出さない
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, dogfood.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        # アプリのデバッグ出力で計測結果が埋もれないようにする
+        with contextlib.redirect_stdout(devnull):
+            yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        devnull.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='計測するアプリの URL (省略時はプロセス内で起動)')
+    parser.add_argument('--endpoints', nargs='+', default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=10, help='1条件あたりの計測時間 (秒)')
+    parser.add_argument('--recipe-size', type=int, default=10, help='合成レシピの食材数')
+    parser.add_argument('--distinct-recipes', type=int, default=1000,
+                        help='合成レシピの種類数 (少ないほど同じレシピが繰り返し送られる)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果の JSON の出力先 (省略時は標準出力)')
+    args = parser.parse_args()
+
+    catalog = load_catalog()
+    recipes = synthetic_recipes(catalog, args.distinct_recipes, args.recipe_size, seed=args.seed)
+    queries = search_queries(catalog, 1000, seed=args.seed)
+
+    results = []
+    with (contextlib.nullcontext(args.url) if args.url else local_server()) as url:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                result = run_scenario(url, endpoint, concurrency, args.duration, recipes, queries, args.seed)
+                results.append({"endpoint": endpoint, "concurrency": concurrency, **result})
+    write_results(args.output, 'load', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+栄養素計算のホットパスのマイクロベンチマーク。
+レシピの食材数・カタログの食材数・不足栄養素の数を変えて
+calculate_totals / suggest_ingredients_for_deficiencies / suggest_best_ingredients / process_excel を計測する。
+
+    python -m benchmarks.micro [--output results.json] [--repeat 200]
+
+一時的な DB を使うので instance/database.db は変更しない。
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import time
+
+from benchmarks.common import (
+    load_catalog, scaled_matrix, summarize, synthetic_recipes, use_temporary_database, write_results,
+)
+
+
+def time_calls(func, args_list, repeat):
+    """args_list の各引数で func を順に呼び、repeat 回分の1回ごとのレイテンシ (秒) を返す"""
+    func(*args_list[0])  # ウォームアップ
+    latencies = []
+    for i in range(repeat):
+        args = args_list[i % len(args_list)]
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_process_excel(dogfood, ingredient_data):
+    """
+    process_excel を 空の DB への登録 / 既存データの更新 × スナップショットなし / ありで計測する
+    """
+    results = []
+    with dogfood.app.app_context():
+        for snapshot in ('cold', 'warm'):
+            for mode in ('insert', 'update'):
+                if snapshot == 'cold':
+                    shutil.rmtree(ingredient_data.SNAPSHOT_DIR, ignore_errors=True)
+                if mode == 'insert':
+                    dogfood.Ingredient.query.delete()
+                    dogfood.db.session.commit()
+                start = time.perf_counter()
+                stats = dogfood.process_excel(reload=True)
+                elapsed = time.perf_counter() - start
+                results.append({
+                    "snapshot": snapshot,
+                    "mode": mode,
+                    "rows": stats["rows"],
+                    "seconds": round(elapsed, 4),
+                    "parse_seconds": stats["parse_seconds"],
+                    "write_seconds": stats["write_seconds"],
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='結果の JSON の出力先 (省略時は標準出力)')
+    parser.add_argument('--repeat', type=int, default=200, help='1条件あたりの計測回数')
+    parser.add_argument('--recipe-sizes', type=int, nargs='+', default=[1, 5, 20, 50])
+    parser.add_argument('--catalog-factors', type=int, nargs='+', default=[1, 4, 16],
+                        help='カタログを何倍の食材数に複製して計測するか')
+    parser.add_argument('--deficiency-counts', type=int, nargs='+', default=[1, 10, 48])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # app の import 前に一時 DB・一時スナップショットに切り替える
+    directory = use_temporary_database()
+    import ingredient_data
+    ingredient_data.SNAPSHOT_DIR = os.path.join(directory, 'snapshots')
+    import app as dogfood
+
+    devnull = open(os.devnull, 'w')
+    with contextlib.redirect_stdout(devnull):
+        dogfood.create_app()
+    catalog = load_catalog()
+    base_matrix = dogfood.nutrient_matrix
+
+    # 基準値が設定されている栄養素から順に不足扱いにする
+    nutrients = sorted(dogfood.nutrient_labels, key=lambda n: dogfood.aafco_standards.get(n, 0) <= 0)
+
+    results = {"calculate_totals": [], "suggest_ingredients_for_deficiencies": [], "suggest_best_ingredients": []}
+    with dogfood.app.app_context(), contextlib.redirect_stdout(devnull):
+        for factor in args.catalog_factors:
+            dogfood.nutrient_matrix = scaled_matrix(base_matrix, factor)
+            catalog_size = len(dogfood.nutrient_matrix)
+
+            for size in args.recipe_sizes:
+                recipes = synthetic_recipes(catalog, 100, size, seed=args.seed)
+                latencies = time_calls(dogfood.calculate_totals, [(recipe,) for recipe in recipes], args.repeat)
+                results["calculate_totals"].append(
+                    {"catalog_size": catalog_size, "recipe_size": size, **summarize(latencies)}
+                )
+
+            for count in args.deficiency_counts:
+                deficiencies = [(nutrients[:count],)]
+                for name in ("suggest_ingredients_for_deficiencies", "suggest_best_ingredients"):
+                    latencies = time_calls(getattr(dogfood, name), deficiencies, args.repeat)
+                    results[name].append(
+                        {"catalog_size": catalog_size, "deficiencies": count, **summarize(latencies)}
+                    )
+        dogfood.nutrient_matrix = base_matrix
+
+        results["process_excel"] = bench_process_excel(dogfood, ingredient_data)
+
+    devnull.close()
+    shutil.rmtree(directory, ignore_errors=True)
+    write_results(args.output, 'micro', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
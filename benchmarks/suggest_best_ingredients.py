@@ -0,0 +1,65 @@
+"""
+suggest_best_ingredients の旧実装 (全食材 × 不足栄養素の Python ループ) と
+カバー率行列による新実装のレイテンシを比較する。
+
+    python -m benchmarks.suggest_best_ingredients
+"""
+import time
+
+import app as dogfood
+
+
+def legacy_suggest_best_ingredients(deficiencies):
+    """旧実装: Ingredient.query.all() と二重ループでスコアを計算する"""
+    best_suggestions = []
+    for ingredient in dogfood.Ingredient.query.all():
+        total_score = 0
+        covered_nutrients = []
+        for nutrient in deficiencies:
+            nutrient_value = getattr(ingredient, nutrient, 0) or 0
+            standard_value = dogfood.aafco_standards.get(nutrient, 0)
+            if standard_value > 0 and nutrient_value > 0:
+                total_score += min(nutrient_value / standard_value, 1.0)
+                covered_nutrients.append(nutrient)
+        if total_score > 0:
+            best_suggestions.append({
+                "food_code": ingredient.food_code,
+                "name": ingredient.name,
+                "score": round(total_score, 2),
+                "covered_nutrients": covered_nutrients
+            })
+    return sorted(best_suggestions, key=lambda x: x['score'], reverse=True)[:5]
+
+
+def measure(func, deficiencies, repeat):
+    """func(deficiencies) を repeat 回実行し、1回あたりの平均時間 (ms) を返す"""
+    func(deficiencies)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(deficiencies)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    with dogfood.app.app_context():
+        dogfood.standards_profiles = dogfood.load_standards_profiles()
+        dogfood.default_profile = dogfood.select_default_profile(dogfood.standards_profiles)
+        dogfood.aafco_standards = dogfood.default_profile.standards
+        dogfood.nutrient_matrix = dogfood.load_nutrient_matrix()
+
+        # 基準値が設定されている栄養素から順に不足扱いにする
+        nutrients = sorted(dogfood.nutrient_labels, key=lambda n: dogfood.aafco_standards.get(n, 0) <= 0)
+        print(f"{'deficiencies':>12} {'legacy (ms)':>12} {'vectorized (ms)':>16} {'speedup':>8}")
+        for count in (1, 10, len(nutrients)):
+            deficiencies = nutrients[:count]
+            legacy_scores = [x['score'] for x in legacy_suggest_best_ingredients(deficiencies)]
+            new_scores = [x['score'] for x in dogfood.suggest_best_ingredients(deficiencies)]
+            assert legacy_scores == new_scores, (legacy_scores, new_scores)
+
+            legacy = measure(legacy_suggest_best_ingredients, deficiencies, repeat=3)
+            vectorized = measure(dogfood.suggest_best_ingredients, deficiencies, repeat=200)
+            print(f"{count:>12} {legacy:>12.2f} {vectorized:>16.3f} {legacy / vectorized:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""
+CSV / Excel / JSONL のレシピを一括評価し、栄養素の合計・result_symbols・提案食材を書き出す。
+Flask・SQLAlchemy は使わず、栄養素行列は列指向ストアかスナップショットから読み込む。
+
+    python bulk_evaluate.py recipes.csv -o results.csv
+    python bulk_evaluate.py recipes.xlsx -o results.parquet [--profile 成犬維持] [--workers 8]
+    python bulk_evaluate.py recipes.jsonl > results.jsonl
+
+入力の形式 (拡張子で判定。標準入力 "-" の場合は --input-format で指定する):
+  csv / xlsx  1行1食材で recipe_id (または id), food_code, grams の列を持つ表。
+              recipe_id が同じ連続した行を1つのレシピとする
+  jsonl       1行1レシピで /batch/evaluate と同じ形式
+              ({"id", "selected_list": [{"food_code", "grams"}, ...]} または食材のリスト)
+
+出力の形式 (拡張子で判定。標準出力の場合は jsonl):
+  jsonl       /batch/evaluate の結果に suggestions を加えたもの
+  csv         1行1レシピ。栄養素ごとの合計と判定 (<栄養素>_result) の列を持ち、
+              deficiencies / excesses / missing_food_codes は ";" 区切り、suggestions は JSON
+  parquet     csv と同じ列 (リストの列はリスト型)。pyarrow が必要
+"""
+import argparse
+import collections
+import csv
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import orjson
+
+import columnar_store
+import data_reload
+import ingredient_data
+from nutrient_engine import NutrientMatrix, evaluate_recipes, significant, validate_recipe
+from standards import StandardsProfile, load_profiles
+
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+INGREDIENTS_EXCEL = os.path.join(ROOT, 'ingredients.xlsx')
+AAFCO_EXCEL = os.path.join(ROOT, 'aafco_standards.xlsx')
+
+INPUT_FORMATS = ('csv', 'xlsx', 'jsonl')
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet')
+_EXTENSIONS = {'.csv': 'csv', '.xlsx': 'xlsx', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.parquet': 'parquet'}
+
+
+def load_matrix(store=None):
+    """
+    栄養素行列を読み込む。
+    store を指定した場合はその列指向ストアを開く。省略した場合は、サーバーが公開中の世代の列指向ストアを
+    (ingredients.xlsx がその世代から変わっていなければ) 開き、無ければ ingredients.xlsx のスナップショットから作る。
+    どちらも openpyxl は使わない (スナップショットが無い初回だけ xlsx を解析する)。
+    """
+    if store:
+        return columnar_store.open_store(store)
+
+    manifest = data_reload.read_manifest()
+    if manifest and manifest.get("store") and os.path.isdir(manifest["store"]):
+        sources = manifest.get("sources", {})
+        if sources.get(os.path.basename(INGREDIENTS_EXCEL)) == ingredient_data.file_hash(INGREDIENTS_EXCEL):
+            return columnar_store.open_store(manifest["store"])
+
+    nutrients = ingredient_data.NUTRIENT_COLUMNS
+    df = ingredient_data.read_ingredients_excel(INGREDIENTS_EXCEL).sort_values('food_code')
+    return NutrientMatrix(df['food_code'].to_numpy(), df['name'].tolist(), nutrients, df[nutrients].to_numpy())
+
+
+def load_profile(nutrients, name=None):
+    """
+    基準値プロファイルを読み込む (aafco_standards.xlsx のスナップショットから)。
+    name を省略した場合は環境変数 STANDARDS_PROFILE、それも無ければ最初のシートのプロファイル。
+    """
+    profiles = {}
+    if os.path.exists(AAFCO_EXCEL):
+        profiles = load_profiles(ingredient_data.read_aafco_standards(AAFCO_EXCEL), nutrients)
+    name = name or os.environ.get('STANDARDS_PROFILE')
+    if name:
+        if name not in profiles:
+            raise ValueError(f"Unknown standards profile: {name}")
+        return profiles[name]
+    if profiles:
+        return next(iter(profiles.values()))
+    return StandardsProfile('default', nutrients, {})
+
+
+def _table_recipes(rows, source):
+    """
+    1行1食材の表 (最初の行は見出し) を、recipe_id が同じ連続した行ごとのレシピ {"id", "selected_list"} にする
+    """
+    rows = iter(rows)
+    header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+    id_column = 'recipe_id' if 'recipe_id' in header else 'id'
+    for column in (id_column, 'food_code', 'grams'):
+        if column not in header:
+            raise ValueError(f"{source}: column '{column}' is required")
+    id_index, code_index, grams_index = (header.index(column) for column in (id_column, 'food_code', 'grams'))
+
+    def items():
+        for line, row in enumerate(rows, start=2):
+            if not row or all(cell is None or cell == '' for cell in row):
+                continue
+            try:
+                item = {"food_code": int(float(row[code_index])), "grams": float(row[grams_index])}
+            except (IndexError, TypeError, ValueError):
+                raise ValueError(f"{source}:{line}: invalid food_code or grams") from None
+            yield row[id_index], item
+
+    for recipe_id, group in itertools.groupby(items(), key=lambda pair: pair[0]):
+        yield {"id": recipe_id, "selected_list": [item for _, item in group]}
+
+
+def read_recipes(path, input_format, sheet=None):
+    """入力ファイルのレシピを1件ずつ読み込むジェネレータ (ファイル全体は読み込まない)"""
+    if input_format == 'jsonl':
+        with (open(path, 'rb') if path != '-' else sys.stdin.buffer) as f:
+            index = 0
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    recipe = orjson.loads(text)
+                    validate_recipe(recipe)
+                except ValueError as e:
+                    raise ValueError(f"{path}:{line}: {e}") from None
+                # /batch/evaluate と同じく、id が無いレシピは入力の順番を id にする
+                if isinstance(recipe, dict):
+                    items = recipe.get('selected_list', recipe.get('selected_ingredients', []))
+                    recipe = {"id": recipe.get('id', index), "selected_list": items}
+                else:
+                    recipe = {"id": index, "selected_list": recipe}
+                index += 1
+                yield recipe
+
+    elif input_format == 'csv':
+        # Excel で保存した CSV の BOM は読み飛ばす
+        with (open(path, newline='', encoding='utf-8-sig') if path != '-' else sys.stdin) as f:
+            yield from _table_recipes(csv.reader(f), path)
+
+    elif input_format == 'xlsx':
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+            yield from _table_recipes(worksheet.iter_rows(values_only=True), path)
+        finally:
+            workbook.close()
+
+    else:
+        raise ValueError(f"Unknown input format: {input_format}")
+
+
+def output_columns(nutrients):
+    """csv / parquet の列"""
+    return [
+        "id", "total_grams", *nutrients, *[f"{nutrient}_result" for nutrient in nutrients],
+        "deficiencies", "excesses", "suggestions", "missing_food_codes",
+    ]
+
+
+# ワーカープロセスの評価に使うデータ (_init_worker で設定する)
+_state = {}
+
+# 提案食材の候補として、栄養素ごとに上位 (提案数 + _EXTRA_CANDIDATES) 件を保持する
+_EXTRA_CANDIDATES = 32
+
+
+def _init_worker(matrix, profile, suggestions, output_format):
+    _state.update(matrix=matrix, profile=profile, suggestions=suggestions, output_format=output_format,
+                  top={})
+
+
+def _suggestion(matrix, row, nutrient):
+    return {
+        "food_code": int(matrix.food_codes[row]),
+        "name": matrix.names[row],
+        "value": significant(matrix.values[row, matrix.column_index[nutrient]]),
+    }
+
+
+def _suggestions(deficiencies, recipe):
+    """
+    不足栄養素ごとに、含有量が多い上位の食材 (レシピにある食材を除く) を {food_code, name, value} で返す。
+    栄養素ごとの上位の候補は一度だけ作り、ワーカー内のレシピで使い回す。
+    """
+    matrix = _state["matrix"]
+    k = _state["suggestions"]
+    if not k or not deficiencies:
+        return {}
+    # food_code が文字列で書かれたレシピもあるので、レシピの食材は行番号で比べる
+    recipe_rows = {matrix.row_of(item.get('food_code')) for item in recipe["selected_list"]}
+    size = k + _EXTRA_CANDIDATES
+    suggestions = {}
+    for nutrient in deficiencies:
+        candidates = _state["top"].get(nutrient)
+        if candidates is None:
+            candidates = [
+                (row, _suggestion(matrix, row, nutrient))
+                for row in matrix.top_rows(nutrient, size, positive_only=True)
+            ]
+            _state["top"][nutrient] = candidates
+        chosen = list(itertools.islice((food for row, food in candidates if row not in recipe_rows), k))
+        if len(chosen) < k and len(candidates) == size:
+            # レシピの食材が上位の候補の大半を占める場合だけ、ランキングから引き直す
+            exclude = [item.get('food_code') for item in recipe["selected_list"]]
+            chosen = [
+                _suggestion(matrix, row, nutrient)
+                for row in matrix.top_rows(nutrient, k, exclude, positive_only=True)
+            ]
+        suggestions[nutrient] = chosen
+    return suggestions
+
+
+def _encode(results, nutrients, output_format):
+    """1チャンク分の結果を出力の形式にする (jsonl / csv はバイト列、parquet は列ごとのリスト)"""
+    if output_format == 'jsonl':
+        return b''.join(orjson.dumps(result) + b'\n' for result in results)
+
+    rows = [
+        [
+            result["id"], result["total_grams"],
+            *(result["nutrient_totals"][nutrient] for nutrient in nutrients),
+            *(result["result_symbols"][nutrient] for nutrient in nutrients),
+            result["deficiencies"], result["excesses"],
+            orjson.dumps(result["suggestions"]).decode('utf-8'), result["missing_food_codes"],
+        ]
+        for result in results
+    ]
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for row in rows:
+            deficiencies, excesses, suggestions, missing = row[-4:]
+            row[-4:] = [';'.join(deficiencies), ';'.join(excesses), suggestions, ';'.join(map(str, missing))]
+            writer.writerow(row)
+        return buffer.getvalue().encode('utf-8')
+
+    columns = output_columns(nutrients)
+    data = {column: list(values) for column, values in zip(columns, zip(*rows))} if rows else \
+        {column: [] for column in columns}
+    data["id"] = [str(value) for value in data["id"]]
+    data["missing_food_codes"] = [[str(code) for code in codes] for codes in data["missing_food_codes"]]
+    return data
+
+
+def _evaluate_chunk(chunk):
+    """1チャンクのレシピを評価し、(出力, レシピ数, 基準を満たしたレシピ数) を返す"""
+    matrix = _state["matrix"]
+    profile = _state["profile"]
+    results = []
+    passing = 0
+    for recipe, result in zip(chunk, evaluate_recipes(matrix, chunk, profile, chunk_size=len(chunk))):
+        result["suggestions"] = _suggestions(result["deficiencies"], recipe)
+        if not result["deficiencies"] and not result["excesses"]:
+            passing += 1
+        results.append(result)
+    return _encode(results, profile.column_nutrients, _state["output_format"]), len(results), passing
+
+
+def _chunks(recipes, chunk_size):
+    recipes = iter(recipes)
+    return iter(lambda: list(itertools.islice(recipes, chunk_size)), [])
+
+
+def evaluate_file(recipes, matrix, profile, output_format, suggestions=3, chunk_size=512, workers=None):
+    """
+    レシピを chunk_size 件ずつ評価し、チャンクごとの (出力, レシピ数, 基準を満たしたレシピ数) を入力の順に返すジェネレータ。
+    workers が2以上ならチャンクをプロセスプールで並列に評価する (出力の形式への変換もワーカーで行う)。
+    実行中のチャンクは workers の2倍までにするので、入力の件数に関わらずメモリ使用量は一定。
+    """
+    workers = workers or os.cpu_count() or 1
+    initargs = (matrix, profile, suggestions, output_format)
+    if workers == 1:
+        _init_worker(*initargs)
+        for chunk in _chunks(recipes, chunk_size):
+            yield _evaluate_chunk(chunk)
+        return
+
+    # 対話的に使うコマンドでスレッドは無いので、fork できる環境では fork して栄養素行列をコピーせずに共有する
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+                             initializer=_init_worker, initargs=initargs) as executor:
+        pending = collections.deque()
+        try:
+            for chunk in _chunks(recipes, chunk_size):
+                pending.append(executor.submit(_evaluate_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _format_of(path, option, formats, default=None):
+    """--input-format / --format の指定、またはファイルの拡張子から形式を決める"""
+    if option:
+        return option
+    output_format = _EXTENSIONS.get(os.path.splitext(path)[1].lower()) if path != '-' else None
+    if output_format in formats:
+        return output_format
+    if default:
+        return default
+    raise ValueError(f"Cannot determine the format of {path}. Specify it with --input-format / --format")
+
+
+def write_output(path, output_format, nutrients, chunks):
+    """チャンクごとの出力を書き出し、(レシピ数, 基準を満たしたレシピ数) を返す"""
+    count = passing = 0
+    if output_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet output requires pyarrow (pip install pyarrow)") from None
+        if path == '-':
+            raise ValueError("Parquet output cannot be written to stdout")
+        schema = pa.schema([
+            ("id", pa.string()), ("total_grams", pa.float64()),
+            *[(nutrient, pa.float64()) for nutrient in nutrients],
+            *[(f"{nutrient}_result", pa.string()) for nutrient in nutrients],
+            ("deficiencies", pa.list_(pa.string())), ("excesses", pa.list_(pa.string())),
+            ("suggestions", pa.string()), ("missing_food_codes", pa.list_(pa.string())),
+        ])
+        with pq.ParquetWriter(path, schema) as writer:
+            for data, chunk_count, chunk_passing in chunks:
+                writer.write_table(pa.Table.from_pydict(data, schema=schema))
+                count += chunk_count
+                passing += chunk_passing
+        return count, passing
+
+    with (open(path, 'wb') if path != '-' else sys.stdout.buffer) as f:
+        if output_format == 'csv':
+            # Excel で文字化けしないよう BOM を付ける
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator='\n').writerow(output_columns(nutrients))
+            f.write(buffer.getvalue().encode('utf-8-sig'))
+        for data, chunk_count, chunk_passing in chunks:
+            f.write(data)
+            count += chunk_count
+            passing += chunk_passing
+    return count, passing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='レシピのファイル ("-" で標準入力)')
+    parser.add_argument('-o', '--output', default='-', help='結果の出力先 (省略時は標準出力)')
+    parser.add_argument('--input-format', choices=INPUT_FORMATS)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help='出力の形式')
+    parser.add_argument('--sheet', help='xlsx のシート名 (省略時は最初のシート)')
+    parser.add_argument('--profile', help='基準値プロファイル (省略時は STANDARDS_PROFILE または最初のシート)')
+    parser.add_argument('--store', help='栄養素行列の列指向ストアのパス (省略時は公開中の世代かスナップショット)')
+    parser.add_argument('--suggestions', type=int, default=3, help='不足栄養素ごとの提案食材の数 (0 で出力しない)')
+    parser.add_argument('--chunk-size', type=int, default=512, help='まとめて評価するレシピ数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='評価するプロセス数')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    started = time.perf_counter()
+    try:
+        input_format = _format_of(args.input, args.input_format, INPUT_FORMATS)
+        output_format = _format_of(args.output, args.format, OUTPUT_FORMATS, default='jsonl')
+        if args.chunk_size <= 0 or (args.workers is not None and args.workers <= 0):
+            raise ValueError("--chunk-size and --workers must be positive")
+
+        matrix = load_matrix(args.store)
+        profile = load_profile(matrix.nutrients, args.profile)
+        chunks = evaluate_file(
+            read_recipes(args.input, input_format, args.sheet), matrix, profile, output_format,
+            suggestions=args.suggestions, chunk_size=args.chunk_size, workers=args.workers,
+        )
+        count, passing = write_output(args.output, output_format, profile.column_nutrients, chunks)
+    except (OSError, ValueError, KeyError) as e:
+        parser.exit(1, f"error: {e}\n")
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{count} recipes ({passing} meeting {profile.name}) in {elapsed:.2f}s "
+        f"({count / elapsed if elapsed else 0:.0f} recipes/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == '__main__':
+    main()
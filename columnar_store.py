@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import ingredient_data
+from data_reload import read_manifest
+from nutrient_engine import NutrientMatrix
+
+
+logger = logging.getLogger(__name__)
+
+_PREFIX = 'nutrients-'
+
+
+def store_dir():
+    """列指向ストアの保存先 (スナップショットと同じ instance/snapshots の下)"""
+    return os.path.join(ingredient_data.SNAPSHOT_DIR, 'nutrients')
+
+
+def store_path(version, directory=None):
+    """バージョン version のストアのパス"""
+    return os.path.join(directory or store_dir(), _PREFIX + version)
+
+
+def write_store(matrix, directory=None):
+    """
+    栄養素行列を列指向のファイル群に書き出し、そのパスを返す。
+
+    - values.npy: 食材 × 栄養素の float32 (Fortran 順。栄養素ごとに全食材の値が連続して並ぶ)
+    - ranking.npy: 栄養素ごとの降順ランキング (int32, Fortran 順)
+    - food_codes.npy: 食品番号 (int64)
+    - meta.json: バージョン・栄養素名・食材名
+
+    ディレクトリ名にバージョンを含めるので、同じ内容なら書き直さない。
+    """
+    directory = directory or store_dir()
+    path = store_path(matrix.version, directory)
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return path
+    os.makedirs(directory, exist_ok=True)
+
+    # 書きかけのストアを読まれないよう、一時ディレクトリに書いてから名前を変える
+    staging = tempfile.mkdtemp(dir=directory, prefix='.staging-')
+    try:
+        np.save(os.path.join(staging, 'values.npy'), np.asfortranarray(matrix.values, dtype=np.float32))
+        np.save(os.path.join(staging, 'ranking.npy'), np.asfortranarray(matrix.ranking, dtype=np.int32))
+        np.save(os.path.join(staging, 'food_codes.npy'), matrix.food_codes)
+        with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({"version": matrix.version, "nutrients": matrix.nutrients, "names": matrix.names}, f,
+                      ensure_ascii=False)
+        os.rename(staging, path)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        # 別のプロセスが先に同じストアを書き終えていればそれを使う
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            raise
+
+    remove_old_stores(path, directory)
+    return path
+
+
+def remove_old_stores(path, directory=None):
+    """
+    path 以外の古いストアを削除する。ただし直前の世代のストア (path 以外で最も新しいもの) と、
+    公開中のマニフェストが参照しているストアは残す
+    (まだ新しい世代を取り込んでいないワーカーが、マニフェストを読んでから開くことがあるため)。
+    開いているプロセスのメモリマップは、削除されてもそのまま使える。
+    """
+    directory = directory or store_dir()
+    stores = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(_PREFIX) and name != os.path.basename(path)
+    ]
+    if not stores:
+        return
+    keep = {max(stores, key=os.path.getmtime)}
+    manifest = read_manifest(os.path.dirname(os.path.abspath(directory)))
+    if manifest is not None and manifest.get("store"):
+        keep.add(os.path.abspath(manifest["store"]))
+    for store in stores:
+        if store not in keep and os.path.abspath(store) not in keep:
+            shutil.rmtree(store, ignore_errors=True)
+
+
+def open_store(path):
+    """
+    列指向ストアを読み込み専用のメモリマップで開き、NutrientMatrix を返す。
+    配列はコピーされないので、同じファイルを開いたワーカー間でページキャッシュを共有する。
+    """
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    return NutrientMatrix(
+        np.load(os.path.join(path, 'food_codes.npy'), mmap_mode='r'),
+        meta["names"],
+        meta["nutrients"],
+        np.load(os.path.join(path, 'values.npy'), mmap_mode='r'),
+        ranking=np.load(os.path.join(path, 'ranking.npy'), mmap_mode='r'),
+        version=meta["version"],
+    )
+
+
+def latest_store(directory=None):
+    """保存先にある最新のストアのパスを返す (無ければ None)"""
+    directory = directory or store_dir()
+    if not os.path.isdir(directory):
+        return None
+    paths = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(_PREFIX) and os.path.exists(os.path.join(directory, name, 'meta.json'))
+    ]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def persist(matrix, directory=None):
+    """
+    matrix を列指向ストアに書き出し、メモリマップで開き直した NutrientMatrix を返す。
+    書き出せない場合 (読み込み専用のファイルシステムなど) は matrix をそのまま返す。
+    """
+    try:
+        return open_store(write_store(matrix, directory))
+    except (OSError, ValueError) as e:
+        logger.warning("列指向ストアを使えないため、メモリ上の栄養素行列を使います: %s", e)
+        return matrix
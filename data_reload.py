@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows では同じプロセス内の排他だけにする
+    fcntl = None
+
+import ingredient_data
+
+
+logger = logging.getLogger(__name__)
+
+_MANIFEST = 'generation.json'
+_LOCK = 'reload.lock'
+
+
+# データの世代
+class DataGeneration:
+    """
+    1回の読み込みで作った栄養素行列・検索インデックス・基準値プロファイルの組。
+    作成後は変更せず、再読み込みでは新しい世代を作って丸ごと差し替える。
+    """
+
+    __slots__ = ('generation', 'matrix', 'search_index', 'profiles', 'default_profile', 'loaded_at')
+
+    def __init__(self, generation, matrix, search_index, profiles, default_profile):
+        self.generation = generation
+        self.matrix = matrix
+        self.search_index = search_index
+        self.profiles = profiles
+        self.default_profile = default_profile
+        self.loaded_at = time.time()
+
+    @property
+    def standards(self):
+        """既定のプロファイルの最小値 {栄養素: 基準値}"""
+        return self.default_profile.standards
+
+    def describe(self):
+        return {
+            "generation": self.generation,
+            "matrix_version": self.matrix.version,
+            "ingredients": len(self.matrix),
+            "profiles": list(self.profiles),
+            "default_profile": self.default_profile.name,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def source_hashes(paths):
+    """元データのファイルごとの SHA-256 (ファイルが無ければ None)"""
+    return {
+        os.path.basename(path): ingredient_data.file_hash(path) if os.path.exists(path) else None
+        for path in paths
+    }
+
+
+def read_manifest(directory=None):
+    """公開されている最新の世代の情報を返す (無ければ None)"""
+    path = os.path.join(directory or ingredient_data.SNAPSHOT_DIR, _MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(manifest, directory=None):
+    """世代の情報を書きかけのファイルを読まれないように置き換える"""
+    directory = directory or ingredient_data.SNAPSHOT_DIR
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.json', delete=False, encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(f.name, os.path.join(directory, _MANIFEST))
+
+
+@contextmanager
+def exclusive(directory=None):
+    """再読み込みをプロセス間 (gunicorn のワーカー間) で1つずつ実行するためのファイルロック"""
+    directory = directory or ingredient_data.SNAPSHOT_DIR
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, _LOCK), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# データの再読み込み
+class Reloader:
+    """
+    元データ (xlsx) から新しい世代を作って差し替える。
+
+    - build(generation, reimport) は元データから DataGeneration を作り、(世代, マニフェストに書く情報) を返す
+      (reimport が True なら ingredients.xlsx を DB に取り込み直す)
+    - adopt(manifest) は別のプロセスが公開した世代を共有のスナップショット・列指向ストアから開く
+      (xlsx は解析しない)
+    - on_install(generation) は差し替えのたびに呼ばれる
+
+    作った世代はスナップショットのディレクトリの generation.json (マニフェスト) で公開し、
+    ほかのワーカーは refresh() でマニフェストの更新を検知して同じ世代を取り込む。
+    """
+
+    def __init__(self, sources, build, adopt, on_install=None, directory=None, check_interval=1.0):
+        self.sources = list(sources)
+        self.build = build
+        self.adopt = adopt
+        self.on_install = on_install
+        self.directory = directory
+        self.check_interval = check_interval
+        self.current = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._checked_at = 0.0
+        self._manifest_mtime = None
+        self._watcher = None
+
+    def install(self, generation):
+        """世代を差し替える (参照の代入1回なので、読み込み中のリクエストは古い世代をそのまま使える)"""
+        self.current = generation
+        if self.on_install is not None:
+            self.on_install(generation)
+        logger.info("データの世代 %s に切り替えました (食材 %s件)", generation.generation, len(generation.matrix))
+
+    def _manifest_path(self):
+        return os.path.join(self.directory or ingredient_data.SNAPSHOT_DIR, _MANIFEST)
+
+    def _publish(self, generation, hashes, extra):
+        manifest = {"generation": generation.generation, "sources": hashes, **extra}
+        write_manifest(manifest, self.directory)
+        self._manifest_mtime = os.stat(self._manifest_path()).st_mtime_ns
+        return manifest
+
+    def load(self, force=False):
+        """
+        元データが公開中の世代から変わっていれば新しい世代を作り、変わっていなければ公開中の世代を取り込む。
+        起動時と再読み込みで呼ばれる。返り値は現在の世代。
+        """
+        with self._lock, exclusive(self.directory):
+            manifest = read_manifest(self.directory)
+            hashes = source_hashes(self.sources)
+            if manifest is not None and manifest.get("sources") == hashes and not force:
+                if self.current is None or self.current.generation != manifest["generation"]:
+                    try:
+                        self.install(self.adopt(manifest))
+                        self._manifest_mtime = os.stat(self._manifest_path()).st_mtime_ns
+                        return self.current
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning("公開中の世代 %s を開けないため作り直します: %s", manifest["generation"], e)
+                else:
+                    return self.current
+
+            number = max(manifest["generation"] if manifest else 0, self.current.generation if self.current else 0) + 1
+            # 取り込み済みの元データから変わった場合だけ DB に取り込み直す (初回は DB が空の場合だけ取り込む)
+            reimport = force or (manifest is not None and manifest.get("sources") != hashes)
+            generation, extra = self.build(number, reimport)
+            try:
+                self._publish(generation, hashes, extra)
+            except OSError as e:
+                logger.warning("世代の情報を書き込めませんでした (ほかのワーカーには反映されません): %s", e)
+            self.install(generation)
+            self.last_error = None
+            return generation
+
+    def reload(self, force=False, wait=False):
+        """
+        バックグラウンドのスレッドで load() を実行する。既に実行中なら新しくは始めない。
+        wait=True なら完了まで待つ。返り値は新しく開始したかどうか。
+        """
+        with self._thread_lock:
+            running = self._thread is not None and self._thread.is_alive()
+            if not running:
+                self._thread = threading.Thread(target=self._run, args=(force,), name='data-reload', daemon=True)
+                self._thread.start()
+            thread = self._thread
+        if wait:
+            thread.join()
+        return not running
+
+    def _run(self, force):
+        try:
+            self.load(force)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.exception("データの再読み込みに失敗しました: %s", e)
+
+    @property
+    def reloading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self):
+        """
+        ほかのプロセスが新しい世代を公開していれば取り込む。
+        リクエストの最初に呼ばれるので、マニフェストの確認は check_interval 秒に1回 (stat 1回) だけにする。
+        """
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._manifest_path()).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._manifest_mtime or not self._lock.acquire(blocking=False):
+            return
+        try:
+            manifest = read_manifest(self.directory)
+            if manifest is not None and (self.current is None or manifest["generation"] > self.current.generation):
+                self.install(self.adopt(manifest))
+            self._manifest_mtime = mtime
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("公開された世代を取り込めませんでした: %s", e)
+        finally:
+            self._lock.release()
+
+    def watch(self, interval):
+        """元データのファイルの更新時刻を interval 秒ごとに確認し、変わったら再読み込みするスレッドを開始する"""
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def stat_all():
+            stats = []
+            for path in self.sources:
+                try:
+                    stat = os.stat(path)
+                    stats.append((stat.st_mtime_ns, stat.st_size))
+                except OSError:
+                    stats.append(None)
+            return stats
+
+        def run():
+            last = stat_all()
+            while True:
+                time.sleep(interval)
+                stats = stat_all()
+                if stats != last:
+                    last = stats
+                    logger.info("元データの変更を検知しました。再読み込みします")
+                    self.reload()
+
+        self._watcher = threading.Thread(target=run, name='data-watcher', daemon=True)
+        self._watcher.start()
+
+    def status(self):
+        status = self.current.describe() if self.current is not None else {}
+        status.update({"reloading": self.reloading, "last_error": self.last_error})
+        return status
@@ -0,0 +1,134 @@
+import itertools
+
+import numpy as np
+
+from nutrient_engine import significant, significant_array
+
+
+# 安静時エネルギー要求量 RER = 70 × 体重(kg)^0.75 (kcal/日)
+RER_COEFFICIENT = 70.0
+RER_EXPONENT = 0.75
+
+# 1日のエネルギー要求量 = RER × 活動係数 (避妊・去勢済みの成犬で 1.6)
+DEFAULT_ACTIVITY_FACTOR = 1.6
+
+
+def energy_requirements(body_weights, activity_factors):
+    """体重 (kg) と活動係数の配列から、1日のエネルギー要求量 (kcal) の配列を返す"""
+    body_weights = np.asarray(body_weights, dtype=np.float64)
+    return RER_COEFFICIENT * body_weights ** RER_EXPONENT * np.asarray(activity_factors, dtype=np.float64)
+
+
+def _roster_arrays(roster):
+    """犬の名簿 [{"id", "body_weight", "activity_factor", "energy_kcal"}] を配列にする"""
+    body_weights = np.array([float(dog.get('body_weight', 0)) for dog in roster], dtype=np.float64)
+    activity_factors = np.array(
+        [float(dog.get('activity_factor', DEFAULT_ACTIVITY_FACTOR)) for dog in roster], dtype=np.float64
+    )
+    if (body_weights <= 0).any():
+        index = int(np.flatnonzero(body_weights <= 0)[0])
+        raise ValueError(f"dog {index}: body_weight must be positive")
+    if (activity_factors <= 0).any():
+        index = int(np.flatnonzero(activity_factors <= 0)[0])
+        raise ValueError(f"dog {index}: activity_factor must be positive")
+
+    energy = energy_requirements(body_weights, activity_factors)
+    # energy_kcal を指定した犬は計算値の代わりにその値を使う (獣医師の指示がある場合など)
+    for i, dog in enumerate(roster):
+        if dog.get('energy_kcal') is not None:
+            energy[i] = float(dog['energy_kcal'])
+            if energy[i] <= 0:
+                raise ValueError(f"dog {i}: energy_kcal must be positive")
+    return body_weights, activity_factors, energy
+
+
+def plan_feeding(matrix, selected_list, roster, profile, days=1):
+    """
+    レシピと犬の名簿から、犬ごとの1日の給与量と栄養素の摂取量を計算し、全頭分の仕込み量を集計する。
+
+    レシピの配合比はそのままで、犬ごとに「エネルギー要求量 ÷ レシピ全体のエネルギー (ENERC_KCAL)」倍に
+    グラム数を増減する。摂取量は レシピの合計 × 倍率 (犬の数 × 栄養素数の外積)、
+    基準値との比較も名簿全体をまとめて1回で行う。
+    """
+    if days <= 0:
+        raise ValueError("days must be positive")
+    rows, grams, _, missing = matrix.resolve(selected_list)
+    if missing:
+        raise ValueError(f"food_code {missing[0]} not found")
+    totals = matrix.totals_vector(rows, grams)
+    recipe_grams = float(grams.sum())
+    recipe_energy = float(totals[matrix.column_index['ENERC_KCAL']])
+    if recipe_energy <= 0:
+        raise ValueError("The recipe has no energy (ENERC_KCAL)")
+
+    body_weights, activity_factors, energy = _roster_arrays(roster)
+    scales = energy / recipe_energy
+    intake = np.outer(scales, totals)
+    portions = scales * recipe_grams
+    ingredient_grams = significant_array(np.outer(scales, grams))
+
+    columns = profile.columns
+    nutrients = profile.column_nutrients
+    _, below, above = profile.evaluate(intake, portions)
+    below, above = below[:, columns], above[:, columns]
+    intake = significant_array(intake[:, columns])
+
+    # 名簿全体を一度に list に変換してから犬ごとの結果を組み立てる
+    dogs = [
+        {
+            "id": dog.get('id', i),
+            "body_weight": weight,
+            "activity_factor": factor,
+            "energy_kcal": kcal,
+            "scale": scale,
+            "portion_grams": portion,
+            "ingredient_grams": dog_grams,
+            "nutrient_intake": dict(zip(nutrients, dog_intake)),
+            "deficiencies": list(itertools.compress(nutrients, low)),
+            "excesses": list(itertools.compress(nutrients, high)),
+        }
+        for i, (dog, weight, factor, kcal, scale, portion, dog_grams, dog_intake, low, high) in enumerate(zip(
+            roster,
+            body_weights.tolist(),
+            activity_factors.tolist(),
+            np.round(energy, 1).tolist(),
+            significant_array(scales).tolist(),
+            np.round(portions, 1).tolist(),
+            ingredient_grams.tolist(),
+            intake.tolist(),
+            below.tolist(),
+            above.tolist(),
+        ))
+    ]
+
+    # 全頭分 × 日数の食材ごとの仕込み量
+    batch_grams = grams * (scales.sum() * days)
+    failing = below | above
+    return {
+        "recipe": {
+            "ingredients": [
+                {"food_code": int(matrix.food_codes[row]), "name": matrix.names[row], "grams": float(value)}
+                for row, value in zip(rows.tolist(), grams.tolist())
+            ],
+            "total_grams": round(recipe_grams, 2),
+            "energy_kcal": significant(recipe_energy),
+            "kcal_per_100g": significant(recipe_energy / recipe_grams * 100) if recipe_grams else 0,
+        },
+        "dogs": dogs,
+        "batch": {
+            "days": days,
+            "total_grams": round(float(batch_grams.sum()), 1),
+            "total_energy_kcal": round(float(energy.sum() * days), 1),
+            "ingredients": [
+                {"food_code": int(matrix.food_codes[row]), "name": matrix.names[row], "grams": round(float(value), 1)}
+                for row, value in zip(rows.tolist(), batch_grams.tolist())
+            ],
+        },
+        "summary": {
+            "dogs": len(roster),
+            "dogs_meeting_standards": int((~failing.any(axis=1)).sum()),
+            "deficiency_counts": {
+                nutrient: int(count) for nutrient, count in zip(nutrients, below.sum(axis=0).tolist()) if count
+            },
+        },
+    }
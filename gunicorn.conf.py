@@ -0,0 +1,34 @@
+"""
+gunicorn の設定。環境変数で並列度を調整できる。
+
+    WEB_CONCURRENCY   ワーカープロセス数 (既定: CPU数 * 2 + 1)
+    GUNICORN_THREADS  ワーカーあたりのスレッド数 (既定: 4)
+    GUNICORN_TIMEOUT  リクエストのタイムアウト秒数 (既定: 30)
+    DATA_WATCH_INTERVAL  ingredients.xlsx / aafco_standards.xlsx の変更を確認する間隔 (秒, 既定: 0 = 監視しない)
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# マスタープロセスでデータをロードし、ワーカーは fork で共有する
+preload_app = True
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = 5
+
+
+def when_ready(server):
+    # アプリのロード後、最初のワーカーを fork する前に1回だけ、ロード済みのオブジェクトを GC の対象から外し、
+    # ワーカーでの GC による copy-on-write の発生を抑える
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # 元データの監視スレッドはワーカーごとに開始する (fork 前のスレッドはワーカーに引き継がれない)
+    import app as dogfood
+    dogfood.start_data_watcher()
@@ -0,0 +1,90 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+from json_provider import dumps_bytes
+
+try:
+    import brotli
+except ImportError:  # brotli は任意の依存 (無ければ gzip のみ)
+    brotli = None
+
+
+# 事前に圧縮したレスポンス本文
+class CachedPayload:
+    """
+    レスポンス本文と、その gzip / brotli 圧縮版、強い ETag をまとめて保持する。
+    version はデータのバージョン (栄養素行列の version など) で、変わったら作り直す。
+    圧縮版はクライアントから初めて要求された圧縮形式だけを作り、以降は使い回す。
+    """
+
+    def __init__(self, body, mimetype, version=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.version = version
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded = {}
+
+    def encode(self, encoding):
+        """encoding ('gzip' / 'br') で圧縮した本文を返す (同時に圧縮しても結果は同じなのでロックは取らない)"""
+        data = self.encoded.get(encoding)
+        if data is None:
+            data = gzip.compress(self.body, compresslevel=6) if encoding == 'gzip' else brotli.compress(self.body)
+            self.encoded[encoding] = data
+        return data
+
+    def response(self):
+        """
+        現在のリクエストに対するレスポンスを返す。
+        If-None-Match が一致すれば 304、Accept-Encoding に応じて圧縮版を返す。
+        """
+        encoding = None
+        for candidate in ('br', 'gzip'):
+            if (candidate != 'br' or brotli is not None) and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        # 圧縮形式ごとに異なる強い ETag を付ける
+        etag = self.etag if encoding is None else f"{self.etag}-{encoding}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.body if encoding is None else self.encode(encoding), mimetype=self.mimetype)
+            if encoding is not None:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+def json_bytes(obj):
+    """obj をコンパクトな UTF-8 の JSON バイト列にする"""
+    return dumps_bytes(obj)
+
+
+# キャッシュする CachedPayload の最大数 (ページ分割したレスポンスなど key が多い場合は、古く使われたものから捨てる)
+MAX_PAYLOADS = 1024
+
+_payloads = OrderedDict()
+_lock = threading.Lock()
+
+
+def cached_payload(key, version, build, mimetype='application/json'):
+    """
+    key ごとに build() の結果 (bytes) をデータのバージョン単位でキャッシュした CachedPayload を返す
+    """
+    with _lock:
+        payload = _payloads.get(key)
+        if payload is not None and payload.version == version:
+            _payloads.move_to_end(key)
+            return payload
+        payload = CachedPayload(build(), mimetype, version)
+        _payloads[key] = payload
+        _payloads.move_to_end(key)
+        while len(_payloads) > MAX_PAYLOADS:
+            _payloads.popitem(last=False)
+    return payload
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+# Excel (ingredients.xlsx) の列名と Ingredient モデルのフィールド名の対応
+INGREDIENT_COLUMNS = {
+    '食品番号': 'food_code',
+    '食品名': 'name',
+    'エネルギー': 'ENERC_KCAL',
+    '水分': 'WATER',
+    'イソロイシン': 'ILE',
+    'ロイシン': 'LEU',
+    'リシン（リジン）': 'LYS',
+    'メチオニン': 'MET',
+    'シスチン': 'CYS',
+    'フェニルアラニン': 'PHE',
+    'チロシン': 'TYR',
+    'トレオニン（スレオニン）': 'THR',
+    'トリプトファン': 'TRP',
+    'バリン': 'VAL',
+    'ヒスチジン': 'HIS',
+    'アルギニン': 'ARG',
+    'リノール酸': 'F18D2N6',
+    'α‐リノレン酸': 'F18D3N3',
+    'ドコサヘキサエン酸': 'F22D6N3',
+    'ナトリウム': 'NAT',
+    'カリウム': 'K',
+    'カルシウム': 'CA',
+    'マグネシウム': 'MG',
+    'リン': 'P',
+    '鉄': 'FE',
+    '亜鉛': 'ZN',
+    '銅': 'CU',
+    'マンガン': 'MN',
+    'ヨウ素': 'YO',
+    'セレン': 'SE',
+    'クロム': 'CR',
+    'VAレチノール': 'RETOL',
+    'VAα|カロテン': 'CARTA',
+    'VAβ|カロテン': 'CARTB',
+    'VＡβ|クリプトキサンチン': 'CRYPXB',
+    'ＶＡβ|カロテン当量': 'CARTBEQ',
+    'ＶＡレチノール活性当量': 'VITA_RAE',
+    'ビタミンD': 'VITD',
+    'VEα|トコフェロール': 'TOCPHA',
+    'VEβ|トコフェロール': 'TOCPHB',
+    'VEγ|トコフェロール': 'TOCPHG',
+    'VEδ|トコフェロール': 'TOCPHD',
+    'ビタミンB1': 'THIA',
+    'ビタミンB2': 'RIBF',
+    'ナイアシン': 'NIA',
+    'ビタミンB6': 'VITB6A',
+    'ビタミンB12': 'VITB12',
+    '葉酸': 'FOL',
+    'パントテン酸': 'PANTAC',
+    '食塩相当量': 'NACL_EQ',
+}
+
+# 栄養素のフィールド名 (nutrient_labels と同じ順序)
+NUTRIENT_COLUMNS = list(INGREDIENT_COLUMNS.values())[2:]
+
+# 数値として扱えない表記 (0 とみなす)
+MISSING_VALUES = ['Tr', 'N/A', 'Undefined']
+
+# 解析済みの Excel を保存するスナップショットの保存先
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'snapshots')
+
+# aafco_standards.xlsx (全プロファイル形式) のスナップショット名
+AAFCO_SNAPSHOT = 'aafco_profiles'
+
+
+def clean_ingredients(df):
+    """
+    Excel から読み込んだ食材表の列名をモデルのフィールド名に置き換え、
+    空欄と MISSING_VALUES の表記を 0 にそろえた DataFrame を返す。
+    それ以外の数値に変換できない値も 0 として取り込むが、食品番号・列・値を警告ログに残す
+    """
+    df = df.rename(columns=INGREDIENT_COLUMNS)[list(INGREDIENT_COLUMNS.values())]
+    df = df.dropna(subset=['food_code'])
+
+    nutrients = df[NUTRIENT_COLUMNS].replace(MISSING_VALUES, 0)
+    values = nutrients.apply(pd.to_numeric, errors='coerce')
+    unparsed = values.isna() & nutrients.notna()
+    for index, column in zip(*unparsed.to_numpy().nonzero()):
+        logger.warning(
+            "食品番号 %s の %s の値 %r を数値に変換できないため 0 として扱います",
+            df['food_code'].iloc[index], NUTRIENT_COLUMNS[column], nutrients.iat[index, column],
+        )
+    df = df.assign(**{column: values[column].fillna(0).astype(float) for column in NUTRIENT_COLUMNS})
+    df['food_code'] = df['food_code'].astype(int)
+    df['name'] = df['name'].astype(str)
+
+    # 食品番号が重複している場合は後の行を優先する
+    return df.drop_duplicates('food_code', keep='last').reset_index(drop=True)
+
+
+def parse_ingredients_excel(path):
+    """ingredients.xlsx を openpyxl で読み込み、クレンジング済みの DataFrame を返す"""
+    df = pd.read_excel(path, engine='openpyxl', usecols=list(INGREDIENT_COLUMNS))
+    return clean_ingredients(df)
+
+
+def parse_aafco_excel(path):
+    """
+    aafco_standards.xlsx を openpyxl で読み込み、profile / nutrient / minimum / maximum / basis の DataFrame を返す。
+    シートごとに1つの基準値プロファイル (シート名がプロファイル名) として扱う。
+    maximum (上限値) と basis (absolute / per_1000kcal / dry_matter) の列は省略でき、
+    省略した場合は上限なし・レシピ全体の合計量との比較になる。
+    """
+    frames = []
+    for sheet, df in pd.read_excel(path, engine='openpyxl', sheet_name=None).items():
+        df = df.dropna(subset=['nutrient', 'minimum'])
+        if 'maximum' not in df.columns:
+            df['maximum'] = np.nan
+        if 'basis' not in df.columns:
+            df['basis'] = 'absolute'
+        df['basis'] = df['basis'].fillna('absolute')
+        df['profile'] = sheet
+        frames.append(df[['profile', 'nutrient', 'minimum', 'maximum', 'basis']])
+    df = pd.concat(frames, ignore_index=True)
+    return df.astype({'profile': str, 'nutrient': str, 'minimum': float, 'maximum': float, 'basis': str})
+
+
+def file_hash(path):
+    """ファイル内容の SHA-256 を返す"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_snapshot(df, base, source_hash):
+    """数値列を1つの .npy に、それ以外の列と列情報を .json に書き出す"""
+    numeric = [column for column in df.columns if pd.api.types.is_numeric_dtype(df[column])]
+    meta = {
+        "source_sha256": source_hash,
+        "columns": list(df.columns),
+        "numeric_columns": numeric,
+        "integer_columns": [column for column in numeric if pd.api.types.is_integer_dtype(df[column])],
+        "text_columns": {column: df[column].tolist() for column in df.columns if column not in numeric},
+    }
+    directory = os.path.dirname(base)
+    os.makedirs(directory, exist_ok=True)
+
+    # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.npy', delete=False) as f:
+        np.save(f, df[numeric].to_numpy(dtype=np.float64))
+    os.replace(f.name, base + '.npy')
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.json', delete=False, encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(f.name, base + '.json')
+
+
+def _read_snapshot(base):
+    """スナップショットをメモリマップで読み込み、DataFrame に戻す"""
+    with open(base + '.json', encoding='utf-8') as f:
+        meta = json.load(f)
+    values = np.load(base + '.npy', mmap_mode='r')
+    df = pd.DataFrame(values, columns=meta["numeric_columns"])
+    for column in meta["integer_columns"]:
+        df[column] = df[column].astype(np.int64)
+    for column, texts in meta["text_columns"].items():
+        df[column] = texts
+    return df[meta["columns"]]
+
+
+def snapshot_base(stem, source_hash, snapshot_dir=None):
+    """元のファイルのハッシュが source_hash のスナップショットのパス (拡張子なし)"""
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f"{stem}-{source_hash[:16]}")
+
+
+def read_excel_cached(path, parse, snapshot_dir=None, name=None):
+    """
+    parse(path) の結果をファイル内容のハッシュをキーにしてスナップショットに保存し、
+    次回以降は openpyxl を使わずにスナップショットから読み込む。
+    元のファイルが変わるとハッシュが変わるため、自動的に作り直される。
+    name はスナップショットのファイル名 (省略時は元のファイル名)。parse の出力形式を変えたときに変える。
+    古いスナップショットは、name と元のファイル名の両方について削除する。
+    """
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    file_stem = os.path.splitext(os.path.basename(path))[0]
+    stem = name or file_stem
+    source_hash = file_hash(path)
+    base = snapshot_base(stem, source_hash, snapshot_dir)
+
+    if os.path.exists(base + '.json') and os.path.exists(base + '.npy'):
+        try:
+            return _read_snapshot(base)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("スナップショット %s を読み込めませんでした: %s", base, e)
+
+    df = parse(path)
+    try:
+        _write_snapshot(df, base, source_hash)
+        # 古いハッシュのスナップショットと、name を変える前の (元のファイル名の) スナップショットを削除する
+        prefixes = tuple({stem + '-', file_stem + '-'})
+        for filename in os.listdir(snapshot_dir):
+            if filename.startswith(prefixes) and not filename.startswith(os.path.basename(base)):
+                os.remove(os.path.join(snapshot_dir, filename))
+    except OSError as e:
+        logger.warning("スナップショットを書き込めませんでした: %s", e)
+    return df
+
+
+def read_ingredients_excel(path, use_snapshot=True):
+    """ingredients.xlsx のクレンジング済み DataFrame を返す (スナップショットがあればそれを使う)"""
+    if use_snapshot:
+        return read_excel_cached(path, parse_ingredients_excel)
+    return parse_ingredients_excel(path)
+
+
+def read_aafco_standards(path, use_snapshot=True):
+    """aafco_standards.xlsx の全プロファイルの DataFrame を返す (スナップショットがあればそれを使う)"""
+    if use_snapshot:
+        return read_excel_cached(path, parse_aafco_excel, name=AAFCO_SNAPSHOT)
+    return parse_aafco_excel(path)
+
+
+def read_aafco_snapshot(source_hash, snapshot_dir=None):
+    """
+    ハッシュが source_hash の aafco_standards.xlsx から作ったスナップショットを読み込む
+    (xlsx は解析しない。スナップショットが無ければ OSError)
+    """
+    return _read_snapshot(snapshot_base(AAFCO_SNAPSHOT, source_hash, snapshot_dir))
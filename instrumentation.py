@@ -0,0 +1,201 @@
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+
+
+# レイテンシのヒストグラムのバケット (秒)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+# Prometheus のテキスト形式で出力するメトリクス
+class Metrics:
+    """
+    カウンター・ゲージ・ヒストグラムをプロセス内で集計し、Prometheus のテキスト形式で出力する。
+    gunicorn のワーカーごとに別々に集計される (スクレイプのたびに応答したワーカーの値になる)。
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._descriptions = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        """メトリクスの種類 (counter / gauge / histogram) と説明を登録する"""
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, labels=()):
+        with self._lock:
+            self._values[(name, tuple(labels))] = value
+
+    def observe(self, name, value, labels=()):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                # バケットごとの件数, 合計, 件数
+                histogram = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """全メトリクスを Prometheus のテキスト形式 (version 0.0.4) で返す"""
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: item[0])
+            values = [(key, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value)
+                      for key, value in values]
+
+        lines = []
+        described = set()
+        for (name, labels), value in values:
+            if name not in described:
+                kind, help_text = self._descriptions.get(name, ('untyped', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            if isinstance(value, list):
+                counts, total, count = value
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {value!r}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('dogfood_requests_total', 'counter', 'エンドポイント・ステータスごとのリクエスト数')
+metrics.describe('dogfood_request_duration_seconds', 'histogram', 'リクエスト全体の処理時間')
+metrics.describe(
+    'dogfood_phase_duration_seconds', 'histogram',
+    'リクエスト内の処理の種類 (db / compute / suggestion / render) ごとの処理時間',
+)
+metrics.describe('dogfood_sql_queries_total', 'counter', 'エンドポイントごとの SQL 実行回数')
+metrics.describe('dogfood_result_cache_hits_total', 'counter', 'レシピの計算結果キャッシュのヒット数')
+metrics.describe('dogfood_result_cache_misses_total', 'counter', 'レシピの計算結果キャッシュのミス数')
+metrics.describe('dogfood_result_cache_entries', 'gauge', 'レシピの計算結果キャッシュの件数')
+metrics.describe('dogfood_recipe_store_entries', 'gauge', 'プロセス内に保持しているレシピの件数')
+metrics.describe('dogfood_data_generation', 'gauge', '使用中のデータ (食材・基準値) の世代')
+
+
+def add_phase_time(name, seconds):
+    """
+    現在のリクエストの処理時間に name の時間を加える。
+    phase() の内側で呼ばれた場合、その時間は外側の処理時間から除く。
+    """
+    if not has_request_context():
+        return
+    timings = g.setdefault('phase_seconds', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+    stack = g.get('phase_stack')
+    if stack:
+        stack[-1] += seconds
+
+
+@contextmanager
+def phase(name):
+    """
+    with ブロックの処理時間を現在のリクエストの name (compute / suggestion など) に加える。
+    入れ子になった場合は内側の時間を外側から除き、それぞれの処理だけの時間を集計する。
+    リクエストの外 (CLI やベンチマーク) では何もしない。
+    """
+    if not has_request_context():
+        yield
+        return
+    stack = g.setdefault('phase_stack', [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        children = stack.pop()
+        add_phase_time(name, elapsed - children)
+        if stack:
+            # add_phase_time で加えた分と合わせて、外側からは内側の時間全体を除く
+            stack[-1] += children
+
+
+def timed(name):
+    """関数の処理時間を phase(name) で集計するデコレーター"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_request(endpoint, status, duration, phases, query_count):
+    """1リクエスト分の処理時間と SQL 実行回数をメトリクスに記録する"""
+    labels = (('endpoint', endpoint),)
+    metrics.inc('dogfood_requests_total', labels + (('status', str(status)),))
+    metrics.observe('dogfood_request_duration_seconds', duration, labels)
+    for name, seconds in phases.items():
+        metrics.observe('dogfood_phase_duration_seconds', seconds, labels + (('phase', name),))
+    if query_count:
+        metrics.inc('dogfood_sql_queries_total', labels, query_count)
+
+
+# プロファイラは同時に1つのリクエストだけで動かす
+_profile_lock = threading.Lock()
+
+
+def start_profile():
+    """cProfile を開始する。別のリクエストをプロファイル中なら None を返す"""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 他のプロファイラが動いている場合
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def finish_profile(profiler, output='text', limit=60):
+    """
+    プロファイルを止めて結果を返す。
+    output='pstats' なら pstats / snakeviz で読めるバイナリ、それ以外は累積時間順の上位 limit 件のテキスト。
+    返り値は (本文, mimetype)。
+    """
+    try:
+        profiler.disable()
+    finally:
+        _profile_lock.release()
+    profiler.create_stats()
+    if output == 'pstats':
+        return marshal.dumps(profiler.stats), 'application/octet-stream'
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue(), 'text/plain'
@@ -0,0 +1,96 @@
+import decimal
+import threading
+
+import numpy as np
+import orjson
+from flask.json.provider import JSONProvider
+from markupsafe import Markup
+
+
+# NumPy の配列はそのまま、dict のキーは文字列以外 (食品番号など) も扱えるようにする
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """orjson が直接扱えない値を変換する"""
+    if isinstance(obj, np.float32):
+        # float32 は float64 に広げると丸め誤差が出るので、float32 として最短の表記から戻す
+        return float(str(obj))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        # 非連続な配列など OPT_SERIALIZE_NUMPY で扱えないもの
+        return obj.tolist()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if hasattr(obj, '_get_current_object'):
+        # werkzeug の LocalProxy (現在の世代のデータなど)
+        return obj._get_current_object()
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """obj をコンパクトな UTF-8 の JSON バイト列にする"""
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+# orjson を使う Flask の JSON プロバイダ
+class OrjsonProvider(JSONProvider):
+    """
+    jsonify / request.get_json / テンプレートの tojson を orjson で処理する。
+    NumPy の配列やスカラーは list に変換せずにそのまま渡せる。
+    """
+
+    def dumps(self, obj, **kwargs):
+        """
+        obj を JSON 文字列にする。json.dumps の引数のうち、sort_keys (tojson が渡す)、
+        indent (2 のみ)、separators (セッションが渡すコンパクトな表記のみ) に対応する。
+        orjson で再現できない引数は無視せずに TypeError を送出する。
+        """
+        option = OPTIONS
+        if kwargs.pop('sort_keys', False):
+            option |= orjson.OPT_SORT_KEYS
+        indent = kwargs.pop('indent', None)
+        if indent is not None:
+            if indent != 2:
+                raise TypeError(f"indent={indent!r} is not supported (only 2)")
+            option |= orjson.OPT_INDENT_2
+        separators = kwargs.pop('separators', None)
+        if separators is not None and tuple(separators) != ((',', ': ') if indent else (',', ':')):
+            raise TypeError(f"separators={separators!r} is not supported")
+        if kwargs:
+            raise TypeError(f"Unsupported arguments: {', '.join(sorted(kwargs))}")
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+
+_static = {}
+_lock = threading.Lock()
+
+
+def static_json(key, version, build):
+    """
+    変わらない部分 (AAFCO基準値など) の JSON を version ごとに1回だけシリアライズして返す。
+    返り値はテンプレートの <script> にそのまま埋め込める (tojson と同じエスケープをした) Markup。
+    """
+    cached = _static.get(key)
+    if cached is None or cached[0] != version:
+        text = (
+            dumps_bytes(build()).decode('utf-8')
+            .replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026').replace("'", '\\u0027')
+        )
+        with _lock:
+            cached = _static[key] = (version, Markup(text))
+    return cached[1]
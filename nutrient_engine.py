@@ -0,0 +1,378 @@
+import hashlib
+import itertools
+import logging
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+def significant(value):
+    """float32 の丸め誤差が出力に出ないよう、有効数字7桁に丸めた float を返す"""
+    return float(f"{value:.7g}")
+
+
+def significant_array(values):
+    """significant の配列版 (有効数字7桁に丸めた float64 の配列を返す)"""
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values) & (values != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = np.where(finite, 6 - np.floor(np.log10(np.abs(values))), 0)
+    scale = 10.0 ** np.abs(exponent)
+    # 10の累乗は整数のときだけ正確に表せるので、桁を上げる場合は割り算、下げる場合は掛け算で戻す
+    rounded = np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    return np.where(finite, rounded, values)
+
+
+# 食材テーブル全体を保持する栄養素行列
+class NutrientMatrix:
+    """
+    食材 × 栄養素の密行列 (float32, 100gあたりの値) と food_code → 行番号の索引。
+    合計値の計算はグラムベクトルと行列の積1回で行う。
+    values / ranking には列指向ストア (columnar_store) のメモリマップをそのまま渡せる (コピーしない)。
+    """
+
+    def __init__(self, food_codes, names, nutrients, values, ranking=None, version=None):
+        self.food_codes = np.asarray(food_codes, dtype=np.int64)
+        self.names = list(names)
+        self.nutrients = list(nutrients)
+        values = np.asarray(values, dtype=np.float32)
+        if not np.isfinite(values).all():
+            values = np.where(np.isfinite(values), values, np.float32(0))
+        self.values = values
+        self.row_index = {int(code): row for row, code in enumerate(self.food_codes.tolist())}
+        self.column_index = {nutrient: col for col, nutrient in enumerate(self.nutrients)}
+        # 栄養素ごとの降順ランキング (列ごとに値の大きい食材の行番号が先頭に並ぶ)
+        if ranking is None:
+            ranking = np.argsort(-self.values, axis=0, kind='stable')
+        self.ranking = ranking
+        self._records = {}
+        self._coverage_key = None
+        self._coverage = None
+        self._catalog = None
+        self._code_order = None
+
+        # データの内容から決まるバージョン (キャッシュのキーに使う)
+        if version is None:
+            digest = hashlib.sha256(self.food_codes.tobytes())
+            digest.update(self.values.tobytes())
+            digest.update('\n'.join(self.names).encode('utf-8'))
+            version = digest.hexdigest()[:16]
+        self.version = version
+
+    @classmethod
+    def from_rows(cls, rows, nutrients):
+        """(food_code, name, 栄養素1, 栄養素2, ...) のタプル列から行列を構築する"""
+        rows = list(rows)
+        food_codes = [row[0] for row in rows]
+        names = [row[1] for row in rows]
+        values = np.array(
+            [[value if value is not None else 0 for value in row[2:]] for row in rows],
+            dtype=np.float32,
+        ).reshape(len(rows), len(nutrients))
+        return cls(food_codes, names, nutrients, values)
+
+    def __len__(self):
+        return len(self.food_codes)
+
+    def column(self, nutrient):
+        """全食材の nutrient の値 (列指向ストアでは連続したメモリのビュー)"""
+        return self.values[:, self.column_index[nutrient]]
+
+    def row_of(self, food_code):
+        """food_code に対応する行番号を返す (存在しない場合は None)"""
+        try:
+            return self.row_index.get(int(food_code))
+        except (TypeError, ValueError):
+            return None
+
+    def name_of(self, food_code):
+        row = self.row_of(food_code)
+        return self.names[row] if row is not None else None
+
+    def catalog(self):
+        """全食材の {food_code, name} のリストを返す (一度だけ生成して使い回す)"""
+        if self._catalog is None:
+            self._catalog = [
+                {"food_code": int(food_code), "name": name}
+                for food_code, name in zip(self.food_codes.tolist(), self.names)
+            ]
+        return self._catalog
+
+    def page(self, cursor=None, limit=None, fields=('food_code', 'name')):
+        """
+        food_code 順に並べた食材のうち、cursor より後ろの最大 limit 件を fields の項目だけで返す。
+        返り値は (食材のリスト, 次のページの cursor または None)。
+        """
+        if self._code_order is None:
+            self._code_order = np.argsort(self.food_codes, kind='stable')
+        order = self._code_order
+        start = 0
+        if cursor is not None:
+            start = int(np.searchsorted(self.food_codes[order], cursor, side='right'))
+        end = len(order) if limit is None else min(start + limit, len(order))
+
+        items = []
+        for row in order[start:end].tolist():
+            record = self.food_record(row)
+            items.append({
+                field: record[field] if field in ('food_code', 'name') else record["nutrients"][field]
+                for field in fields
+            })
+        next_cursor = int(self.food_codes[order[end - 1]]) if start < end < len(order) else None
+        return items, next_cursor
+
+    def food_record(self, row):
+        """
+        提案リストに埋め込む食材情報 {food_code, name, nutrients} を返す。
+        行ごとに一度だけ生成し、以降は同じ辞書を使い回す。
+        """
+        record = self._records.get(row)
+        if record is None:
+            record = {
+                "food_code": int(self.food_codes[row]),
+                "name": self.names[row],
+                "nutrients": {
+                    nutrient: significant(value)
+                    for nutrient, value in zip(self.nutrients, self.values[row].tolist())
+                },
+            }
+            self._records[row] = record
+        return record
+
+    def top_rows(self, nutrient, k, exclude_food_codes=(), positive_only=False):
+        """栄養素 nutrient の含有量が多い上位 k 件の行番号を返す"""
+        col = self.column_index[nutrient]
+        excluded = {self.row_of(food_code) for food_code in exclude_food_codes}
+        excluded.discard(None)
+        candidates = self.ranking[:k + len(excluded), col].tolist()
+        rows = [row for row in candidates if row not in excluded][:k]
+        if positive_only:
+            column = self.values[:, col]
+            rows = [row for row in rows if column[row] > 0]
+        return rows
+
+    def top_foods(self, nutrient, k, exclude_food_codes=(), positive_only=False):
+        """
+        栄養素 nutrient の含有量が多い上位 k 件の食材を提案リストの形式で返す。
+        exclude_food_codes に含まれる食材 (レシピに既にある食材など) は除外する。
+        """
+        results = []
+        for row in self.top_rows(nutrient, k, exclude_food_codes, positive_only):
+            record = self.food_record(row)
+            results.append({**record, "value": record["nutrients"][nutrient]})
+        return results
+
+    def coverage(self, standards):
+        """
+        食材ごとの基準値カバー率 min(値 / 基準値, 1) の行列を返す。
+        基準値が変わらない限り一度だけ計算してキャッシュする。
+        """
+        key = tuple(standards.items())
+        if key != self._coverage_key:
+            minimums = np.array([standards.get(nutrient, 0) for nutrient in self.nutrients], dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                coverage = np.minimum(self.values / minimums, 1.0)
+            coverage[:, minimums <= 0] = 0
+            coverage[self.values <= 0] = 0
+            self._coverage_key, self._coverage = key, coverage
+        return self._coverage
+
+    def best_foods(self, deficiencies, standards, k=5, weights=None):
+        """
+        不足栄養素のカバー率の合計 (weights を指定した場合は重み付き和) が高い上位 k 件の食材を返す
+        """
+        nutrients = [nutrient for nutrient in deficiencies if nutrient in self.column_index]
+        if not nutrients:
+            return []
+        coverage = self.coverage(standards)[:, [self.column_index[nutrient] for nutrient in nutrients]]
+        if weights is None:
+            scores = coverage.sum(axis=1)
+        else:
+            scores = coverage @ np.array([weights.get(nutrient, 0) for nutrient in nutrients], dtype=np.float64)
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+        return [
+            {
+                "food_code": int(self.food_codes[row]),
+                "name": self.names[row],
+                "score": round(float(scores[row]), 2),
+                "covered_nutrients": [
+                    nutrient for nutrient, value in zip(nutrients, coverage[row].tolist()) if value > 0
+                ],
+            }
+            for row in candidates.tolist()
+        ]
+
+    def resolve(self, selected_list):
+        """
+        selected_list を (行番号配列, グラム配列, 見つかった項目, 見つからなかった food_code) に変換する
+        """
+        rows = []
+        grams = []
+        found = []
+        missing = []
+        for item in selected_list:
+            food_code = item.get('food_code')
+            row = self.row_of(food_code)
+            if row is None:
+                missing.append(food_code)
+                continue
+            rows.append(row)
+            grams.append(float(item.get('grams', 0) or 0))
+            found.append(item)
+        return np.array(rows, dtype=np.intp), np.array(grams, dtype=np.float64), found, missing
+
+    def totals_vector(self, rows, grams):
+        """行番号とグラム数から全栄養素の合計ベクトルを計算する"""
+        if len(rows) == 0:
+            return np.zeros(len(self.nutrients), dtype=np.float64)
+        return (grams / 100) @ self.values[rows]
+
+    def totals(self, selected_list, nutrients=None):
+        """
+        栄養素の合計を {栄養素: 値} の辞書で返す。
+        nutrients を指定した場合はその栄養素だけを返す。
+        """
+        rows, grams, _, missing = self.resolve(selected_list)
+        for food_code in missing:
+            logger.warning("Ingredient with food_code %s not found", food_code)
+        return self.to_dict(self.totals_vector(rows, grams), nutrients)
+
+    def gram_matrix(self, selected_lists):
+        """
+        複数のレシピを CSR 形式の疎なレシピ × 食材グラム行列 (indptr, indices, grams) に変換する。
+        見つからなかった food_code はレシピごとのリストで返す。
+        """
+        indptr = [0]
+        indices = []
+        grams = []
+        missing = []
+        for selected_list in selected_lists:
+            rows, recipe_grams, _, recipe_missing = self.resolve(selected_list)
+            indices.extend(rows.tolist())
+            grams.extend(recipe_grams.tolist())
+            indptr.append(len(indices))
+            missing.append(recipe_missing)
+        return (
+            np.array(indptr, dtype=np.intp),
+            np.array(indices, dtype=np.intp),
+            np.array(grams, dtype=np.float64),
+            missing,
+        )
+
+    def batch_totals(self, indptr, indices, grams):
+        """疎なグラム行列と栄養素行列の積で、レシピごとの合計 (レシピ数 × 栄養素数) を計算する"""
+        totals = np.zeros((len(indptr) - 1, len(self.nutrients)), dtype=np.float64)
+        if len(indices) == 0:
+            return totals
+        weighted = self.values[indices] * (grams / 100)[:, None]
+        # 空のレシピは reduceat の区間から除外する
+        non_empty = np.flatnonzero(np.diff(indptr) > 0)
+        totals[non_empty] = np.add.reduceat(weighted, indptr[non_empty], axis=0)
+        return totals
+
+    def to_dict(self, vector, nutrients=None):
+        """合計ベクトルを栄養素名をキーとする辞書に変換する"""
+        if nutrients is None:
+            nutrients = self.nutrients
+        return {
+            nutrient: significant(vector[self.column_index[nutrient]]) if nutrient in self.column_index else 0
+            for nutrient in nutrients
+        }
+
+
+def shortfall_weights(nutrient_totals, standards, nutrients):
+    """基準値に対する不足の割合 (0〜1) を栄養素ごとの重みとして返す"""
+    weights = {}
+    for nutrient in nutrients:
+        minimum = standards.get(nutrient, 0)
+        if minimum > 0:
+            weights[nutrient] = min(max(1 - nutrient_totals.get(nutrient, 0) / minimum, 0.0), 1.0)
+    return weights
+
+
+def _recipe_items(recipe):
+    """レシピ (食材リスト、または selected_list / selected_ingredients を持つ辞書) から食材リストを取り出す"""
+    if isinstance(recipe, dict):
+        return recipe.get('selected_list', recipe.get('selected_ingredients', []))
+    return recipe
+
+
+def validate_recipe(recipe):
+    """
+    レシピの形式を確認し、評価できない場合は ValueError を送出する。
+    レシピを読み込めなかった場合 (NDJSON の行が JSON でないなど) は、その例外のオブジェクトを渡す。
+    """
+    if isinstance(recipe, Exception):
+        raise ValueError(str(recipe))
+    if not isinstance(recipe, (dict, list)):
+        raise ValueError("recipe must be an object or a list of ingredients")
+    items = _recipe_items(recipe)
+    if not isinstance(items, list):
+        raise ValueError("selected_list must be a list")
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("each ingredient must be an object with food_code and grams")
+        try:
+            float(item.get('grams', 0) or 0)
+        except (TypeError, ValueError):
+            raise ValueError(f"grams of food_code {item.get('food_code')} must be a number") from None
+
+
+def evaluate_recipes(matrix, recipes, profile, chunk_size=512):
+    """
+    多数のレシピを基準値プロファイル (standards.StandardsProfile) に照らして評価し、レシピごとの結果を順に返すジェネレータ。
+    レシピは chunk_size 件ずつまとめて行列積で計算し、基準値との比較もチャンク全体で1回だけ行うため、
+    件数に関わらずメモリ使用量は一定。
+    形式が正しくないレシピ (validate_recipe を参照) は評価せず、{"id", "error"} を返す。
+    """
+    nutrients = profile.column_nutrients
+    columns = profile.columns
+
+    recipes = iter(recipes)
+    position = 0
+    while True:
+        chunk = list(itertools.islice(recipes, chunk_size))
+        if not chunk:
+            break
+        errors = []
+        for recipe in chunk:
+            try:
+                validate_recipe(recipe)
+                errors.append(None)
+            except ValueError as e:
+                errors.append(str(e))
+        # 形式が正しくないレシピは空のレシピとして計算し、結果の代わりにエラーを返す
+        indptr, indices, grams, missing = matrix.gram_matrix(
+            [] if error else _recipe_items(recipe) for recipe, error in zip(chunk, errors)
+        )
+        totals = matrix.batch_totals(indptr, indices, grams)
+        recipe_grams = np.bincount(np.repeat(np.arange(len(chunk)), np.diff(indptr)), weights=grams, minlength=len(chunk))
+        _, below, above = profile.evaluate(totals, recipe_grams)
+        # チャンク全体をまとめて丸め、list に変換してからレシピごとの結果を組み立てる
+        totals = significant_array(totals[:, columns]).tolist()
+        below, above = below[:, columns].tolist(), above[:, columns].tolist()
+
+        for i, (recipe, total_grams) in enumerate(zip(chunk, recipe_grams.tolist())):
+            recipe_id = recipe.get('id', position + i) if isinstance(recipe, dict) else position + i
+            if errors[i]:
+                yield {"id": recipe_id, "error": errors[i]}
+                continue
+            yield {
+                "id": recipe_id,
+                "total_grams": round(total_grams, 2),
+                "nutrient_totals": dict(zip(nutrients, totals[i])),
+                "deficiencies": list(itertools.compress(nutrients, below[i])),
+                "excesses": list(itertools.compress(nutrients, above[i])),
+                "result_symbols": {
+                    nutrient: "×" if low or high else "○" for nutrient, low, high in zip(nutrients, below[i], above[i])
+                },
+                "missing_food_codes": missing[i],
+            }
+        position += len(chunk)
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+_EPS = 1e-9
+
+
+class OptimizationError(Exception):
+    """最適化問題が解けなかった場合の例外"""
+
+
+def _solve_min_grams(coefficients, max_iter=None):
+    """
+    min 1ᵀx  (s.t. coefficients @ x >= 1, x >= 0) を解き、x を返す。
+
+    双対問題 max 1ᵀy (s.t. coefficientsᵀ @ y <= 1, y >= 0) は原点が実行可能解なので、
+    スラック変数を初期基底とした単体法だけで解ける。最終表の目的関数行の
+    スラック変数の係数が主問題の解 x になる。
+    """
+    m, n = coefficients.shape
+    tableau = np.zeros((n + 1, m + n + 1), dtype=np.float64)
+    tableau[:n, :m] = coefficients.T
+    tableau[:n, m:m + n] = np.eye(n)
+    tableau[:n, -1] = 1
+    tableau[n, :m] = -1
+
+    if max_iter is None:
+        max_iter = 50 * (m + n)
+    for _ in range(max_iter):
+        entering = int(np.argmin(tableau[n, :-1]))
+        if tableau[n, entering] >= -_EPS:
+            break
+        column = tableau[:n, entering]
+        positive = column > _EPS
+        if not positive.any():
+            raise OptimizationError("候補食材では不足栄養素を補えません")
+        ratios = np.full(n, np.inf)
+        ratios[positive] = tableau[:n, -1][positive] / column[positive]
+        leaving = int(np.argmin(ratios))
+
+        tableau[leaving] /= tableau[leaving, entering]
+        factors = tableau[:, entering].copy()
+        factors[leaving] = 0
+        tableau -= np.outer(factors, tableau[leaving])
+    else:
+        raise OptimizationError("単体法が収束しませんでした")
+
+    return np.maximum(tableau[n, m:m + n], 0)
+
+
+def min_total_grams(coverage):
+    """
+    coverage (栄養素 × 食材。1gで各栄養素の基準値の何割を補えるか) で全栄養素を基準値以上にする、
+    グラム数の合計が最小の各食材のグラム数を返す。補えない場合は OptimizationError。
+    """
+    return _solve_min_grams(coverage)
+
+
+def close_gaps(matrix, selected_list, candidate_food_codes, profile):
+    """
+    候補食材を追加して全栄養素を基準値プロファイル (profile) の最小値以上にするための、
+    追加グラム数の合計が最小となる組み合わせを求める (最小値の単位は absolute のみ)。
+    追加後のレシピは profile.assess で判定するので、result_symbols には上限超過も反映される。
+    候補食材のどれにも含まれない不足栄養素は uncoverable として返し、最適化の対象から外す。
+    食材表にない (整数でない) 候補の food_code があれば ValueError を送出する。
+    """
+    rows, grams, _, _ = matrix.resolve(selected_list)
+    current = matrix.totals_vector(rows, grams)
+
+    # 候補食材を重複なく行番号に変換する
+    candidate_rows = [matrix.row_of(food_code) for food_code in candidate_food_codes]
+    unknown = [food_code for food_code, row in zip(candidate_food_codes, candidate_rows) if row is None]
+    if unknown:
+        raise ValueError(f"Unknown candidate food_code: {unknown}")
+    pool = np.array(list(dict.fromkeys(candidate_rows)), dtype=np.intp)
+
+    standards = profile.standards
+    nutrients = [nutrient for nutrient in standards if nutrient in matrix.column_index]
+    columns = np.array([matrix.column_index[nutrient] for nutrient in nutrients], dtype=np.intp)
+    minimums = np.array([standards[nutrient] for nutrient in nutrients], dtype=np.float64)
+    deficits = minimums - current[columns]
+
+    # 100gあたりの値を1gあたりに換算し、各不足量で割って「1gで不足分の何割を補えるか」にそろえる
+    per_gram = matrix.values[pool][:, columns].T.astype(np.float64) / 100
+    deficient = (minimums > 0) & (deficits > 0)
+    coverable = deficient & (per_gram.sum(axis=1) > 0)
+    uncoverable = [nutrient for nutrient, flag in zip(nutrients, deficient & ~coverable) if flag]
+
+    added = np.zeros(len(pool), dtype=np.float64)
+    if coverable.any():
+        added = _solve_min_grams(per_gram[coverable] / deficits[coverable][:, None])
+        # 表示用に 0.01g 単位で切り上げ、丸めで基準値を下回らないようにする
+        added = np.ceil(added * 100 - 1e-6) / 100
+
+    after = current + (added / 100) @ matrix.values[pool]
+    nutrient_totals = matrix.to_dict(after, standards.keys())
+    assessment = profile.assess(after, float(grams.sum() + added.sum()))
+
+    return {
+        "additions": [
+            {"food_code": int(matrix.food_codes[row]), "name": matrix.names[row], "grams": float(value)}
+            for row, value in zip(pool.tolist(), added.tolist())
+            if value > 0
+        ],
+        "total_added_grams": round(float(added.sum()), 2),
+        "uncoverable": uncoverable,
+        "nutrient_totals": nutrient_totals,
+        "excesses": assessment["excesses"],
+        "result_symbols": assessment["result_symbols"],
+    }
@@ -0,0 +1,101 @@
+import numpy as np
+
+from nutrient_engine import significant
+from recipe_store import VersionConflict
+
+
+def apply_changes(matrix, selected_list, totals, changes):
+    """
+    レシピ (selected_list) と栄養素合計ベクトル totals に、食材1件ずつの変更を差分として適用する。
+    変更は {"op": "set" | "add" | "remove", "food_code", "old_grams", "new_grams" / "grams"} のリストで、
+    合計は変更した食材の行だけを足し引きするので、1件あたり O(栄養素数) で済む。
+    返り値は (新しい selected_list, 新しい合計ベクトル, 値が変わりうる栄養素列のマスク)。
+    old_grams が現在のグラム数と一致しない場合は、別の更新を上書きしないよう VersionConflict を送出する。
+    """
+    selected_list = [dict(item) for item in selected_list]
+    totals = np.array(totals, dtype=np.float64)
+    touched = np.zeros(len(matrix.nutrients), dtype=bool)
+
+    for change in changes:
+        op = change.get('op', 'set')
+        row = matrix.row_of(change.get('food_code'))
+        if row is None:
+            raise ValueError(f"food_code {change.get('food_code')} not found")
+
+        index = next(
+            (i for i, item in enumerate(selected_list) if matrix.row_of(item['food_code']) == row), None
+        )
+        current = float(selected_list[index].get('grams', 0) or 0) if index is not None else 0.0
+        if change.get('old_grams') is not None and abs(float(change['old_grams']) - current) > 1e-6:
+            raise VersionConflict(f"food_code {change['food_code']} has {current}g, not {change['old_grams']}g")
+
+        if op == 'remove':
+            if index is None:
+                raise ValueError(f"food_code {change['food_code']} is not in the recipe")
+            new = 0.0
+            del selected_list[index]
+        elif op in ('set', 'add'):
+            if op == 'add' and index is not None:
+                raise ValueError(f"food_code {change['food_code']} is already in the recipe")
+            new = float(change.get('new_grams', change.get('grams', 100)))
+            if new < 0:
+                raise ValueError("grams must not be negative")
+            if index is None:
+                selected_list.append({
+                    'food_code': int(matrix.food_codes[row]),
+                    'grams': new,
+                    'name': matrix.names[row],
+                })
+            else:
+                selected_list[index]['grams'] = new
+        else:
+            raise ValueError(f"unknown op: {op}")
+
+        values = matrix.values[row].astype(np.float64)
+        totals += values * ((new - current) / 100)
+        touched |= values != 0
+
+    # 足し引きで残った丸め誤差 (食材を削除した後など) は 0 にそろえる
+    totals[np.abs(totals) < 1e-12] = 0
+    return selected_list, totals, touched
+
+
+def changed_fields(matrix, before, after, touched, profile, grams_before=None, grams_after=None):
+    """
+    差分適用前後の合計ベクトルから、基準値プロファイル (profile) の栄養素について
+    変化した合計値 (値が変わりうる touched の栄養素のみ)・判定記号と、
+    新たに不足した / 不足が解消した栄養素、新たに上限を超えた / 超過が解消した栄養素を返す。
+    判定は profile.evaluate で最小値・最大値・単位ごとに行うので、1000kcal あたり・乾物あたりの栄養素は
+    その栄養素の合計が変わらなくても、エネルギー・水分・合計グラム数 (grams_before / grams_after) の変化で判定が変わりうる。
+    """
+    _, below_before, above_before = profile.evaluate(before, grams_before)
+    _, below_after, above_after = profile.evaluate(after, grams_after)
+
+    nutrient_totals = {}
+    result_symbols = {}
+    deficiencies_added = []
+    deficiencies_removed = []
+    excesses_added = []
+    excesses_removed = []
+    for column, nutrient in zip(profile.columns.tolist(), profile.column_nutrients):
+        if touched[column]:
+            value = significant(after[column])
+            if value != significant(before[column]):
+                nutrient_totals[nutrient] = value
+
+        was_deficient, is_deficient = bool(below_before[column]), bool(below_after[column])
+        was_excess, is_excess = bool(above_before[column]), bool(above_after[column])
+        if (was_deficient or was_excess) != (is_deficient or is_excess):
+            result_symbols[nutrient] = "×" if is_deficient or is_excess else "○"
+        if was_deficient != is_deficient:
+            (deficiencies_added if is_deficient else deficiencies_removed).append(nutrient)
+        if was_excess != is_excess:
+            (excesses_added if is_excess else excesses_removed).append(nutrient)
+    return {
+        "nutrient_totals": nutrient_totals,
+        "result_symbols": result_symbols,
+        "deficiencies_added": deficiencies_added,
+        "deficiencies_removed": deficiencies_removed,
+        "excesses_added": excesses_added,
+        "excesses_removed": excesses_removed,
+    }
@@ -0,0 +1,312 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from optimizer import OptimizationError, min_total_grams
+
+
+logger = logging.getLogger(__name__)
+
+
+_executor = None
+_manager = None
+_executor_lock = threading.Lock()
+
+# 探索中のシャードが停止の指示を確認する間隔 (訪問した組み合わせの数)
+STOP_CHECK_INTERVAL = 256
+
+# ワーカーのシャードが完了したかを確認する間隔 (秒)。見つかったレシピは待たずにキューから受け取る
+POLL_SECONDS = 0.05
+
+
+def _mp_context():
+    # スレッドを使うサーバー (gthread) から fork すると子プロセスでロックが壊れることがあるので forkserver を使う
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def _get_executor(workers):
+    """探索用のプロセスプールを返す (最初の探索で作成し、以降の探索で使い回す)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context())
+        return _executor
+
+
+def _get_manager():
+    """
+    探索ごとの停止フラグ (Event) と結果のキュー (Queue) をワーカープロセスと共有するためのマネージャを返す
+    (プロセスプールの引数に渡せるのはマネージャのプロキシだけなので、最初の探索で起動して使い回す)
+    """
+    global _manager
+    with _executor_lock:
+        if _manager is None:
+            _manager = _mp_context().Manager()
+        return _manager
+
+
+def _suffix_max(coverage):
+    """
+    coverage: 候補食材 × 栄養素の「1gで基準値の何割を補えるか」
+    候補 t 以降の食材の coverage の栄養素ごとの最大値 (枝刈りの上界) を返す
+    """
+    suffix_max = np.zeros((len(coverage) + 1, coverage.shape[1]), dtype=np.float64)
+    if len(coverage):
+        suffix_max[:-1] = np.maximum.accumulate(coverage[::-1], axis=0)[::-1]
+    return suffix_max
+
+
+def _solve(coverage, combination, max_grams):
+    """組み合わせのグラム数 (合計が最小のもの) を返す。上限を超える・使わない食材がある場合は None"""
+    try:
+        grams = min_total_grams(coverage[list(combination)].T)
+    except OptimizationError:
+        return None
+    # 0.01g 単位で切り上げる (切り上げなので基準値を下回らない)
+    grams = np.ceil(grams * 100 - 1e-6) / 100
+    if grams.sum() > max_grams or (grams <= 0).any():
+        # 0g の食材があるものは、より少ない食材の組み合わせと同じなので返さない
+        return None
+    return grams.tolist()
+
+
+def _search_shard(search, prefixes, deadline, limit, stop, results):
+    """
+    search (coverage, sizes, max_grams) の探索のうち、
+    prefixes (候補の番号の昇順のタプル) から始まる組み合わせを深さ優先で探索し、
+    全栄養素を基準値以上にできる組み合わせを見つけるたびに results (Queue) に ("found", 組み合わせ, グラム数) を入れる。
+    deadline を過ぎるか、stop (Event) がセットされたら (件数に達した・クライアントが切断したなど) 打ち切る。
+    戻り値は探索の統計。
+
+    上限 max_grams のとき、組み合わせで補える栄養素 j の最大量は max_grams × (組み合わせ内の coverage の最大値) なので、
+    これから追加できる食材 (番号がより大きいもの) を含めても 1 に届かない栄養素があれば、その先は探索しない。
+    """
+    coverage, (min_size, max_size), max_grams = search
+    suffix_max = _suffix_max(coverage)
+    threshold = 1.0 / max_grams
+    count = len(coverage)
+
+    stats = {"visited": 0, "pruned": 0, "solved": 0, "found": 0, "timed_out": False}
+
+    def extend(combination, best):
+        if deadline is not None and time.time() > deadline:
+            stats["timed_out"] = True
+            return False
+        # 停止フラグはマネージャへの問い合わせになるので、一定の訪問数ごとに確認する
+        if stats["visited"] % STOP_CHECK_INTERVAL == 0 and stop.is_set():
+            return False
+        stats["visited"] += 1
+        if len(combination) >= min_size:
+            stats["solved"] += 1
+            grams = _solve(coverage, combination, max_grams)
+            if grams is not None:
+                results.put(("found", combination, grams))
+                stats["found"] += 1
+                if limit is not None and stats["found"] >= limit:
+                    return False
+        if len(combination) == max_size:
+            return True
+
+        start = combination[-1] + 1
+        if start >= count:
+            return True
+        # 次の食材の候補を一括で枝刈りする (追加後の最大値と、さらにその先に追加できる食材の最大値で判定)
+        reachable = np.maximum(best, coverage[start:])
+        if len(combination) + 1 < max_size:
+            reachable = np.maximum(reachable, suffix_max[start + 1:])
+        feasible = (reachable >= threshold).all(axis=1)
+        stats["pruned"] += int((~feasible).sum())
+        for index in (np.flatnonzero(feasible) + start).tolist():
+            if not extend(combination + (index,), np.maximum(best, coverage[index])):
+                return False
+        return True
+
+    for prefix in prefixes:
+        best = coverage[list(prefix)].max(axis=0)
+        if not (np.maximum(best, suffix_max[prefix[-1] + 1]) >= threshold).all():
+            stats["pruned"] += 1
+            continue
+        if not extend(tuple(prefix), best):
+            break
+    return stats
+
+
+# 条件を満たすレシピの探索
+class RecipeSearch:
+    """
+    候補食材 (pool) から min_size〜max_size 種類を選び、合計 max_grams 以下で全栄養素を基準値以上にできる
+    組み合わせを探索する。組み合わせごとのグラム数は合計が最小になるように線形計画で求める。
+
+    組み合わせの空間を先頭の食材で分割し、ProcessPoolExecutor で全コアに分けて探索する。
+    run() は見つかったレシピを見つかった順に返すジェネレータで、シャードの完了を待たずに 1 件ずつ返す。
+    終了後に stats に探索の統計が入る。max_results (件数) か time_budget (秒) に達するか、
+    run() を途中で閉じると、実行中のシャードも止めて探索を打ち切る。
+
+    候補のどの食材でも基準値に届かない栄養素は uncoverable として制約から外すので、見つかったレシピが
+    全栄養素の基準値を満たすとは限らない。各レシピには基準値プロファイル (profile) での判定結果
+    (deficiencies / excesses / result_symbols) を付けて返す。
+    """
+
+    def __init__(self, matrix, pool_food_codes, profile, min_size=3, max_size=5, max_grams=1000,
+                 max_results=None, time_budget=None, workers=None):
+        if not 1 <= min_size <= max_size:
+            raise ValueError("min_size and max_size must satisfy 1 <= min_size <= max_size")
+        if max_grams <= 0:
+            raise ValueError("max_grams must be positive")
+        if time_budget is not None and not (math.isfinite(time_budget) and time_budget > 0):
+            raise ValueError("time_budget must be a positive number of seconds")
+
+        self.matrix = matrix
+        rows = dict.fromkeys(matrix.row_of(food_code) for food_code in pool_food_codes)
+        rows.pop(None, None)
+        self.rows = np.array(sorted(rows), dtype=np.intp)
+
+        # 基準値が正の栄養素だけを制約にする
+        standards = profile.standards
+        nutrients = [
+            nutrient for nutrient, minimum in standards.items() if minimum > 0 and nutrient in matrix.column_index
+        ]
+        columns = [matrix.column_index[nutrient] for nutrient in nutrients]
+        minimums = np.array([standards[nutrient] for nutrient in nutrients], dtype=np.float64)
+        coverage = matrix.values[self.rows][:, columns].astype(np.float64) / 100 / minimums
+
+        # 候補のどの食材を max_grams 使っても基準値に届かない栄養素は、どの組み合わせでも補えないので
+        # close_gaps と同じく uncoverable として返し、制約から外す
+        reachable = coverage.max(axis=0, initial=0) * max_grams >= 1
+        self.uncoverable = [nutrient for nutrient, flag in zip(nutrients, reachable) if not flag]
+        self.nutrients = [nutrient for nutrient, flag in zip(nutrients, reachable) if flag]
+        self.coverage = coverage[:, reachable]
+        self.profile = profile
+
+        self.sizes = (min_size, min(max_size, len(self.rows)))
+        self.max_grams = float(max_grams)
+        self.max_results = max_results
+        self.time_budget = time_budget
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = {}
+
+    def _shards(self):
+        """先頭の食材 (候補が多い場合は先頭2つ) の組み合わせを、ワーカー数の数倍のシャードに振り分ける"""
+        count = len(self.rows)
+        depth = 1 if count <= 64 or self.sizes[0] == 1 else 2
+        prefixes = list(itertools.combinations(range(count), depth))
+        shard_count = max(1, min(len(prefixes), self.workers * 8))
+        # 番号の小さい先頭ほど探索範囲が広いので、順番に振り分けて偏りを減らす
+        return [prefixes[i::shard_count] for i in range(shard_count)]
+
+    def _recipe(self, combination, grams):
+        rows = self.rows[list(combination)]
+        totals = self.matrix.totals_vector(rows, np.array(grams, dtype=np.float64))
+        return {
+            "ingredients": [
+                {"food_code": int(self.matrix.food_codes[row]), "name": self.matrix.names[row], "grams": value}
+                for row, value in zip(rows.tolist(), grams)
+            ],
+            "total_grams": round(sum(grams), 2),
+            "nutrient_totals": self.matrix.to_dict(totals, self.profile.standards.keys()),
+            **self.profile.assess(totals, sum(grams)),
+        }
+
+    def run(self):
+        started = time.monotonic()
+        # 期限はワーカープロセスと共通の時計 (time.time) で渡す
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+        self.stats = {"candidates": len(self.rows), "uncoverable": self.uncoverable, "found": 0, "visited": 0,
+                      "pruned": 0, "solved": 0, "timed_out": False}
+        if len(self.rows) < self.sizes[0]:
+            self.stats["elapsed_seconds"] = 0.0
+            return
+
+        shards = self._shards()
+        if self.workers == 1 or len(shards) == 1:
+            results = self._run_inline(shards, deadline)
+        else:
+            results = self._run_pool(shards, deadline)
+
+        try:
+            for item in results:
+                if item[0] == "stats":
+                    stats = item[1]
+                    for key in ("visited", "pruned", "solved"):
+                        self.stats[key] += stats[key]
+                    self.stats["timed_out"] |= stats["timed_out"]
+                    continue
+                if self.max_results is not None and self.stats["found"] >= self.max_results:
+                    break
+                _, combination, grams = item
+                self.stats["found"] += 1
+                yield self._recipe(combination, grams)
+                if self.max_results is not None and self.stats["found"] >= self.max_results:
+                    break
+        finally:
+            results.close()
+            self.stats["elapsed_seconds"] = round(time.monotonic() - started, 3)
+
+    # _run_inline / _run_pool は ("found", 組み合わせ, グラム数) を見つかった順に、
+    # ("stats", 統計) をシャードが終わるたびに返すジェネレータ
+
+    def _run_inline(self, shards, deadline):
+        """ワーカーが 1 つの場合は、シャードを順にスレッドで探索する (見つかったものをすぐ返せるように)"""
+        search = (self.coverage, self.sizes, self.max_grams)
+        stop = threading.Event()
+        results = queue.Queue()
+
+        def work():
+            try:
+                for shard in shards:
+                    if stop.is_set():
+                        break
+                    results.put(("stats", _search_shard(search, shard, deadline, self.max_results, stop, results)))
+            except Exception as exc:
+                results.put(("error", exc))
+            finally:
+                results.put(None)
+
+        threading.Thread(target=work, name="recipe-search", daemon=True).start()
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    return
+                if item[0] == "error":
+                    raise item[1]
+                yield item
+        finally:
+            stop.set()
+
+    def _run_pool(self, shards, deadline):
+        executor = _get_executor(self.workers)
+        manager = _get_manager()
+        stop = manager.Event()
+        results = manager.Queue()
+        search = (self.coverage, self.sizes, self.max_grams)
+        pending = {
+            executor.submit(_search_shard, search, shard, deadline, self.max_results, stop, results)
+            for shard in shards
+        }
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                # 完了したシャードが見つけたものは完了前にキューに入っているので、統計より先に取り出す
+                while True:
+                    try:
+                        yield results.get_nowait()
+                    except queue.Empty:
+                        break
+                for future in done:
+                    yield "stats", future.result()
+        finally:
+            # 打ち切った場合 (件数に達した・クライアントが切断した) は、未着手のシャードを取り消し、
+            # 実行中のシャードにも停止フラグで止めさせて、プールのワーカーを次の探索に空ける
+            stop.set()
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,147 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class VersionConflict(Exception):
+    """レシピが別のリクエストで更新されていた (更新が失われる) 場合の例外"""
+
+
+# サーバー側で保持するレシピ
+class RecipeEntry:
+    """
+    レシピ (selected_list) と、その計算結果のキャッシュ。
+    version はレシピが更新されるたびに増え、計算結果は (version, データのバージョン) ごとに保持する。
+    totals は差分計算用にサーバー側で保持する (栄養素行列の version, 栄養素合計ベクトル) (プロセス内のみ)。
+    """
+
+    __slots__ = ('selected_list', 'version', 'expires', 'totals', '_results')
+
+    def __init__(self, selected_list, version, expires, totals=None):
+        self.selected_list = selected_list
+        self.version = version
+        self.expires = expires
+        self.totals = totals
+        self._results = {}
+
+    def result(self, key, compute):
+        """key (データのバージョンなど) に対する計算結果を返す。未計算なら compute() で計算して保持する"""
+        cache_key = (self.version, key)
+        if cache_key not in self._results:
+            # 古いバージョンの結果は不要なので捨てる
+            self._results = {cache_key: compute()}
+        return self._results[cache_key]
+
+
+# レシピのサーバー側ストア
+class RecipeStore:
+    """
+    レシピ ID をキーにしたレシピのストア。
+    プロセス内の LRU (最大 max_entries 件、最終アクセスから ttl 秒で失効) に加えて、
+    db_path を指定すると SQLite にも書き込み、gunicorn の別ワーカーからも同じレシピを読めるようにする
+    (db_path を指定しない場合はプロセス内のみで、ワーカーが複数あるとレシピを見失う)。
+    """
+
+    def __init__(self, max_entries=10000, ttl=86400, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(12)
+
+    def _connection(self):
+        # SQLite の接続はスレッドごとに作る (fork 後のワーカーでも安全)
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS recipe_session ('
+                'id TEXT PRIMARY KEY, selected_list TEXT NOT NULL, version INTEGER NOT NULL, expires REAL NOT NULL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def get(self, recipe_id):
+        """レシピ ID に対応する RecipeEntry を返す (無い・失効した場合は None)"""
+        if not recipe_id:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(recipe_id)
+            if entry is not None and entry.expires < now:
+                del self._entries[recipe_id]
+                entry = None
+
+        if self.db_path:
+            row = self._connection().execute(
+                'SELECT selected_list, version, expires FROM recipe_session WHERE id = ?', (recipe_id,)
+            ).fetchone()
+            if row is None or row[2] < now:
+                return None
+            # 別のワーカーで更新されていればそちらを使う
+            if entry is None or entry.version != row[1]:
+                entry = RecipeEntry(json.loads(row[0]), row[1], row[2])
+        if entry is None:
+            return None
+
+        with self._lock:
+            entry.expires = now + self.ttl
+            self._entries[recipe_id] = entry
+            self._entries.move_to_end(recipe_id)
+            self._evict()
+        return entry
+
+    def put(self, recipe_id, selected_list, expected_version=None, totals=None):
+        """
+        レシピを保存し、更新後の RecipeEntry を返す。
+        expected_version を指定した場合、保存済みの version と一致しなければ VersionConflict を送出する。
+        """
+        now = time.time()
+        with self._lock:
+            previous = self._entries.get(recipe_id)
+            version = previous.version if previous is not None else 0
+
+            if self.db_path:
+                connection = self._connection()
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    row = connection.execute('SELECT version FROM recipe_session WHERE id = ?', (recipe_id,)).fetchone()
+                    version = row[0] if row is not None else 0
+                    if expected_version is not None and expected_version != version:
+                        raise VersionConflict(f"recipe version is {version}, not {expected_version}")
+                    connection.execute(
+                        'INSERT OR REPLACE INTO recipe_session (id, selected_list, version, expires) VALUES (?, ?, ?, ?)',
+                        (recipe_id, json.dumps(selected_list, ensure_ascii=False), version + 1, now + self.ttl),
+                    )
+                    self._writes += 1
+                    if self._writes % 1000 == 0:
+                        connection.execute('DELETE FROM recipe_session WHERE expires < ?', (now,))
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+            elif expected_version is not None and expected_version != version:
+                raise VersionConflict(f"recipe version is {version}, not {expected_version}")
+
+            entry = RecipeEntry(selected_list, version + 1, now + self.ttl, totals)
+            self._entries[recipe_id] = entry
+            self._entries.move_to_end(recipe_id)
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def recipe_key(selected_list):
+    """
+    レシピの正規化ハッシュ。(food_code, grams) を並べ替えてからハッシュするので、
+    食材の順番や food_code / grams の型 ("1001" と 1001 など) が違っても同じキーになる。
+    """
+    pairs = []
+    for item in selected_list:
+        food_code = item.get('food_code')
+        try:
+            food_code = int(food_code)
+        except (TypeError, ValueError):
+            food_code = str(food_code)
+        pairs.append((str(food_code), float(item.get('grams', 0) or 0)))
+    pairs.sort()
+    return hashlib.blake2b(repr(pairs).encode('utf-8'), digest_size=16).hexdigest()
+
+
+# レシピの計算結果のキャッシュ
+class ResultCache:
+    """
+    計算結果をキーごとに保持する LRU キャッシュ (最大 max_entries 件、保存から ttl 秒で失効)。
+    version (食材データと AAFCO基準値のバージョン) が変わったら全件を破棄する。
+    """
+
+    def __init__(self, max_entries=4096, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, version, compute):
+        """key の計算結果を返す。無い・失効した場合は compute() で計算して保存する"""
+        now = time.time()
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] >= now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        # 計算中はロックを持たない (同じキーを同時に計算することはあるが、結果は同じ)
+        value = compute()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def stats(self):
+        """ヒット数・ミス数・件数を返す"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
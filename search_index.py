@@ -0,0 +1,123 @@
+import bisect
+import heapq
+import re
+import unicodedata
+
+
+# カタカナ → ひらがなの変換表 (ァ〜ヶ を ぁ〜ゖ に寄せる)
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+# 食材名の区切りとして扱う記号 (NFKC 正規化後)
+_SEPARATORS = re.compile(r'[\s<>()\[\]{}「」『』【】、。・,/]+')
+
+
+def normalize(text):
+    """
+    検索用に文字列を正規化する。
+    全角/半角 (英数字・記号・半角カナ) と互換漢字は NFKC で、カタカナはひらがなに、英字は小文字にそろえる。
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    return text.translate(_KATAKANA_TO_HIRAGANA)
+
+
+def _ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _prefix_range(sorted_keys, prefix):
+    """(文字列, id) のソート済みリストから、文字列が prefix で始まる要素の id を返す"""
+    start = bisect.bisect_left(sorted_keys, (prefix,))
+    end = bisect.bisect_left(sorted_keys, (prefix + '\U0010ffff',), start)
+    return [i for _, i in sorted_keys[start:end]]
+
+
+# 食材名のメモリ内検索インデックス
+class IngredientSearchIndex:
+    """
+    正規化した食材名 (区切り記号を除いたもの) の n-gram 転置インデックス。
+    結果は 完全一致 > 前方一致 > 語の前方一致 > 部分一致 の順で、同順位は名前の短い順に並べる。
+    内部の id をあらかじめ (名前の長さ, 食品番号) 順に振っておくことで、
+    各順位の中では id の小さい順に取り出すだけで済むようにしている。
+    数字だけのクエリは食品番号の前方一致としても検索する。
+
+    表記ゆれの吸収は normalize() の範囲 (全角/半角・カタカナ/ひらがな・大文字/小文字) に限る。
+    食材表に読みの列がないため、漢字で書かれた食材名は読み (かな) では検索できない
+    (例: 「鶏」は「とり」では見つからない)。読みで引けるようにするには、
+    読みを normalize() したキーを names と一緒に登録する必要がある。
+    """
+
+    def __init__(self, food_codes, names):
+        entries = []
+        for food_code, name in zip(food_codes, names):
+            normalized = normalize(name)
+            compact = _SEPARATORS.sub('', normalized)
+            entries.append((len(compact), int(food_code), name, normalized, compact))
+        entries.sort(key=lambda entry: entry[:2])
+
+        self.food_codes = [entry[1] for entry in entries]
+        self.names = [entry[2] for entry in entries]
+        self._compact = [entry[4] for entry in entries]
+        self._unigrams = {}
+        self._bigrams = {}
+        sorted_words = set()
+        for i, (_, _, _, normalized, compact) in enumerate(entries):
+            for gram in _ngrams(compact, 1):
+                self._unigrams.setdefault(gram, set()).add(i)
+            for gram in _ngrams(compact, 2):
+                self._bigrams.setdefault(gram, set()).add(i)
+            sorted_words.update((word, i) for word in _SEPARATORS.split(normalized) if word)
+
+        self._sorted_compact = sorted((compact, i) for i, compact in enumerate(self._compact))
+        self._sorted_words = sorted(sorted_words)
+        self._sorted_codes = sorted((str(food_code), i) for i, food_code in enumerate(self.food_codes))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _substring_matches(self, term):
+        """正規化済みの term を部分文字列として含む食材の id 集合を返す"""
+        if len(term) == 1:
+            return self._unigrams.get(term, set())
+        if len(term) == 2:
+            return self._bigrams.get(term, set())
+        postings = [self._bigrams.get(gram) for gram in _ngrams(term, 2)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        return {i for i in set.intersection(*postings) if term in self._compact[i]}
+
+    def search(self, query, limit=50):
+        """
+        クエリに一致する食材を関連度順に最大 limit 件返す。
+        空白などで区切られた複数語のクエリは、すべての語を含む食材を返す。
+        返り値は {"food_code", "name"} のリスト。
+        """
+        terms = [term for term in _SEPARATORS.split(normalize(query)) if term]
+        if not terms or limit <= 0:
+            return []
+
+        term = terms[0]
+        matches = self._substring_matches(term)
+        for other in terms[1:]:
+            matches = matches & self._substring_matches(other)
+
+        # 順位ごとに候補を集め、上位 limit 件がそろった時点で打ち切る
+        prefixed = [i for i in _prefix_range(self._sorted_compact, term) if i in matches]
+        tiers = [
+            [i for i in prefixed if self._compact[i] == term],
+            prefixed,
+            [i for i in _prefix_range(self._sorted_words, term) if i in matches],
+            matches,
+        ]
+        if term.isdigit() and len(terms) == 1:
+            tiers.insert(0, _prefix_range(self._sorted_codes, term))
+
+        results = []
+        seen = set()
+        for tier in tiers:
+            for i in heapq.nsmallest(limit - len(results), set(tier) - seen):
+                seen.add(i)
+                results.append({"food_code": self.food_codes[i], "name": self.names[i]})
+            if len(results) >= limit:
+                break
+        return results
@@ -0,0 +1,163 @@
+import hashlib
+import math
+
+import numpy as np
+
+from nutrient_engine import significant_array
+
+
+# 基準値の単位
+#   absolute     … レシピ全体の合計量
+#   per_1000kcal … エネルギー 1000kcal あたりの量 (ENERC_KCAL で正規化)
+#   dry_matter   … 乾物 100g あたりの量 (合計グラム数から WATER を引いた乾物量で正規化)
+BASES = ('absolute', 'per_1000kcal', 'dry_matter')
+
+ENERGY = 'ENERC_KCAL'
+WATER = 'WATER'
+
+
+# 基準値プロファイル
+class StandardsProfile:
+    """
+    1つの基準値プロファイル (成長期・繁殖用 / 成犬維持用など) を、栄養素行列の列順にそろえた
+    最小値・最大値・単位のベクトルにしたもの。
+    基準値のない栄養素は最小値 -inf・最大値 inf にしてあるので、全栄養素・全レシピを比較1回で判定できる。
+    """
+
+    def __init__(self, name, nutrients, minimums, maximums=None, bases=None):
+        self.name = name
+        self.nutrients = list(nutrients)
+        column_index = {nutrient: col for col, nutrient in enumerate(self.nutrients)}
+        size = len(self.nutrients)
+        self.minimum = np.full(size, -np.inf)
+        self.maximum = np.full(size, np.inf)
+        self.basis = np.zeros(size, dtype=np.int8)
+        maximums = maximums or {}
+        bases = bases or {}
+
+        # 基準値の辞書 (プロファイルに書かれた順。行列にない栄養素も含む)
+        self.standards = {nutrient: float(value) for nutrient, value in minimums.items()}
+        self.maximums = {nutrient: float(value) for nutrient, value in maximums.items()}
+        for nutrient, basis in bases.items():
+            if basis not in BASES:
+                raise ValueError(f"Unknown basis for {nutrient} in profile {name}: {basis}")
+        self.bases = {nutrient: bases.get(nutrient, 'absolute') for nutrient in self.standards}
+
+        for nutrient, value in self.standards.items():
+            if nutrient in column_index:
+                self.minimum[column_index[nutrient]] = value
+        for nutrient, value in self.maximums.items():
+            if nutrient in column_index:
+                self.maximum[column_index[nutrient]] = value
+        for nutrient, basis in bases.items():
+            if nutrient in column_index:
+                self.basis[column_index[nutrient]] = BASES.index(basis)
+
+        # 判定結果に含める列 (プロファイルに書かれた栄養素のうち行列にあるもの)
+        self.columns = np.array(
+            [column_index[nutrient] for nutrient in self.standards if nutrient in column_index], dtype=np.intp
+        )
+        self.column_nutrients = [self.nutrients[col] for col in self.columns.tolist()]
+
+        self._per_kcal = self.basis == BASES.index('per_1000kcal')
+        self._dry_matter = self.basis == BASES.index('dry_matter')
+        if self._per_kcal.any() and ENERGY not in column_index:
+            raise ValueError(f"Profile {name} uses per_1000kcal but {ENERGY} is not available")
+        if self._dry_matter.any() and WATER not in column_index:
+            raise ValueError(f"Profile {name} uses dry_matter but {WATER} is not available")
+        self._energy_col = column_index.get(ENERGY)
+        self._water_col = column_index.get(WATER)
+
+        digest = hashlib.sha256(name.encode('utf-8'))
+        for array in (self.minimum, self.maximum, self.basis):
+            digest.update(array.tobytes())
+        self.version = digest.hexdigest()[:16]
+
+    @property
+    def needs_grams(self):
+        """乾物基準の栄養素があり、判定にレシピの合計グラム数が必要か"""
+        return bool(self._dry_matter.any())
+
+    def normalize(self, totals, total_grams=None):
+        """
+        合計 (栄養素数、またはレシピ数 × 栄養素数) を各栄養素の基準の単位に換算する。
+        エネルギーや乾物量が 0 のレシピは、換算後の値を 0 とする。
+        """
+        totals = np.asarray(totals, dtype=np.float64)
+        if not (self._per_kcal.any() or self._dry_matter.any()):
+            return totals
+        values = np.atleast_2d(totals).copy()
+
+        if self._per_kcal.any():
+            energy = values[:, self._energy_col].copy()
+            factor = np.divide(1000.0, energy, out=np.zeros_like(energy), where=energy > 0)
+            values[:, self._per_kcal] *= factor[:, None]
+
+        if self._dry_matter.any():
+            if total_grams is None:
+                raise ValueError(f"Profile {self.name} needs total grams for dry matter basis")
+            dry = np.atleast_1d(np.asarray(total_grams, dtype=np.float64)) - np.atleast_2d(totals)[:, self._water_col]
+            factor = np.divide(100.0, dry, out=np.zeros_like(dry), where=dry > 0)
+            values[:, self._dry_matter] *= factor[:, None]
+
+        return values[0] if totals.ndim == 1 else values
+
+    def evaluate(self, totals, total_grams=None):
+        """
+        合計を基準値と比較し、(換算後の値, 最小値未満, 最大値超過) の配列を返す。
+        totals が レシピ数 × 栄養素数 なら全レシピをまとめて比較する。
+        比較は表示と同じ有効数字7桁に丸めた値で行う (表示が基準値と同じなのに不足と判定しないため)。
+        """
+        values = self.normalize(totals, total_grams)
+        rounded = significant_array(values)
+        return values, rounded < self.minimum, rounded > self.maximum
+
+    def assess(self, totals, total_grams=None):
+        """1レシピ分の判定結果 {deficiencies, excesses, result_symbols} を返す"""
+        _, below, above = self.evaluate(totals, total_grams)
+        below = below[self.columns].tolist()
+        above = above[self.columns].tolist()
+        return {
+            "deficiencies": [nutrient for nutrient, flag in zip(self.column_nutrients, below) if flag],
+            "excesses": [nutrient for nutrient, flag in zip(self.column_nutrients, above) if flag],
+            "result_symbols": {
+                nutrient: "×" if low or high else "○"
+                for nutrient, low, high in zip(self.column_nutrients, below, above)
+            },
+        }
+
+    def describe(self):
+        """プロファイルの内容 (API で返す形式)"""
+        return {
+            "name": self.name,
+            "standards": [
+                {
+                    "nutrient": nutrient,
+                    "minimum": minimum,
+                    "maximum": self.maximums.get(nutrient),
+                    "basis": self.bases[nutrient],
+                }
+                for nutrient, minimum in self.standards.items()
+            ],
+        }
+
+
+def load_profiles(df, nutrients):
+    """
+    profile / nutrient / minimum / maximum / basis 列の DataFrame から
+    {プロファイル名: StandardsProfile} を作る (プロファイルの順序は DataFrame の順)
+    """
+    profiles = {}
+    for name, rows in df.groupby('profile', sort=False):
+        records = rows.to_dict('records')
+        profiles[name] = StandardsProfile(
+            name,
+            nutrients,
+            minimums={record['nutrient']: record['minimum'] for record in records},
+            maximums={
+                record['nutrient']: record['maximum'] for record in records
+                if record.get('maximum') is not None and not math.isnan(record['maximum'])
+            },
+            bases={record['nutrient']: record.get('basis') or 'absolute' for record in records},
+        )
+    return profiles
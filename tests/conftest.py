@@ -0,0 +1,35 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+
+# リポジトリ直下のモジュール (app.py, standards.py など) を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def dogfood():
+    """
+    一時ディレクトリの DB・スナップショット・レシピストアを使うように設定してから app を import し、
+    create_app() でデータをロードしたモジュールを返す (instance/ の下は書き換えない)。
+    """
+    directory = tempfile.mkdtemp(prefix='dogfood-test-')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, 'database.db')
+    os.environ['RECIPE_STORE_PATH'] = os.path.join(directory, 'recipes.db')
+
+    import ingredient_data
+    ingredient_data.SNAPSHOT_DIR = os.path.join(directory, 'snapshots')
+
+    import app as dogfood
+    dogfood.create_app()
+    yield dogfood
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def client(dogfood):
+    """Cookie (レシピID) を共有しないよう、テストごとに新しいテストクライアントを返す"""
+    return dogfood.app.test_client()
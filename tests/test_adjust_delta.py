@@ -0,0 +1,61 @@
+import pytest
+
+
+def saved_recipe(dogfood, client):
+    """POST /adjust でレシピを保存し、(レシピ, version) を返す"""
+    recipe = [
+        {'food_code': item['food_code'], 'grams': 100, 'name': item['name']}
+        for item in dogfood.nutrient_matrix.catalog()[:3]
+    ]
+    response = client.post('/adjust', json={'selected_ingredients': recipe})
+    return recipe, response.json['version']
+
+
+def test_delta_updates_recipe_and_totals(dogfood, client):
+    recipe, version = saved_recipe(dogfood, client)
+    food_code = recipe[0]['food_code']
+    response = client.post('/adjust/delta', json={
+        'version': version,
+        'changes': [{'op': 'set', 'food_code': food_code, 'old_grams': 100, 'new_grams': 250}],
+    })
+    assert response.status_code == 200, response.data
+    assert response.json['version'] == version + 1
+    assert response.json['total_grams'] == 450
+
+    # 変化した栄養素の合計は、レシピ全体を計算し直した値と一致する
+    recipe[0]['grams'] = 250
+    full = client.post('/calculate-nutrients', json={'selected_ingredients': recipe}).json['nutrient_totals']
+    assert response.json['nutrient_totals']
+    for nutrient, value in response.json['nutrient_totals'].items():
+        assert value == pytest.approx(full[nutrient])
+
+
+def test_delta_with_stale_version_conflicts(dogfood, client):
+    """別のタブなどでレシピが更新されていたら 409 と現在の version を返し、変更は適用しない"""
+    recipe, version = saved_recipe(dogfood, client)
+    change = {'op': 'set', 'food_code': recipe[0]['food_code'], 'old_grams': 100, 'new_grams': 200}
+    assert client.post('/adjust/delta', json={'version': version, 'changes': [change]}).status_code == 200
+
+    response = client.post('/adjust/delta', json={'version': version, 'changes': [change]})
+    assert response.status_code == 409
+    assert response.json['version'] == version + 1
+
+
+def test_delta_with_stale_grams_conflicts(dogfood, client):
+    """old_grams が保存済みのグラム数と一致しない場合も 409 を返す"""
+    recipe, version = saved_recipe(dogfood, client)
+    change = {'op': 'set', 'food_code': recipe[0]['food_code'], 'old_grams': 90, 'new_grams': 200}
+    response = client.post('/adjust/delta', json={'version': version, 'changes': [change]})
+    assert response.status_code == 409
+    assert response.json['version'] == version
+
+    # レシピは変わっていないので、同じ version で正しい old_grams なら適用できる
+    change['old_grams'] = 100
+    response = client.post('/adjust/delta', json={'version': version, 'changes': [change]})
+    assert response.status_code == 200
+    assert response.json['version'] == version + 1
+
+
+def test_delta_without_recipe_is_not_found(client):
+    response = client.post('/adjust/delta', json={'version': 1, 'changes': []})
+    assert response.status_code == 404
@@ -0,0 +1,70 @@
+import orjson
+
+
+RECIPE = [{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 50}]
+
+
+def ndjson(*lines):
+    return b''.join(line if isinstance(line, bytes) else orjson.dumps(line) + b'\n' for line in lines)
+
+
+def test_batch_evaluate_json(client):
+    response = client.post('/batch/evaluate', json={'recipes': [{'id': 'a', 'selected_list': RECIPE}, RECIPE]})
+    results = [orjson.loads(line) for line in response.data.splitlines()]
+    assert response.status_code == 200
+    assert [result['id'] for result in results] == ['a', 1]
+    assert results[0]['total_grams'] == 150.0
+    assert results[0]['nutrient_totals'] == results[1]['nutrient_totals']
+
+
+def test_batch_evaluate_json_rejects_malformed_recipes_up_front(client):
+    response = client.post('/batch/evaluate', json={'recipes': [RECIPE, [1, 2]]})
+    assert response.status_code == 400
+    assert response.json['error'].startswith('recipe 1:')
+
+    response = client.post('/batch/evaluate', json={'recipes': {'selected_list': RECIPE}})
+    assert response.status_code == 400
+
+
+def test_batch_evaluate_ndjson_reports_bad_lines_in_place(client):
+    """NDJSON は形式が正しくない行の位置に {"id", "error"} を返し、残りのレシピの評価を続ける"""
+    body = ndjson(
+        {'id': 'a', 'selected_list': RECIPE},
+        [1, 2],
+        b'not json\n',
+        {'selected_list': [{'food_code': 1001, 'grams': 'x'}]},
+        {'id': 'e', 'selected_list': RECIPE},
+    )
+    response = client.post('/batch/evaluate', data=body, content_type='application/x-ndjson')
+    results = [orjson.loads(line) for line in response.data.splitlines()]
+    assert [result['id'] for result in results] == ['a', 1, 2, 3, 'e']
+    assert [('error' in result) for result in results] == [False, True, True, True, False]
+    assert results[2]['error'].startswith('invalid JSON')
+
+
+def test_batch_evaluate_limits_recipe_count(dogfood, client, monkeypatch):
+    monkeypatch.setitem(dogfood.app.config, 'BATCH_MAX_RECIPES', 2)
+    response = client.post('/batch/evaluate', json={'recipes': [RECIPE] * 3})
+    assert response.status_code == 400
+
+    body = ndjson(*[RECIPE] * 3)
+    response = client.post('/batch/evaluate', data=body, content_type='application/x-ndjson')
+    results = [orjson.loads(line) for line in response.data.splitlines()]
+    assert len(results) == 3
+    assert 'nutrient_totals' in results[1]
+    assert results[2] == {'error': 'Too many recipes (max 2)'}
+
+
+def test_batch_standards_parameter_does_not_trigger_profiler(dogfood, client, monkeypatch):
+    """基準値プロファイルは ?standards= で指定する (?profile= はリクエストのプロファイラ用)"""
+    monkeypatch.setitem(dogfood.app.config, 'PROFILING_ENABLED', True)
+    name = next(iter(dogfood.standards_profiles))
+    body = b'{"id": "a", "items": [{"food_code": 1001, "grams": 100}]}\n'
+    response = client.post(f'/batch/evaluate?standards={name}', data=body,
+                           content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert b'"id":"a"' in response.data
+
+    response = client.post('/batch/evaluate', json={'recipes': [], 'standards': 'no such profile'})
+    assert response.status_code == 400
@@ -0,0 +1,50 @@
+import os
+import time
+
+import columnar_store
+from data_reload import write_manifest
+from nutrient_engine import NutrientMatrix
+
+
+def matrix(value):
+    return NutrientMatrix.from_rows([(1001, 'a', value, 1.0), (1002, 'b', 2.0, value)], ['P', 'CA'])
+
+
+def write(value, directory):
+    path = columnar_store.write_store(matrix(value), str(directory))
+    # mtime の順序を確実にする
+    time.sleep(0.01)
+    return path
+
+
+def stores(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith('nutrients-'))
+
+
+def test_write_store_roundtrip(tmp_path):
+    directory = tmp_path / 'nutrients'
+    original = matrix(3.0)
+    opened = columnar_store.open_store(columnar_store.write_store(original, str(directory)))
+    assert opened.version == original.version
+    assert opened.food_codes.tolist() == [1001, 1002]
+    assert opened.values.tolist() == original.values.tolist()
+
+
+def test_write_store_keeps_previous_generation(tmp_path):
+    """新しいストアを書いても直前の世代のストアは残し、それより古いものを削除する"""
+    directory = tmp_path / 'nutrients'
+    first, second, third = (write(value, directory) for value in (1.0, 2.0, 3.0))
+    assert stores(directory) == sorted(os.path.basename(p) for p in (second, third))
+    assert columnar_store.open_store(second).values[0, 0] == 2.0
+
+
+def test_write_store_keeps_store_referenced_by_manifest(tmp_path):
+    directory = tmp_path / 'nutrients'
+    first = write(1.0, directory)
+    write_manifest({"generation": 1, "store": first}, str(tmp_path))
+    second, third = write(2.0, directory), write(3.0, directory)
+    assert stores(directory) == sorted(os.path.basename(p) for p in (first, second, third))
+
+    write_manifest({"generation": 3, "store": third}, str(tmp_path))
+    fourth = write(4.0, directory)
+    assert stores(directory) == sorted(os.path.basename(p) for p in (third, fourth))
@@ -0,0 +1,107 @@
+import pytest
+
+import data_reload
+
+
+def test_adopt_loads_standards_by_manifest_hash(dogfood, monkeypatch):
+    """別のワーカーの世代を開くときは、現在の xlsx ではなくマニフェストのハッシュのスナップショットを使う"""
+    manifest = data_reload.read_manifest()
+    assert manifest["sources"]["aafco_standards.xlsx"]
+
+    def parse(path):
+        raise AssertionError("adopt must not parse the current aafco_standards.xlsx")
+    monkeypatch.setattr(dogfood, 'read_aafco_standards', parse)
+
+    data = dogfood.adopt_data_generation(manifest)
+    current = dogfood.reloader.current
+    assert data.generation == manifest["generation"]
+    assert list(data.profiles) == list(current.profiles)
+    assert data.default_profile.version == current.default_profile.version
+
+    # スナップショットの無いハッシュは開けない (Reloader は作り直す)
+    stale = dict(manifest, sources=dict(manifest["sources"], **{"aafco_standards.xlsx": "0" * 64}))
+    with pytest.raises(OSError):
+        dogfood.adopt_data_generation(stale)
+
+
+class FakeSource:
+    """build / adopt の呼び出しを記録し、DataGeneration の代わりになる世代を作る"""
+
+    def __init__(self):
+        self.built = []
+        self.adopted = []
+        self.installed = []
+
+    def build(self, generation, reimport):
+        self.built.append((generation, reimport))
+        return data_reload.DataGeneration(generation, [], None, {}, None), {"store": None}
+
+    def adopt(self, manifest):
+        self.adopted.append(manifest["generation"])
+        return data_reload.DataGeneration(manifest["generation"], [], None, {}, None)
+
+    def reloader(self, source, directory):
+        return data_reload.Reloader(
+            [str(source)], self.build, self.adopt, on_install=self.installed.append,
+            directory=str(directory), check_interval=0,
+        )
+
+
+def test_reloader_builds_once_and_other_workers_adopt(tmp_path):
+    source = tmp_path / 'ingredients.xlsx'
+    source.write_bytes(b'version 1')
+    worker1, worker2 = FakeSource(), FakeSource()
+    reloader1 = worker1.reloader(source, tmp_path)
+    reloader2 = worker2.reloader(source, tmp_path)
+
+    assert reloader1.load().generation == 1
+    assert worker1.built == [(1, False)]
+    assert data_reload.read_manifest(str(tmp_path))["generation"] == 1
+
+    # 元データが変わっていなければ、別のワーカーは公開された世代を取り込む
+    assert reloader2.load().generation == 1
+    assert worker2.built == [] and worker2.adopted == [1]
+    assert reloader1.load() is reloader1.current and worker1.built == [(1, False)]
+
+    # 元データが変わると新しい世代を作り (DB に取り込み直す)、ほかのワーカーは refresh() で取り込む
+    source.write_bytes(b'version 2')
+    reloader1.reload(wait=True)
+    assert reloader1.current.generation == 2 and worker1.built[-1] == (2, True)
+    reloader2.refresh()
+    assert reloader2.current.generation == 2 and worker2.adopted == [1, 2]
+    assert [data.generation for data in worker2.installed] == [1, 2]
+
+    # force なら元データが同じでも作り直す
+    assert reloader2.load(force=True).generation == 3
+    assert worker2.built == [(3, True)]
+
+
+def test_reloader_rebuilds_when_adopt_fails(tmp_path):
+    source = tmp_path / 'ingredients.xlsx'
+    source.write_bytes(b'version 1')
+    worker1, worker2 = FakeSource(), FakeSource()
+    worker1.reloader(source, tmp_path).load()
+
+    def adopt(manifest):
+        raise OSError("store was removed")
+    worker2.adopt = adopt
+    assert worker2.reloader(source, tmp_path).load().generation == 2
+    assert worker2.built == [(2, False)]
+
+
+def test_request_keeps_its_generation_during_reload(dogfood):
+    """リクエストの途中で世代が差し替わっても、そのリクエストは最初に参照した世代を使い続ける"""
+    reloader = dogfood.reloader
+    old = reloader.current
+    new = data_reload.DataGeneration(old.generation + 1, old.matrix, old.search_index, old.profiles,
+                                     old.default_profile)
+    try:
+        with dogfood.app.test_request_context():
+            assert dogfood.current_data() is old
+            reloader.current = new
+            assert dogfood.current_data() is old
+            assert dogfood.nutrient_matrix.version == old.matrix.version
+        with dogfood.app.test_request_context():
+            assert dogfood.current_data() is new
+    finally:
+        reloader.current = old
@@ -0,0 +1,44 @@
+import gzip
+
+import http_cache
+
+
+def counting_gzip(monkeypatch):
+    calls = []
+    compress = gzip.compress
+
+    def wrapper(data, *args, **kwargs):
+        calls.append(len(data))
+        return compress(data, *args, **kwargs)
+    monkeypatch.setattr(http_cache.gzip, 'compress', wrapper)
+    return calls
+
+
+def test_paginated_ingredients_are_compressed_once(client, monkeypatch):
+    calls = counting_gzip(monkeypatch)
+    url = '/ingredients?limit=20&cursor=0&fields=food_code,name,P'
+    first = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    second = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert first.status_code == second.status_code == 200
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert first.data == second.data and first.headers['ETag'] == second.headers['ETag']
+    assert len(calls) == 1
+
+
+def test_payload_compresses_only_requested_encoding(client, monkeypatch):
+    calls = counting_gzip(monkeypatch)
+    response = client.get('/ingredients?limit=5&cursor=0')
+    assert response.status_code == 200 and 'Content-Encoding' not in response.headers
+    assert calls == []
+    assert response.json['ingredients'] and 'next_cursor' in response.json
+
+
+def test_cached_payload_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(http_cache, 'MAX_PAYLOADS', 2)
+    monkeypatch.setattr(http_cache, '_payloads', http_cache.OrderedDict())
+    a = http_cache.cached_payload('a', 1, lambda: b'a')
+    http_cache.cached_payload('b', 1, lambda: b'b')
+    assert http_cache.cached_payload('a', 1, lambda: b'x') is a
+    http_cache.cached_payload('c', 1, lambda: b'c')
+    assert list(http_cache._payloads) == ['a', 'c']
+    assert http_cache.cached_payload('a', 2, lambda: b'new').body == b'new'
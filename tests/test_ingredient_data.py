@@ -0,0 +1,71 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+import ingredient_data
+
+
+def ingredient_frame(rows):
+    """food_code, name と栄養素の列 (指定しないものは 1.0) からなる Excel 相当の DataFrame を作る"""
+    columns = list(ingredient_data.INGREDIENT_COLUMNS)
+    records = []
+    for food_code, values in rows:
+        record = dict.fromkeys(columns[2:], 1.0)
+        record.update({'食品番号': food_code, '食品名': f'食材{food_code}'})
+        record.update(values)
+        records.append(record)
+    return pd.DataFrame(records, columns=columns)
+
+
+def test_clean_ingredients_missing_values_are_zero(caplog):
+    """空欄と Tr / N/A / Undefined は 0 として取り込み、警告は出さない"""
+    df = ingredient_frame([
+        (1, {'水分': 'Tr', 'リン': 'N/A', '鉄': 'Undefined', '銅': np.nan}),
+    ])
+    with caplog.at_level(logging.WARNING, logger='ingredient_data'):
+        cleaned = ingredient_data.clean_ingredients(df)
+
+    row = cleaned.iloc[0]
+    assert (row['WATER'], row['P'], row['FE'], row['CU']) == (0, 0, 0, 0)
+    assert row['ENERC_KCAL'] == 1.0
+    assert caplog.records == []
+
+
+def test_clean_ingredients_logs_unparseable_cells(caplog):
+    """それ以外の数値に変換できない値は 0 として取り込み、食品番号・列・値を警告する"""
+    df = ingredient_frame([(1, {'ナトリウム': '(0.1)'}), (2, {'カルシウム': '-'})])
+    with caplog.at_level(logging.WARNING, logger='ingredient_data'):
+        cleaned = ingredient_data.clean_ingredients(df)
+
+    assert cleaned['NAT'].tolist() == [0.0, 1.0]
+    assert cleaned['CA'].tolist() == [1.0, 0.0]
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 2
+    assert 'NAT' in messages[0] and "'(0.1)'" in messages[0] and '1' in messages[0]
+    assert 'CA' in messages[1] and "'-'" in messages[1]
+
+
+def test_read_excel_cached_removes_stale_snapshots(tmp_path):
+    """新しいスナップショットを書いたら、古いハッシュと name を変える前のスナップショットを削除する"""
+    source = tmp_path / 'aafco_standards.xlsx'
+    source.write_bytes(b'version 1')
+    snapshots = tmp_path / 'snapshots'
+    snapshots.mkdir()
+    for filename in ('aafco_standards-0123456789abcdef.json', 'aafco_standards-0123456789abcdef.npy',
+                     'aafco_profiles-0123456789abcdef.json', 'ingredients-0123456789abcdef.json'):
+        (snapshots / filename).write_text('{}')
+
+    def parse(path):
+        return pd.DataFrame({'value': [1.0, 2.0]})
+
+    df = ingredient_data.read_excel_cached(str(source), parse, str(snapshots), name='aafco_profiles')
+    assert df['value'].tolist() == [1.0, 2.0]
+    current = 'aafco_profiles-' + ingredient_data.file_hash(str(source))[:16]
+    assert sorted(p.name for p in snapshots.iterdir()) == [
+        current + '.json', current + '.npy', 'ingredients-0123456789abcdef.json',
+    ]
+
+    # 2回目はスナップショットから読み込む
+    df = ingredient_data.read_excel_cached(str(source), None, str(snapshots), name='aafco_profiles')
+    assert df['value'].tolist() == [1.0, 2.0]
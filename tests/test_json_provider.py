@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+
+def test_dumps_honors_json_arguments(dogfood):
+    provider = dogfood.app.json
+    obj = {'b': 1, 'a': np.float32(0.1)}
+    assert provider.dumps(obj) == '{"b":1,"a":0.1}'
+    assert provider.dumps(obj, sort_keys=True) == '{"a":0.1,"b":1}'
+    assert provider.dumps(obj, indent=2, sort_keys=True) == '{\n  "a": 0.1,\n  "b": 1\n}'
+    assert provider.dumps(obj, separators=(',', ':')) == '{"b":1,"a":0.1}'
+
+
+@pytest.mark.parametrize('kwargs', [{'indent': 4}, {'separators': (', ', ': ')}, {'ensure_ascii': True}])
+def test_dumps_rejects_unsupported_arguments(dogfood, kwargs):
+    with pytest.raises(TypeError):
+        dogfood.app.json.dumps({}, **kwargs)
+
+
+def test_tojson_sorts_keys_and_escapes_html(dogfood):
+    with dogfood.app.app_context():
+        rendered = dogfood.app.jinja_env.from_string('{{ value | tojson }}').render(value={'b': '</script>', 'a': 1})
+    assert rendered == '{"a":1,"b":"\\u003c/script\\u003e"}'
+
+
+def test_adjust_embeds_preserialized_labels(dogfood, client):
+    response = client.get('/adjust')
+    assert response.status_code == 200
+    with dogfood.app.test_request_context():
+        labels = dogfood.static_json('nutrient_labels', dogfood.data_version(), None)
+    assert ('const nutrientLabels = ' + str(labels) + ';').encode() in response.data
@@ -0,0 +1,51 @@
+from nutrient_engine import NutrientMatrix
+from optimizer import close_gaps
+from standards import StandardsProfile
+
+
+RECIPE = [{'food_code': 1001, 'grams': 100}]
+
+
+def test_optimize_with_candidates(dogfood, client):
+    candidates = [item['food_code'] for item in dogfood.nutrient_matrix.catalog()[:50]]
+    response = client.post('/optimize', json={'selected_list': RECIPE, 'candidates': candidates})
+    assert response.status_code == 200, response.data
+    assert {item['food_code'] for item in response.json['additions']} <= set(candidates)
+
+
+def test_optimize_rejects_malformed_suggestions(client):
+    for suggestions in ({"CA": [{"name": "x"}]}, {"CA": "x"}, ["CA"]):
+        response = client.post('/optimize', json={'selected_list': RECIPE, 'suggestions': suggestions})
+        assert response.status_code == 400, suggestions
+
+
+def test_optimize_reports_unknown_candidates(client):
+    """整数でない・食材表にない候補は黙って除かずに 400 で知らせる"""
+    response = client.post('/optimize', json={'selected_list': RECIPE, 'candidates': [1001, 'abc', 99999999]})
+    assert response.status_code == 400
+    assert "'abc'" in response.json['error'] and '99999999' in response.json['error']
+
+    response = client.post('/optimize', json={'selected_list': RECIPE, 'candidates': 1001})
+    assert response.status_code == 400
+
+
+def test_close_gaps_judges_with_profile():
+    """追加後のレシピは最大値も含めてプロファイルで判定する"""
+    matrix = NutrientMatrix.from_rows([(1, 'base', 0.0, 0.0), (2, 'both', 1.0, 2.0)], ['P', 'CA'])
+    profile = StandardsProfile('test', ['P', 'CA'], {'P': 1.0, 'CA': 0.5}, maximums={'CA': 1.5})
+    result = close_gaps(matrix, [{'food_code': 1, 'grams': 100}], [2], profile)
+    assert result["additions"] == [{'food_code': 2, 'name': 'both', 'grams': 100.0}]
+    assert result["result_symbols"] == {'P': '○', 'CA': '×'}
+    assert result["excesses"] == ['CA']
+
+
+def test_optimize_rejects_non_absolute_standards(dogfood, client, monkeypatch):
+    nutrients = dogfood.nutrient_matrix.nutrients
+    profile = StandardsProfile('per kcal', nutrients, {'CA': 1.0}, bases={'CA': 'per_1000kcal'})
+    monkeypatch.setattr(dogfood, 'get_profile', lambda name=None: profile)
+    response = client.post('/optimize', json={'selected_list': RECIPE, 'candidates': [1001]})
+    assert response.status_code == 400
+
+    monkeypatch.undo()
+    response = client.post('/optimize', json={'selected_list': RECIPE, 'candidates': [1001], 'standards': 'nope'})
+    assert response.status_code == 400
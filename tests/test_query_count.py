@@ -0,0 +1,46 @@
+from sqlalchemy import text
+
+
+SMALL_RECIPE = [{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 50}]
+
+
+def large_recipe(dogfood, size=30):
+    return [
+        {'food_code': item['food_code'], 'grams': 10 + i, 'name': item['name']}
+        for i, item in enumerate(dogfood.nutrient_matrix.catalog()[:size])
+    ]
+
+
+def query_count(response):
+    assert response.status_code == 200, response.data[:200]
+    return int(response.headers['X-Query-Count'])
+
+
+def test_query_count_header_counts_sql(dogfood):
+    """X-Query-Count の元になる g.query_count はリクエスト中の SQL の実行回数を数える"""
+    with dogfood.app.test_request_context():
+        dogfood.db.session.execute(text('SELECT 1'))
+        dogfood.db.session.execute(text('SELECT 2'))
+        assert dogfood.g.query_count == 2
+
+
+def test_calculate_does_not_query_per_item(dogfood, client):
+    """/calculate は栄養素行列から引き当てるので、食材数に関わらず SQL を実行しない"""
+    assert query_count(client.post('/calculate', json={'selected_list': SMALL_RECIPE})) == 0
+    assert query_count(client.post('/calculate', json={'selected_list': large_recipe(dogfood)})) == 0
+
+
+def test_adjust_get_does_not_query(dogfood, client):
+    """GET /adjust (保存済みのレシピ・初回のデフォルトのレシピとも) は SQL を実行しない"""
+    assert query_count(client.get('/adjust')) == 0
+    client.post('/adjust', json={'selected_ingredients': large_recipe(dogfood)})
+    assert query_count(client.get('/adjust')) == 0
+    # 2回目はレシピと一緒に保持した計算結果を使う
+    assert query_count(client.get('/adjust')) == 0
+
+
+def test_calculate_nutrients_does_not_query(dogfood, client):
+    for recipe in (SMALL_RECIPE, large_recipe(dogfood)):
+        response = client.post('/calculate-nutrients', json={'selected_ingredients': recipe})
+        assert query_count(response) == 0
+        assert response.json['nutrient_totals']['ENERC_KCAL'] > 0
@@ -0,0 +1,80 @@
+from nutrient_engine import NutrientMatrix
+from recipe_delta import apply_changes, changed_fields
+from standards import StandardsProfile
+
+
+NUTRIENTS = ['ENERC_KCAL', 'WATER', 'P', 'NAT', 'CA']
+
+# 食品番号 1: 高エネルギー, 2: リンとナトリウムが多い, 3: 水
+MATRIX = NutrientMatrix.from_rows([
+    (1, 'energy', 400.0, 0.0, 0.1, 0.0, 0.0),
+    (2, 'mineral', 0.0, 0.0, 1.0, 1.0, 1.0),
+    (3, 'water', 0.0, 100.0, 0.0, 0.0, 0.0),
+], NUTRIENTS)
+
+
+def delta(profile, recipe, changes):
+    rows, grams, _, _ = MATRIX.resolve(recipe)
+    before = MATRIX.totals_vector(rows, grams)
+    after_recipe, after, touched = apply_changes(MATRIX, recipe, before, changes)
+    grams_before = sum(item['grams'] for item in recipe)
+    grams_after = sum(item['grams'] for item in after_recipe)
+    result = changed_fields(MATRIX, before, after, touched, profile, grams_before, grams_after)
+
+    # 差分の判定は、変更後のレシピ全体を判定した結果と食い違わない
+    symbols = profile.assess(after, grams_after)["result_symbols"]
+    assert all(symbols[nutrient] == symbol for nutrient, symbol in result["result_symbols"].items())
+    return result
+
+
+def test_changed_fields_reports_new_excess():
+    profile = StandardsProfile('test', NUTRIENTS, {'NAT': 0.5}, maximums={'NAT': 1.5})
+    recipe = [{'food_code': 2, 'grams': 100}]
+    result = delta(profile, recipe, [{'op': 'set', 'food_code': 2, 'old_grams': 100, 'new_grams': 200}])
+    assert result["nutrient_totals"] == {'NAT': 2.0}
+    assert result["result_symbols"] == {'NAT': '×'}
+    assert result["excesses_added"] == ['NAT'] and result["deficiencies_added"] == []
+
+    result = delta(profile, [{'food_code': 2, 'grams': 200}],
+                   [{'op': 'set', 'food_code': 2, 'old_grams': 200, 'new_grams': 100}])
+    assert result["result_symbols"] == {'NAT': '○'}
+    assert result["excesses_removed"] == ['NAT']
+
+
+def test_changed_fields_per_1000kcal_follows_energy():
+    """1000kcal あたりの基準は、その栄養素の合計が変わらなくてもエネルギーが増えれば不足になる"""
+    profile = StandardsProfile('test', NUTRIENTS, {'CA': 5.0}, bases={'CA': 'per_1000kcal'})
+    recipe = [{'food_code': 1, 'grams': 100}, {'food_code': 2, 'grams': 300}]
+    # 3mg / 400kcal = 7.5mg/1000kcal → 3mg / 800kcal = 3.75mg/1000kcal
+    result = delta(profile, recipe, [{'op': 'set', 'food_code': 1, 'old_grams': 100, 'new_grams': 200}])
+    assert result["nutrient_totals"] == {}
+    assert result["result_symbols"] == {'CA': '×'}
+    assert result["deficiencies_added"] == ['CA']
+
+
+def test_changed_fields_dry_matter_follows_water():
+    """乾物あたりの基準は、水を足して乾物量が変わらなければ判定も変わらない"""
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 0.5}, maximums={'P': 0.9}, bases={'P': 'dry_matter'})
+    recipe = [{'food_code': 2, 'grams': 100}]
+    result = delta(profile, recipe, [{'op': 'add', 'food_code': 3, 'grams': 100}])
+    assert result["result_symbols"] == {}
+
+    # リンを含まない高エネルギー食材を足すと、乾物あたりのリンが上限内に下がる (1.0 → 0.7)
+    result = delta(profile, recipe, [{'op': 'add', 'food_code': 1, 'grams': 50}])
+    assert result["result_symbols"] == {'P': '○'}
+    assert result["excesses_removed"] == ['P']
+    assert result["nutrient_totals"] == {'P': 1.05}
+
+
+def test_adjust_delta_uses_default_profile(dogfood, client):
+    recipe = [{'food_code': item['food_code'], 'grams': 1, 'name': item['name']}
+              for item in dogfood.nutrient_matrix.catalog()[:2]]
+    version = client.post('/adjust', json={'selected_ingredients': recipe}).json['version']
+    change = {'op': 'set', 'food_code': recipe[0]['food_code'], 'old_grams': 1, 'new_grams': 500}
+    response = client.post('/adjust/delta', json={'version': version, 'changes': [change]}).json
+
+    recipe[0]['grams'] = 500
+    full = client.post('/calculate-nutrients', json={'selected_ingredients': recipe}).json
+    for nutrient, symbol in response['result_symbols'].items():
+        assert full['result_symbols'][nutrient] == symbol
+    assert set(response) >= {'excesses_added', 'excesses_removed', 'deficiencies_added', 'deficiencies_removed'}
@@ -0,0 +1,124 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+from nutrient_engine import NutrientMatrix
+from recipe_search import RecipeSearch, _search_shard
+from standards import StandardsProfile
+
+
+NUTRIENTS = ['P', 'CA', 'NAT']
+
+MATRIX = NutrientMatrix.from_rows([
+    (1, 'phosphorus', 1.0, 0.0, 0.0),
+    (2, 'calcium', 0.0, 1.0, 0.0),
+    (3, 'both', 0.5, 0.5, 0.0001),
+], NUTRIENTS)
+
+
+def test_search_flags_uncoverable_nutrients():
+    """どの候補でも基準値に届かない NAT は条件から外し、見つかったレシピの判定で不足として返す"""
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 1.0, 'CA': 1.0, 'NAT': 1.0}, maximums={'CA': 1.5})
+    search = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, max_grams=300, workers=1)
+    assert search.uncoverable == ['NAT']
+
+    recipes = list(search.run())
+    assert recipes and search.stats["uncoverable"] == ['NAT']
+    for recipe in recipes:
+        assert recipe["deficiencies"] == ['NAT']
+        assert recipe["result_symbols"]['NAT'] == '×'
+        assert recipe["result_symbols"]['P'] == '○'
+        assert recipe["nutrient_totals"]['P'] >= 1.0 and recipe["nutrient_totals"]['CA'] >= 1.0
+        # 探索は最小値だけを条件にするので、上限超過は判定結果で知らせる
+        assert (recipe["nutrient_totals"]['CA'] > 1.5) == ('CA' in recipe["excesses"])
+
+
+def test_search_endpoint_reports_uncoverable_up_front(dogfood, client):
+    pool = [item['food_code'] for item in dogfood.nutrient_matrix.catalog()[:3]]
+    response = client.post('/recipes/search', json={
+        'pool': pool, 'min_ingredients': 1, 'max_ingredients': 2, 'max_grams': 500, 'time_budget': 5,
+    })
+    assert response.status_code == 200
+    uncoverable = response.headers['X-Uncoverable-Nutrients']
+    lines = [json.loads(line) for line in response.data.splitlines()]
+    assert lines[-1]["done"] is True
+    assert uncoverable == ','.join(lines[-1]["uncoverable"])
+    assert uncoverable
+    for recipe in lines[:-1]:
+        assert set(uncoverable.split(',')) <= set(recipe["deficiencies"])
+
+
+def test_search_endpoint_rejects_unbounded_time_budget(client):
+    """0・負・NaN・inf の time_budget で RECIPE_SEARCH_MAX_SECONDS の上限を外せない"""
+    for time_budget in (0, -1, 'NaN', 'inf'):
+        response = client.post('/recipes/search', json={'pool': [1001], 'time_budget': time_budget})
+        assert response.status_code == 400, time_budget
+
+
+def test_search_time_budget_is_a_deadline():
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 1.0, 'CA': 1.0})
+    for time_budget in (0, float('nan')):
+        with pytest.raises(ValueError):
+            RecipeSearch(MATRIX, [1, 2, 3], profile, time_budget=time_budget)
+
+    search = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, time_budget=1e-9, workers=1)
+    list(search.run())
+    assert search.stats["timed_out"]
+
+
+def test_search_shard_stops_when_flag_is_set():
+    """件数に達した・クライアントが切断した後は、実行中のシャードも停止フラグで打ち切る"""
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 1.0, 'CA': 1.0})
+    search = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, workers=1)
+    stop = threading.Event()
+    stop.set()
+    results = queue.Queue()
+    prefixes = [prefix for shard in search._shards() for prefix in shard]
+    stats = _search_shard((search.coverage, search.sizes, search.max_grams), prefixes, None, None, stop, results)
+    assert results.empty() and stats["visited"] == 0
+
+
+def test_search_streams_each_recipe_before_the_shard_ends(monkeypatch):
+    """見つかったレシピはシャードの完了を待たずに返す"""
+    import recipe_search
+
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 1.0, 'CA': 1.0})
+    search = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, workers=1)
+    released = threading.Event()
+    solve = recipe_search._solve
+    solved = []
+
+    def blocking_solve(*args):
+        # 1 件見つかった後は、テストが受け取るまでシャードを進めない
+        if solved:
+            released.wait(10)
+        grams = solve(*args)
+        if grams is not None:
+            solved.append(grams)
+        return grams
+
+    monkeypatch.setattr(recipe_search, '_solve', blocking_solve)
+    started = time.time()
+    recipes = search.run()
+    assert next(recipes)["ingredients"]
+    assert time.time() - started < 5
+    released.set()
+    recipes.close()
+
+
+def test_search_pool_stops_running_shards():
+    profile = StandardsProfile('test', NUTRIENTS, {'P': 1.0, 'CA': 1.0})
+    inline = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, workers=1)
+    pooled = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, workers=2)
+    key = lambda recipe: [item['food_code'] for item in recipe["ingredients"]]
+    assert sorted(map(key, pooled.run())) == sorted(map(key, inline.run()))
+
+    # 1 件目で打ち切ったら、残りのシャードが time_budget を使い切らずに終わる
+    pooled = RecipeSearch(MATRIX, [1, 2, 3], profile, min_size=1, max_size=2, max_results=1,
+                          time_budget=30, workers=2)
+    started = time.time()
+    assert len(list(pooled.run())) == 1
+    assert time.time() - started < 10
@@ -0,0 +1,57 @@
+import pytest
+
+from recipe_store import RecipeStore, VersionConflict
+
+
+RECIPE = [{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 50}]
+
+
+def test_store_shares_recipes_between_instances(tmp_path):
+    """同じ SQLite を使う別のインスタンス (gunicorn の別ワーカー) から保存したレシピを読める"""
+    db_path = str(tmp_path / 'recipes.db')
+    worker1, worker2 = RecipeStore(db_path=db_path), RecipeStore(db_path=db_path)
+
+    worker1.put('recipe', RECIPE)
+    entry = worker2.get('recipe')
+    assert entry.selected_list == RECIPE and entry.version == 1
+
+    # 別のワーカーでの更新も反映される
+    worker2.put('recipe', RECIPE[:1], expected_version=1)
+    entry = worker1.get('recipe')
+    assert entry.selected_list == RECIPE[:1] and entry.version == 2
+
+
+def test_store_detects_conflicts_between_instances(tmp_path):
+    db_path = str(tmp_path / 'recipes.db')
+    worker1, worker2 = RecipeStore(db_path=db_path), RecipeStore(db_path=db_path)
+    worker1.put('recipe', RECIPE)
+    worker1.get('recipe')
+
+    worker2.put('recipe', RECIPE[:1], expected_version=1)
+    # worker1 のプロセス内の version (1) は古いので、SQLite の version (2) と比べて衝突を検出する
+    with pytest.raises(VersionConflict):
+        worker1.put('recipe', RECIPE, expected_version=1)
+    assert worker1.get('recipe').selected_list == RECIPE[:1]
+
+
+def test_store_without_db_path_is_per_process():
+    worker1, worker2 = RecipeStore(), RecipeStore()
+    worker1.put('recipe', RECIPE)
+    assert worker1.get('recipe').version == 1
+    assert worker2.get('recipe') is None
+
+
+def test_app_reads_recipe_saved_by_another_worker(dogfood, client, monkeypatch):
+    """POST /adjust を受けたワーカーと別のワーカーが、GET /adjust と /calculate/suggestions を処理する"""
+    assert dogfood.recipe_store.db_path
+    item = dogfood.nutrient_matrix.catalog()[-1]
+    recipe = [{'food_code': item['food_code'], 'grams': 123, 'name': item['name']}]
+    assert client.post('/adjust', json={'selected_ingredients': recipe}).json['version'] == 1
+
+    monkeypatch.setattr(dogfood, 'recipe_store', RecipeStore(db_path=dogfood.recipe_store.db_path))
+    response = client.get('/adjust')
+    assert response.status_code == 200
+    # デフォルトの食材で作り直さず (version 1 のまま)、保存したレシピを表示する
+    assert b'let recipeVersion = 1;' in response.data
+    assert str(item['food_code']).encode() in response.data
+    assert client.get('/calculate/suggestions').status_code == 200
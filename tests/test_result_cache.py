@@ -0,0 +1,82 @@
+from result_cache import ResultCache, recipe_key
+
+
+def counting(value):
+    """呼ばれた回数を calls に数える compute 関数を返す"""
+    def compute():
+        compute.calls += 1
+        return value
+    compute.calls = 0
+    return compute
+
+
+def test_cache_hits_until_version_changes():
+    cache = ResultCache()
+    compute = counting('result')
+    assert cache.get_or_compute('key', 1, compute) == 'result'
+    assert cache.get_or_compute('key', 1, compute) == 'result'
+    assert compute.calls == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+    # データのバージョンが変わったら全件を破棄して計算し直す
+    cache.get_or_compute('other', 1, counting('other'))
+    assert cache.get_or_compute('key', 2, compute) == 'result'
+    assert compute.calls == 2
+    assert len(cache) == 1
+
+
+def test_cache_expires_and_evicts():
+    cache = ResultCache(max_entries=2, ttl=0)
+    compute = counting('result')
+    cache.get_or_compute('key', 1, compute)
+    cache.get_or_compute('key', 1, compute)
+    assert compute.calls == 2
+
+    cache = ResultCache(max_entries=2)
+    computes = {key: counting(key) for key in 'abc'}
+    for key in 'abac':
+        cache.get_or_compute(key, 1, computes[key])
+    # 最も長く使われていない b が追い出され、a と c は残る
+    cache.get_or_compute('a', 1, computes['a'])
+    cache.get_or_compute('c', 1, computes['c'])
+    cache.get_or_compute('b', 1, computes['b'])
+    assert (computes['a'].calls, computes['b'].calls, computes['c'].calls) == (1, 2, 1)
+
+
+def test_cache_clear():
+    cache = ResultCache()
+    compute = counting('result')
+    cache.get_or_compute('key', 1, compute)
+    cache.clear()
+    cache.get_or_compute('key', 1, compute)
+    assert compute.calls == 2
+
+
+def test_recipe_key_ignores_order_and_types():
+    recipe = [{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 50.0}]
+    same = [{'food_code': '1002', 'grams': '50'}, {'food_code': '1001', 'grams': 100.0, 'name': 'x'}]
+    assert recipe_key(recipe) == recipe_key(same)
+    assert recipe_key(recipe) != recipe_key([{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 51}])
+
+
+def test_app_cache_is_invalidated_by_data_version(dogfood, monkeypatch):
+    """データのバージョンが変わったら、同じレシピでも計算し直す"""
+    recipe = [{'food_code': 1001, 'grams': 100}, {'food_code': 1002, 'grams': 50}]
+    dogfood.result_cache.clear()
+    with dogfood.app.test_request_context():
+        first = dogfood.cached_nutrient_totals(recipe)
+        assert dogfood.cached_nutrient_totals(recipe) is first
+
+        version = dogfood.data_version()
+        monkeypatch.setattr(dogfood, 'data_version', lambda: version + ('changed',))
+        second = dogfood.cached_nutrient_totals(recipe)
+        assert second is not first and second == first
+
+
+def test_app_cache_is_cleared_when_data_is_installed(dogfood):
+    recipe = [{'food_code': 1001, 'grams': 100}]
+    with dogfood.app.test_request_context():
+        dogfood.cached_nutrient_totals(recipe)
+        assert len(dogfood.result_cache) > 0
+        dogfood.on_data_installed(dogfood.current_data())
+        assert len(dogfood.result_cache) == 0
@@ -0,0 +1,48 @@
+import numpy as np
+
+from nutrient_engine import significant, significant_array
+from standards import StandardsProfile
+
+
+NUTRIENTS = ['ENERC_KCAL', 'WATER', 'LYS', 'NAT']
+
+
+def make_profile():
+    return StandardsProfile('test', NUTRIENTS, {'LYS': 0.63, 'NAT': 0.08}, maximums={'NAT': 0.6})
+
+
+def test_significant_array_matches_significant():
+    """配列版は1件ずつの significant と同じ値に丸める"""
+    rng = np.random.default_rng(0)
+    values = np.concatenate([
+        rng.uniform(-1, 1, 2000) * 10.0 ** rng.integers(-12, 8, 2000),
+        [0.0, np.inf, -np.inf, 0.63, 0.6799999999999999, 1e-7],
+    ])
+    assert significant_array(values).tolist() == [
+        significant(value) if np.isfinite(value) else value for value in values.tolist()
+    ]
+
+
+def test_total_displayed_equal_to_minimum_is_not_deficient():
+    """float32 の合計が基準値よりわずかに小さくても、表示 (有効数字7桁) が同じなら不足にしない"""
+    profile = make_profile()
+    # 0.63 を float32 の食材データから計算すると 0.6299999952316284 になる
+    lys = float(np.float32(0.63))
+    assert lys < 0.63 and significant(lys) == 0.63
+    _, below, above = profile.evaluate(np.array([0.0, 0.0, lys, 0.1]))
+    assert not below.any() and not above.any()
+    assert profile.assess(np.array([0.0, 0.0, lys, 0.1]))["deficiencies"] == []
+
+
+def test_boundary_uses_seven_significant_digits():
+    """7桁目で基準値を下回る・上回る値は不足・超過と判定する"""
+    profile = make_profile()
+    totals = np.array([
+        [0.0, 0.0, 0.629999, 0.1],        # LYS 不足
+        [0.0, 0.0, 0.63, 0.6000001],      # NAT 超過
+        [0.0, 0.0, 0.63, 0.60000004],     # 丸めると上限と同じなので超過ではない
+    ])
+    _, below, above = profile.evaluate(totals)
+    lys, nat = NUTRIENTS.index('LYS'), NUTRIENTS.index('NAT')
+    assert below[:, lys].tolist() == [True, False, False]
+    assert above[:, nat].tolist() == [False, True, False]
@@ -0,0 +1,158 @@
+import numpy as np
+
+from nutrient_engine import significant
+
+
+def _grams_by_row(matrix, selected_list):
+    """レシピを {行番号: グラム数} にする (同じ食材は合計する)"""
+    rows, grams, _, missing = matrix.resolve(selected_list)
+    if missing:
+        raise ValueError(f"food_code {missing[0]} not found")
+    base = {}
+    for row, value in zip(rows.tolist(), grams.tolist()):
+        base[row] = base.get(row, 0.0) + value
+    return base
+
+
+def _variant_delta(matrix, base, changes):
+    """
+    1つの候補の変更を適用し、変わった食材の {行番号: グラム数の差} を返す。
+    変更は次の形式のリスト:
+      {"op": "set", "food_code", "grams"}       グラム数を変更 (レシピに無ければ追加)
+      {"op": "add", "food_code", "grams"}       グラム数を加える (レシピに無ければ追加)
+      {"op": "remove", "food_code"}             削除
+      {"op": "swap", "food_code", "new_food_code", "grams"}  食材を置き換える (grams 省略時は元のグラム数)
+      {"op": "scale", "factor", "food_code"}    グラム数を factor 倍 (food_code 省略時はレシピ全体)
+    """
+    grams = {}
+
+    def current(row):
+        return grams.get(row, base.get(row, 0.0))
+
+    def row_of(food_code):
+        row = matrix.row_of(food_code)
+        if row is None:
+            raise ValueError(f"food_code {food_code} not found")
+        return row
+
+    def in_recipe(row, food_code):
+        if current(row) <= 0:
+            raise ValueError(f"food_code {food_code} is not in the recipe")
+
+    for change in changes:
+        op = change.get('op', 'set')
+        if op == 'scale':
+            factor = float(change.get('factor', 1))
+            if factor < 0:
+                raise ValueError("factor must not be negative")
+            if change.get('food_code') is None:
+                targets = set(base) | set(grams)
+            else:
+                targets = [row_of(change['food_code'])]
+                in_recipe(targets[0], change['food_code'])
+            for row in targets:
+                grams[row] = current(row) * factor
+            continue
+
+        row = row_of(change.get('food_code'))
+        if op in ('set', 'add'):
+            value = float(change.get('grams', 100))
+            if value < 0:
+                raise ValueError("grams must not be negative")
+            grams[row] = value if op == 'set' else current(row) + value
+        elif op == 'remove':
+            in_recipe(row, change['food_code'])
+            grams[row] = 0.0
+        elif op == 'swap':
+            in_recipe(row, change['food_code'])
+            new_row = row_of(change.get('new_food_code'))
+            value = float(change.get('grams', current(row)))
+            if value < 0:
+                raise ValueError("grams must not be negative")
+            grams[row] = 0.0
+            grams[new_row] = current(new_row) + value
+        else:
+            raise ValueError(f"unknown op: {op}")
+
+    return {row: value - base.get(row, 0.0) for row, value in grams.items() if value != base.get(row, 0.0)}
+
+
+def compare_variants(matrix, selected_list, variants, profile):
+    """
+    基準のレシピ (selected_list) に対する多数の候補 (variants) を一括で評価する。
+
+    基準の合計は1回だけ計算し、候補ごとの合計は「変わった食材のグラム数の差 × 栄養素行列」を
+    基準の合計に足すだけにする (候補 × 食材の疎な差分行列と行列の積1回)。
+    基準値との比較も全候補をまとめて1回で行う。
+    候補は {"id", "changes": [...]} (changes の形式は _variant_delta を参照) で、
+    不足を解消した栄養素の数が多い順 (同数なら新たに不足した栄養素が少ない順) に並べて返す。
+    """
+    base = _grams_by_row(matrix, selected_list)
+    base_rows = np.array(list(base), dtype=np.intp)
+    base_grams = np.array(list(base.values()), dtype=np.float64)
+    base_totals = matrix.totals_vector(base_rows, base_grams)
+
+    # 候補ごとのグラム数の差を CSR 形式 (indptr, indices, grams) にまとめる
+    indptr = [0]
+    indices = []
+    deltas = []
+    for i, variant in enumerate(variants):
+        changes = variant.get('changes', [variant]) if isinstance(variant, dict) else variant
+        try:
+            delta = _variant_delta(matrix, base, changes)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"variant {i}: {e}") from e
+        indices.extend(delta)
+        deltas.extend(delta.values())
+        indptr.append(len(indices))
+    indptr = np.array(indptr, dtype=np.intp)
+    deltas = np.array(deltas, dtype=np.float64)
+
+    totals_delta = matrix.batch_totals(indptr, np.array(indices, dtype=np.intp), deltas)
+    totals_delta[np.abs(totals_delta) < 1e-9] = 0
+    grams_delta = np.bincount(np.repeat(np.arange(len(variants)), np.diff(indptr)), weights=deltas, minlength=len(variants))
+    total_grams = base_grams.sum() + grams_delta
+
+    # 基準と全候補をまとめて基準値と比較する (不合格 = 最小値未満または最大値超過)
+    columns = profile.columns
+    nutrients = profile.column_nutrients
+    _, below, above = profile.evaluate(
+        np.vstack([base_totals, base_totals + totals_delta]), np.concatenate([[base_grams.sum()], total_grams])
+    )
+    failing = (below | above)[:, columns]
+    base_failing, variant_failing = failing[0], failing[1:]
+    to_pass = base_failing & ~variant_failing
+    to_fail = ~base_failing & variant_failing
+    closed = to_pass.sum(axis=1)
+    opened = to_fail.sum(axis=1)
+
+    deltas_by_nutrient = totals_delta[:, columns]
+    order = np.lexsort((np.arange(len(variants)), opened, -closed))
+    results = []
+    for rank, i in enumerate(order.tolist(), start=1):
+        variant = variants[i]
+        results.append({
+            "id": variant.get('id', i) if isinstance(variant, dict) else i,
+            "rank": rank,
+            "total_grams": round(float(total_grams[i]), 2),
+            "nutrient_deltas": {
+                nutrient: significant(value)
+                for nutrient, value in zip(nutrients, deltas_by_nutrient[i].tolist())
+                if value != 0
+            },
+            "flipped_to_pass": [nutrient for nutrient, flag in zip(nutrients, to_pass[i]) if flag],
+            "flipped_to_fail": [nutrient for nutrient, flag in zip(nutrients, to_fail[i]) if flag],
+            "deficiencies_closed": int(closed[i]),
+            "deficiencies_opened": int(opened[i]),
+            "failing_count": int(variant_failing[i].sum()),
+        })
+
+    return {
+        "base": {
+            "total_grams": round(float(base_grams.sum()), 2),
+            "nutrient_totals": dict(zip(nutrients, map(significant, base_totals[columns].tolist()))),
+            "deficiencies": [nutrient for nutrient, flag in zip(nutrients, below[0, columns]) if flag],
+            "excesses": [nutrient for nutrient, flag in zip(nutrients, above[0, columns]) if flag],
+        },
+        "variants": results,
+    }
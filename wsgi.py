@@ -0,0 +1,10 @@
+"""
+本番用の WSGI エントリポイント。
+
+    gunicorn wsgi:app
+
+設定は gunicorn.conf.py を参照。
+"""
+from app import create_app
+
+app = create_app()